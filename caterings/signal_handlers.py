@@ -1,6 +1,10 @@
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from resources.cache import CATERING_ORDERS, bump_cache_version
 from resources.signals import reservation_modified, reservation_cancelled
 
+from .models import CateringOrder
+
 
 @receiver(reservation_modified)
 def handle_reservation_change(sender, instance, user, **kwargs):
@@ -20,3 +24,9 @@ def handle_reservation_cancellation(sender, instance, user, **kwargs):
 
     for order in catering_orders:
         order.send_deleted_notification()
+
+
+@receiver(post_save, sender=CateringOrder, dispatch_uid='catering-orders-save')
+@receiver(post_delete, sender=CateringOrder, dispatch_uid='catering-orders-delete')
+def invalidate_catering_orders(sender, **kwargs):
+    bump_cache_version(CATERING_ORDERS)
@@ -32,6 +32,8 @@ class NotificationType:
     # we don't confuse the user with "new reservation created"-style
     # messaging.
     RESERVATION_ACCESS_CODE_CREATED = 'reservation_access_code_created'
+    # A single summary of all the reservations created at once in a series
+    RESERVATION_SERIES_CREATED = 'reservation_series_created'
     CATERING_ORDER_CREATED = 'catering_order_created'
     CATERING_ORDER_MODIFIED = 'catering_order_modified'
     CATERING_ORDER_DELETED = 'catering_order_deleted'
@@ -54,6 +56,7 @@ class NotificationTemplate(TranslatableModel):
         (NotificationType.RESERVATION_DENIED, _('Reservation denied')),
         (NotificationType.RESERVATION_CREATED_WITH_ACCESS_CODE, _('Reservation created with access code')),
         (NotificationType.RESERVATION_ACCESS_CODE_CREATED, _('Access code was created for a reservation')),
+        (NotificationType.RESERVATION_SERIES_CREATED, _('Reservation series created')),
 
         (NotificationType.CATERING_ORDER_CREATED, _('Catering order created')),
         (NotificationType.CATERING_ORDER_MODIFIED, _('Catering order modified')),
@@ -2,7 +2,7 @@ import logging
 from io import StringIO
 from contextlib import redirect_stdout
 from django.conf.urls import url
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin import site as admin_site
 from django.contrib.admin.utils import unquote
 from django.contrib.auth import get_user_model
@@ -13,12 +13,14 @@ from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 from django import forms
+from django.http import HttpResponseRedirect
 from django.template.response import TemplateResponse
 from guardian import admin as guardian_admin
 from image_cropping import ImageCroppingMixin
 from modeltranslation.admin import TranslationAdmin, TranslationStackedInline
 from .base import ExtraReadonlyFieldsOnUpdateMixin, CommonExcludeMixin, PopulateCreatedAndModifiedMixin
 from resources.admin.period_inline import PeriodInline
+from resources.errors import ReservationCollision
 
 from ..models import (
     Day, Equipment, EquipmentAlias, EquipmentCategory, Purpose, Reservation,
@@ -219,6 +221,16 @@ class ReservationAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin, Extr
     search_fields = ('user__first_name', 'user__last_name', 'user__username', 'user__email')
     raw_id_fields = ('user',)
 
+    def changeform_view(self, request, *args, **kwargs):
+        # The form validation checks the overlaps, but with the overlap
+        # constraint on, a reservation made at the same time is only noticed
+        # when saving.
+        try:
+            return super().changeform_view(request, *args, **kwargs)
+        except ReservationCollision as exc:
+            self.message_user(request, ' '.join(exc.messages), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
 
 class ResourceTypeAdmin(PopulateCreatedAndModifiedMixin, CommonExcludeMixin, TranslationAdmin):
     pass
@@ -2,9 +2,11 @@ from .base import all_views
 from users.api import all_views as users_views
 from .resource import ResourceListViewSet, ResourceViewSet, PurposeViewSet
 from .reservation import ReservationViewSet
+from .reservation_series import ReservationSeriesViewSet
 from .unit import UnitViewSet
 from .search import TypeaheadViewSet
 from .equipment import EquipmentViewSet
+from .free_slot import FreeSlotViewSet
 
 from rest_framework import routers
 
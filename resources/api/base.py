@@ -1,8 +1,22 @@
+import hashlib
+
+import arrow
+from arrow.parser import ParserError
 from django.conf import settings
+from django.db.models import Count, Max, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
 import django_filters
 from modeltranslation.translator import NotRegistered, translator
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
+from rest_framework.renderers import JSONRenderer
+
+from ..auth import is_general_admin
+from ..cache import get_cache_version, is_cache_shared
+from ..pagination import is_stream_requested
 
 all_views = []
 
@@ -17,6 +31,77 @@ def register_view(klass, name, base_name=None):
 LANGUAGES = [x[0] for x in settings.LANGUAGES]
 
 
+def parse_query_time_range(params):
+    times = {}
+    for name in ('start', 'end'):
+        if name not in params:
+            continue
+        try:
+            times[name] = arrow.get(params[name]).to('utc').datetime
+        except ParserError:
+            raise exceptions.ParseError("'%s' must be a timestamp in ISO 8601 format" % name)
+
+    if len(times):
+        if 'start' not in times or 'end' not in times:
+            raise exceptions.ParseError("You must supply both 'start' and 'end'")
+        if times['end'] < times['start']:
+            raise exceptions.ParseError("'end' must be after 'start'")
+
+    return times
+
+
+def get_field_selection(request):
+    """
+    Returns the serializer field selection given in the `fields` and `exclude` query parameters
+
+    The return value can be passed as keyword arguments to a serializer using
+    FieldSelectionSerializerMixin.
+    """
+    selection = {}
+    for param in ('fields', 'exclude'):
+        value = request.query_params.get(param, '')
+        names = [x.strip() for x in value.split(',') if x.strip()]
+        if names:
+            selection[param] = names
+    return selection
+
+
+def is_field_selected(field_selection, field_name):
+    if 'fields' in field_selection and field_name not in field_selection['fields']:
+        return False
+    return field_name not in field_selection.get('exclude', ())
+
+
+class FieldSelectionSerializerMixin:
+    """
+    Lets the user of the serializer leave out fields with the `fields` and `exclude` arguments
+
+    Left out fields are removed from the serializer, so e.g. their
+    SerializerMethodFields are never run.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.field_selection = {}
+        for name in ('fields', 'exclude'):
+            if kwargs.get(name) is not None:
+                self.field_selection[name] = kwargs.pop(name)
+        super().__init__(*args, **kwargs)
+
+        for field_name in list(self.fields):
+            if not self.is_field_selected(field_name):
+                del self.fields[field_name]
+
+    def is_field_selected(self, field_name):
+        return is_field_selected(self.field_selection, field_name)
+
+    def to_representation(self, obj):
+        ret = super().to_representation(obj)
+        # Some fields, like the geometries, are added without being in self.fields
+        for field_name in [x for x in ret if not self.is_field_selected(x)]:
+            del ret[field_name]
+        return ret
+
+
 class TranslatedModelSerializer(serializers.ModelSerializer):
 
     def __init__(self, *args, **kwargs):
@@ -85,3 +170,116 @@ class DRFFilterBooleanWidget(django_filters.widgets.BooleanWidget):
     """
     def render(self, *args, **kwargs):
         return None
+
+
+class ConditionalListMixin:
+    """
+    Answers list requests with 304 Not Modified when the client already has the current data
+
+    The ETag is built from the latest modification time and the row count of
+    the filtered queryset, the cache versions of the other data the response
+    is made of and the permissions of the user. Checking it takes a single
+    aggregate query and no serialization.
+
+    The version bumps of the other processes are not seen when the cache is
+    not shared, so then no ETag is given if the cache versions are needed.
+    """
+    # Names of the cache versions that are bumped when related data changes
+    etag_cache_versions = ()
+    # The filtered queryset of the ETag, reused for the list
+    _etag_queryset = None
+
+    def get_etag_cache_versions(self):
+        return self.etag_cache_versions
+
+    def filter_queryset(self, queryset):
+        if self._etag_queryset is not None:
+            return self._etag_queryset
+        return super().filter_queryset(queryset)
+
+    def get_etag(self, request, aggregates):
+        user = request.user
+        parts = [
+            aggregates['last_modified'], aggregates['count'], request.get_full_path(), request.get_host(),
+            request.accepted_renderer.format, get_language(), timezone.localdate(),
+            user.pk, user.is_staff, user.is_superuser, is_general_admin(user),
+        ]
+        parts += [get_cache_version(name) for name in self.get_etag_cache_versions()]
+        return quote_etag(hashlib.md5(repr(parts).encode('utf8')).hexdigest())
+
+    def list(self, request, *args, **kwargs):
+        if self.get_etag_cache_versions() and not is_cache_shared():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        aggregates = queryset.order_by().aggregate(last_modified=Max('modified_at'), count=Count('pk'))
+        etag = self.get_etag(request, aggregates)
+
+        # Last-Modified does not change when rows are deleted or related
+        # data changes, so only the ETag is used as the validator.
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            self._etag_queryset = queryset
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        if aggregates['last_modified']:
+            response['Last-Modified'] = http_date(aggregates['last_modified'].timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class StreamingListMixin:
+    """
+    Streams JSON list responses when the client asks for it with `?stream=true`
+
+    The rows of the page are read from a server-side cursor and serialized
+    `stream_chunk_size` at a time, so the memory used does not grow with the
+    page size. The serializer gets each chunk as its page, so the per-page
+    caches of the view are filled for the chunk only.
+    """
+    stream_chunk_size = 100
+
+    def should_stream(self, request):
+        if not is_stream_requested(request):
+            return False
+        keyset_pagination_class = getattr(self.paginator, 'keyset_pagination_class', None)
+        if keyset_pagination_class and keyset_pagination_class.cursor_query_param in request.query_params:
+            return False
+        return hasattr(self.paginator, 'paginate_queryset_lazily')
+
+    def list(self, request, *args, **kwargs):
+        if not self.should_stream(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginator.paginate_queryset_lazily(queryset, request, view=self)
+        envelope = self.paginator.get_paginated_response([]).data
+        return StreamingHttpResponse(self._stream_list(page, envelope), content_type='application/json')
+
+    def _get_chunks(self, queryset):
+        # iterator() does not prefetch, so it is done for each chunk instead
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(obj)
+            if len(chunk) == self.stream_chunk_size:
+                prefetch_related_objects(chunk, *queryset._prefetch_related_lookups)
+                yield chunk
+                chunk = []
+        if chunk:
+            prefetch_related_objects(chunk, *queryset._prefetch_related_lookups)
+            yield chunk
+
+    def _stream_list(self, queryset, envelope):
+        renderer = JSONRenderer()
+        # The results are the last item of the envelope, so the rows go
+        # between its brackets.
+        head = renderer.render(envelope)
+        assert head.endswith(b'[]}')
+        yield head[:-2]
+
+        separator = b''
+        for chunk in self._get_chunks(queryset):
+            data = renderer.render(self.get_serializer(chunk, many=True).data)
+            yield separator + data[1:-1]
+            separator = b','
+        yield b']}'
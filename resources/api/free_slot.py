@@ -0,0 +1,206 @@
+import datetime
+from collections import namedtuple
+
+import pytz
+from django.conf import settings
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+from psycopg2.extras import DateTimeTZRange
+from rest_framework import exceptions, serializers, viewsets
+from rest_framework.response import Response
+
+from resources.models import Resource, ResourceDailyFreeTime, ResourceDailyOpeningHours
+
+from .base import parse_query_time_range, register_view
+from .resource import RangeLower, RangeUpper, ResourceFilterBackend
+
+# Limits for the amount of work a single request can cause
+MAX_FREE_SLOT_SEARCH_DAYS = 31
+DEFAULT_FREE_SLOT_LIMIT = 50
+MAX_FREE_SLOT_LIMIT = 500
+
+
+class FreeSlotSerializer(serializers.Serializer):
+    resource = serializers.CharField(source='resource_id')
+    begin = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+
+def _parse_positive_int(params, name):
+    try:
+        value = int(params[name])
+        if value <= 0:
+            raise ValueError()
+    except ValueError:
+        raise exceptions.ParseError("'%s' must be a positive integer" % name)
+    return value
+
+
+def _parse_time_of_day(params, name):
+    try:
+        return datetime.datetime.strptime(params[name], '%H:%M').time()
+    except ValueError:
+        raise exceptions.ParseError("'%s' must be a time of day in the format HH:MM" % name)
+
+
+def _clip_to_time_of_day(begin, end, tz, window_start, window_end):
+    """
+    Returns the parts of the given interval that are within the daily window, in the given time zone
+    """
+    date = begin.astimezone(tz).date()
+    last_date = end.astimezone(tz).date()
+    while date <= last_date:
+        part_begin = max(begin, tz.localize(datetime.datetime.combine(date, window_start)))
+        part_end = min(end, tz.localize(datetime.datetime.combine(date, window_end)))
+        if part_begin < part_end:
+            yield part_begin, part_end
+        date += datetime.timedelta(days=1)
+
+
+def _align_to_slots(begin, end, opens, slot_size):
+    """
+    Returns the part of the given interval that begins and ends at the time slots starting from opens
+    """
+    if slot_size:
+        begin = opens + -((opens - begin) // slot_size) * slot_size
+        end = opens + ((end - opens) // slot_size) * slot_size
+    return begin, end
+
+
+FreeSlot = namedtuple('FreeSlot', ('resource_id', 'begin', 'end'))
+
+
+class FreeSlotViewSet(viewsets.GenericViewSet):
+    """
+    Find free time across all the resources matching the resource filters.
+
+    `start` and `end` give the range to search and `duration` the length of
+    the wanted reservation in minutes. The optional `start_time` and
+    `end_time` limit the results to a window of each day (HH:MM, in the
+    time zone of the resource).
+
+    The result is a list of stretches of free time where the reservation
+    would fit. Only the future times within the range the resource can be
+    reserved in advance are included, and the stretches begin and end at
+    the time slots of the resource. The earliest ones come first, and of
+    the ones that start at the same time, the shortest, ie. the best
+    fitting, ones.
+    """
+    queryset = Resource.objects.filter(reservable=True)
+    filter_backends = (ResourceFilterBackend,)
+    serializer_class = FreeSlotSerializer
+
+    def get_queryset(self):
+        return self.queryset.visible_for(self.request.user)
+
+    def _parse_params(self):
+        params = self.request.query_params
+
+        times = parse_query_time_range(params)
+        if not times:
+            raise exceptions.ParseError("You must supply both 'start' and 'end'")
+        if times['end'] - times['start'] > datetime.timedelta(days=MAX_FREE_SLOT_SEARCH_DAYS):
+            raise exceptions.ParseError("'start' and 'end' can be at most %d days apart" % MAX_FREE_SLOT_SEARCH_DAYS)
+
+        if 'duration' not in params:
+            raise exceptions.ParseError("You must supply 'duration'")
+        duration = datetime.timedelta(minutes=_parse_positive_int(params, 'duration'))
+
+        window = None
+        if 'start_time' in params or 'end_time' in params:
+            if 'start_time' not in params or 'end_time' not in params:
+                raise exceptions.ParseError("You must supply both 'start_time' and 'end_time'")
+            window = (_parse_time_of_day(params, 'start_time'), _parse_time_of_day(params, 'end_time'))
+            if window[1] <= window[0]:
+                raise exceptions.ParseError("'end_time' must be after 'start_time'")
+
+        limit = DEFAULT_FREE_SLOT_LIMIT
+        if 'limit' in params:
+            limit = min(_parse_positive_int(params, 'limit'), MAX_FREE_SLOT_LIMIT)
+
+        return times['start'], times['end'], duration, window, limit
+
+    def _get_resource_limits(self, resource_ids):
+        """
+        Returns the earliest and latest reservable time and the slot size by resource id
+        """
+        now = timezone.now()
+        limits = {}
+        for resource in Resource.objects.filter(id__in=resource_ids).select_related('unit'):
+            reservable_after = resource.get_reservable_after()
+            limits[resource.id] = (
+                max(now, reservable_after) if reservable_after else now,
+                resource.get_reservable_before(),
+                resource.slot_size,
+            )
+        return limits
+
+    def _get_opening_times(self, resource_ids, start, end):
+        """
+        Returns the opening hours overlapping the range as (opens, closes) lists by resource id
+        """
+        opening_times = {}
+        hours = ResourceDailyOpeningHours.objects.filter(
+            resource__in=resource_ids, open_between__overlap=DateTimeTZRange(start, end, '[)')
+        ).values_list('resource_id', 'open_between')
+        for resource_id, open_between in hours:
+            opening_times.setdefault(resource_id, []).append((open_between.lower, open_between.upper))
+        return opening_times
+
+    def get_free_slots(self, start, end, duration, window):
+        start = max(start, timezone.now())
+        if start >= end:
+            return []
+        resources = self.filter_queryset(self.get_queryset()).filter(
+            Q(max_period__isnull=True) | Q(max_period__gte=duration), min_period__lte=duration
+        )
+        # The free time is maintained on reservation and opening hours changes,
+        # so it only needs to be clipped to the searched range here.
+        free_time = ResourceDailyFreeTime.objects.filter(
+            resource__in=resources.order_by().values('id'),
+            free_between__overlap=DateTimeTZRange(start, end, '[)'),
+        ).annotate(
+            free_begin=Greatest(RangeLower('free_between'), Value(start, output_field=DateTimeField())),
+            free_end=Least(RangeUpper('free_between'), Value(end, output_field=DateTimeField())),
+        ).annotate(
+            free_length=ExpressionWrapper(F('free_end') - F('free_begin'), output_field=DurationField())
+        ).filter(free_length__gte=duration)
+        free_time = list(free_time.values_list('resource_id', 'resource__unit__time_zone', 'free_begin', 'free_end'))
+
+        # The time slots of a day start from the opening time, like in the
+        # validation of the reservations.
+        resource_ids = {resource_id for resource_id, time_zone, begin, end in free_time}
+        limits = self._get_resource_limits(resource_ids)
+        opening_times = self._get_opening_times(resource_ids, start, end)
+
+        slots = []
+        for resource_id, time_zone, begin, end in free_time:
+            reservable_after, reservable_before, slot_size = limits[resource_id]
+            begin = max(begin, reservable_after)
+            if reservable_before:
+                end = min(end, reservable_before)
+            if window:
+                tz = pytz.timezone(time_zone or settings.TIME_ZONE)
+                parts = _clip_to_time_of_day(begin, end, tz, *window)
+            else:
+                parts = [(begin, end)]
+
+            opens = next((opens for opens, closes in opening_times.get(resource_id, []) if opens <= begin < closes),
+                         begin)
+            for part_begin, part_end in parts:
+                part_begin, part_end = _align_to_slots(part_begin, part_end, opens, slot_size)
+                if part_end - part_begin >= duration:
+                    slots.append(FreeSlot(resource_id, part_begin, part_end))
+
+        slots.sort(key=lambda slot: (slot.begin, slot.end - slot.begin, slot.resource_id))
+        return slots
+
+    def list(self, request, *args, **kwargs):
+        start, end, duration, window, limit = self._parse_params()
+        slots = self.get_free_slots(start, end, duration, window)
+        serializer = self.get_serializer(slots[:limit], many=True)
+        return Response({'count': len(slots), 'results': serializer.data})
+
+
+register_view(FreeSlotViewSet, 'free_slot', base_name='free_slot')
@@ -1,8 +1,10 @@
 import uuid
+from contextlib import contextmanager
+
 import arrow
 import django_filters
 from arrow.parser import ParserError
-from guardian.core import ObjectPermissionChecker
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import (
@@ -19,14 +21,20 @@ from rest_framework.exceptions import NotAcceptable, ValidationError
 from rest_framework.settings import api_settings as drf_settings
 
 from munigeo import api as munigeo_api
-from resources.models import Reservation, Resource, ReservationMetadataSet
+from resources.models import Reservation, Resource, ReservationMetadataSet, ReservationValidationContext
 from resources.models.reservation import RESERVATION_EXTRA_FIELDS
+from resources.models.resource_permission import preload_effective_permissions
+from resources.cache import (
+    CATERING_ORDERS, PERMISSIONS, RESERVATION_METADATA_SETS, RESOURCE_REPRESENTATION, get_catalog
+)
 from resources.pagination import ReservationPagination
 from resources.models.utils import generate_reservation_xlsx, get_object_or_none
 
 from ..auth import is_general_admin
+from ..errors import ReservationCollision
 from .base import (
-    NullableDateTimeField, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget
+    ConditionalListMixin, FieldSelectionSerializerMixin, NullableDateTimeField, StreamingListMixin,
+    TranslatedModelSerializer, register_view, DRFFilterBooleanWidget, get_field_selection
 )
 
 User = get_user_model()
@@ -40,6 +48,44 @@ except Exception:
     pass
 
 
+def _load_reservation_metadata_sets():
+    set_list = ReservationMetadataSet.objects.all().prefetch_related('supported_fields', 'required_fields')
+    return {x.id: x for x in set_list}
+
+
+def get_reservation_metadata_set_cache():
+    return get_catalog(RESERVATION_METADATA_SETS, _load_reservation_metadata_sets)
+
+
+@contextmanager
+def convert_reservation_collision():
+    """
+    Turns a collision found when saving a reservation into the error the validation gives
+    """
+    try:
+        yield
+    except ReservationCollision as exc:
+        raise ValidationError({drf_settings.NON_FIELD_ERRORS_KEY: exc.messages})
+
+
+def validate_reservable_time(resource, begin, end, validation_context):
+    """
+    Check that the reservation is in the future and within the time the resource can be reserved in advance
+    """
+    if end < timezone.now():
+        raise ValidationError(_('You cannot make a reservation in the past'))
+
+    if not validation_context.is_admin:
+        reservable_before = resource.get_reservable_before()
+        if reservable_before and begin >= reservable_before:
+            raise ValidationError(_('The resource is reservable only before %(datetime)s' %
+                                    {'datetime': reservable_before}))
+        reservable_after = resource.get_reservable_after()
+        if reservable_after and begin < reservable_after:
+            raise ValidationError(_('The resource is reservable only after %(datetime)s' %
+                                    {'datetime': reservable_after}))
+
+
 class UserSerializer(TranslatedModelSerializer):
     display_name = serializers.ReadOnlyField(source='get_display_name')
     email = serializers.ReadOnlyField()
@@ -63,7 +109,7 @@ class UserSerializer(TranslatedModelSerializer):
         fields = ('id', 'display_name', 'email')
 
 
-class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
+class ReservationSerializer(FieldSelectionSerializerMixin, TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     begin = NullableDateTimeField()
     end = NullableDateTimeField()
     user = UserSerializer(required=False)
@@ -110,10 +156,12 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
             # we don't need to remove a field here if it isn't supported, as it will be read-only and will be more
             # easily removed in to_representation()
             for field_name in supported:
-                self.fields[field_name].read_only = False
+                if field_name in self.fields:
+                    self.fields[field_name].read_only = False
 
             for field_name in required:
-                self.fields[field_name].required = True
+                if field_name in self.fields:
+                    self.fields[field_name].required = True
 
     def validate_state(self, value):
         instance = self.instance
@@ -144,56 +192,29 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
         except KeyError:
             resource = reservation.resource
 
+        # The permissions, the opening hours and the overlapping reservations are loaded
+        # once for all the checks below.
+        validation_context = ReservationValidationContext(
+            resource, request_user, data['begin'], data['end'], original_reservation=reservation
+        )
+
         if not resource.can_make_reservations(request_user):
             raise PermissionDenied(_('You are not allowed to make reservations in this resource.'))
 
-        if data['end'] < timezone.now():
-            raise ValidationError(_('You cannot make a reservation in the past'))
+        validate_reservable_time(resource, data['begin'], data['end'], validation_context)
 
-        is_resource_admin = resource.is_admin(request_user)
-        is_resource_manager = resource.is_manager(request_user)
-
-        if not is_resource_admin:
-            reservable_before = resource.get_reservable_before()
-            if reservable_before and data['begin'] >= reservable_before:
-                raise ValidationError(_('The resource is reservable only before %(datetime)s' %
-                                        {'datetime': reservable_before}))
-            reservable_after = resource.get_reservable_after()
-            if reservable_after and data['begin'] < reservable_after:
-                raise ValidationError(_('The resource is reservable only after %(datetime)s' %
-                                        {'datetime': reservable_after}))
-
-        # normal users cannot make reservations for other people
-        if not is_resource_admin:
-            data.pop('user', None)
+        self.validate_reservation_fields(data, resource, request_user)
 
         # Check user specific reservation restrictions relating to given period.
-        resource.validate_reservation_period(reservation, request_user, data=data)
-
-        if data.get('staff_event', False):
-            if not is_resource_manager:
-                raise ValidationError(dict(staff_event=_('Only allowed to be set by resource managers')))
-
-        if 'comments' in data:
-            if not is_resource_admin:
-                raise ValidationError(dict(comments=_('Only allowed to be set by staff members')))
-
-        if 'access_code' in data:
-            if data['access_code'] is None:
-                data['access_code'] = ''
-
-            access_code_enabled = resource.is_access_code_enabled()
-
-            if not access_code_enabled and data['access_code']:
-                raise ValidationError(dict(access_code=_('This field cannot have a value with this resource')))
-
-            if access_code_enabled and reservation and data['access_code'] != reservation.access_code:
-                raise ValidationError(dict(access_code=_('This field cannot be changed')))
+        resource.validate_reservation_period(reservation, request_user, data=data,
+                                             validation_context=validation_context)
 
         # Mark begin of a critical section. Subsequent calls with this same resource will block here until the first
         # request is finished. This is needed so that the validations and possible reservation saving are
         # executed in one block and concurrent requests cannot be validated incorrectly.
-        Resource.objects.select_for_update().get(pk=resource.pk)
+        # With the overlap constraint the database rejects overlapping reservations by itself.
+        if not getattr(settings, 'RESPA_RESERVATION_OVERLAP_CONSTRAINT', False):
+            Resource.objects.select_for_update().get(pk=resource.pk)
 
         # Check maximum number of active reservations per user per resource.
         # Only new reservations are taken into account ie. a normal user can modify an existing reservation
@@ -204,7 +225,7 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
         # Run model clean
         instance = Reservation(**data)
         try:
-            instance.clean(original_reservation=reservation)
+            instance.clean(original_reservation=reservation, validation_context=validation_context)
         except DjangoValidationError as exc:
 
             # Convert Django ValidationError to DRF ValidationError so that in the response
@@ -218,6 +239,38 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
 
         return data
 
+    def validate_reservation_fields(self, data, resource, request_user):
+        """
+        Check the fields that only some users may set, regardless of the time of the reservation
+        """
+        reservation = self.instance
+        is_resource_admin = resource.is_admin(request_user)
+        is_resource_manager = resource.is_manager(request_user)
+
+        # normal users cannot make reservations for other people
+        if not is_resource_admin:
+            data.pop('user', None)
+
+        if data.get('staff_event', False):
+            if not is_resource_manager:
+                raise ValidationError(dict(staff_event=_('Only allowed to be set by resource managers')))
+
+        if 'comments' in data:
+            if not is_resource_admin:
+                raise ValidationError(dict(comments=_('Only allowed to be set by staff members')))
+
+        if 'access_code' in data:
+            if data['access_code'] is None:
+                data['access_code'] = ''
+
+            access_code_enabled = resource.is_access_code_enabled()
+
+            if not access_code_enabled and data['access_code']:
+                raise ValidationError(dict(access_code=_('This field cannot have a value with this resource')))
+
+            if access_code_enabled and reservation and data['access_code'] != reservation.access_code:
+                raise ValidationError(dict(access_code=_('This field cannot be changed')))
+
     def to_internal_value(self, data):
         user_data = data.copy().pop('user', None)  # handle user manually
         deserialized_data = super().to_internal_value(data)
@@ -255,8 +308,8 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
 
         # Show the comments field and the user object only for staff
         if not resource.is_admin(user):
-            del data['comments']
-            del data['user']
+            data.pop('comments', None)
+            data.pop('user', None)
 
         if instance.are_extra_fields_visible(user):
             cache = self.context.get('reservation_metadata_set_cache')
@@ -269,12 +322,12 @@ class ReservationSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSeria
                 data.pop(field_name, None)
 
         if not (resource.is_access_code_enabled() and instance.can_view_access_code(user)):
-            data.pop('access_code')
+            data.pop('access_code', None)
 
         if 'access_code' in data and data['access_code'] == '':
             data['access_code'] = None
 
-        if instance.can_view_catering_orders(user):
+        if self.is_field_selected('has_catering_order') and instance.can_view_catering_orders(user):
             data['has_catering_order'] = instance.catering_orders.exists()
 
         return data
@@ -371,10 +424,8 @@ class ReservationFilterBackend(filters.BaseFilterBackend):
             if not past:
                 now = timezone.now()
                 queryset = queryset.filter(end__gte=now)
-        if times.get('start', None):
-            queryset = queryset.filter(end__gte=times['start'])
-        if times.get('end', None):
-            queryset = queryset.filter(begin__lte=times['end'])
+        if times.get('start', None) or times.get('end', None):
+            queryset = queryset.overlaps(times.get('start', None), times.get('end', None), inclusive=True)
         return queryset
 
 
@@ -480,35 +531,18 @@ class ReservationExcelRenderer(renderers.BaseRenderer):
 
 class ReservationCacheMixin:
     def _preload_permissions(self):
-        units = set()
-        resource_groups = set()
-        resources = set()
-        checker = ObjectPermissionChecker(self.request.user)
-
-        for rv in self._page:
-            resources.add(rv.resource)
-            rv.resource._permission_checker = checker
-
-        for res in resources:
-            units.add(res.unit)
-            for g in res.groups.all():
-                resource_groups.add(g)
-
-        if units:
-            checker.prefetch_perms(units)
-        if resource_groups:
-            checker.prefetch_perms(resource_groups)
+        preload_effective_permissions([rv.resource for rv in self._page], self.request.user)
 
     def _get_cache_context(self):
         context = {}
-        set_list = ReservationMetadataSet.objects.all().prefetch_related('supported_fields', 'required_fields')
-        context['reservation_metadata_set_cache'] = {x.id: x for x in set_list}
+        context['reservation_metadata_set_cache'] = get_reservation_metadata_set_cache()
 
         self._preload_permissions()
         return context
 
 
-class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, ReservationCacheMixin):
+class ReservationViewSet(ConditionalListMixin, StreamingListMixin, munigeo_api.GeoModelAPIView,
+                         viewsets.ModelViewSet, ReservationCacheMixin):
     queryset = Reservation.objects.select_related('user', 'resource', 'resource__unit')\
         .prefetch_related('catering_orders').prefetch_related('resource__groups').order_by('begin', 'resource__unit__name', 'resource__name')
 
@@ -520,6 +554,7 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, ReservationPermission)
     renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer, ReservationExcelRenderer)
     pagination_class = ReservationPagination
+    etag_cache_versions = (RESOURCE_REPRESENTATION, RESERVATION_METADATA_SETS, CATERING_ORDERS, PERMISSIONS)
     authentication_classes = (
         list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) +
         [TokenAuthentication, SessionAuthentication])
@@ -533,6 +568,9 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
                 self._page = [instance_or_page]
             else:
                 self._page = instance_or_page
+            # The Excel export always has the same columns
+            if self.request.accepted_renderer.format != 'xlsx':
+                kwargs.update(get_field_selection(self.request))
 
         return super().get_serializer(*args, **kwargs)
 
@@ -540,6 +578,9 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
         context = super().get_serializer_context(*args, **kwargs)
         if hasattr(self, '_page'):
             context.update(self._get_cache_context())
+        else:
+            # The metadata sets are needed for writes too
+            context['reservation_metadata_set_cache'] = get_reservation_metadata_set_cache()
         return context
 
     def get_queryset(self):
@@ -565,7 +606,8 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
         if 'user' not in serializer.validated_data:
             override_data['user'] = self.request.user
         override_data['state'] = Reservation.CREATED
-        instance = serializer.save(**override_data)
+        with convert_reservation_collision():
+            instance = serializer.save(**override_data)
 
         resource = serializer.validated_data['resource']
         is_resource_manager = resource.is_manager(self.request.user)
@@ -579,8 +621,9 @@ class ReservationViewSet(munigeo_api.GeoModelAPIView, viewsets.ModelViewSet, Res
     def perform_update(self, serializer):
         old_instance = self.get_object()
         new_state = serializer.validated_data.pop('state', old_instance.state)
-        new_instance = serializer.save(modified_by=self.request.user)
-        new_instance.set_state(new_state, self.request.user)
+        with convert_reservation_collision():
+            new_instance = serializer.save(modified_by=self.request.user)
+            new_instance.set_state(new_state, self.request.user)
 
     def perform_destroy(self, instance):
         instance.set_state(Reservation.CANCELLED, self.request.user)
@@ -0,0 +1,258 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import permissions, serializers, status, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from resources.models import Reservation, ReservationValidationContext, Resource
+from resources.models.resource import validate_access_code
+from resources.models.resource_permission import preload_effective_permissions
+
+from .base import register_view
+from .reservation import (
+    ReservationSerializer, ReservationViewSet, convert_reservation_collision, validate_reservable_time
+)
+
+# Limit for the amount of work a single request can cause
+MAX_SERIES_OCCURRENCES = 500
+
+
+class ReservationSeriesTemplateSerializer(ReservationSerializer):
+    """
+    The fields shared by all the reservations of a series
+
+    The times are validated separately for each occurrence, so begin and
+    end are optional here. When given, they are the first occurrence of a
+    recurrence.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['begin'].required = False
+        self.fields['end'].required = False
+
+    def validate(self, data):
+        request_user = self.context['request'].user
+        resource = data['resource']
+        # The permission checks of the whole series use the preloaded permissions
+        preload_effective_permissions([resource], request_user)
+
+        if not resource.is_manager(request_user):
+            raise PermissionDenied(_('Only resource managers can create reservation series.'))
+
+        self.validate_reservation_fields(data, resource, request_user)
+
+        if data.get('access_code'):
+            try:
+                validate_access_code(data['access_code'], resource.access_code_type)
+            except DjangoValidationError as exc:
+                raise ValidationError(dict(access_code=exc.messages))
+
+        return data
+
+
+class OccurrenceSerializer(serializers.Serializer):
+    begin = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['end'] <= data['begin']:
+            raise ValidationError(_("You must end the reservation after it has begun"))
+        return data
+
+
+class RecurrenceSerializer(serializers.Serializer):
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    FREQUENCY_DAYS = {DAILY: 1, WEEKLY: 7}
+
+    frequency = serializers.ChoiceField(choices=(DAILY, WEEKLY))
+    interval = serializers.IntegerField(min_value=1, default=1)
+    count = serializers.IntegerField(min_value=1, required=False)
+    until = serializers.DateField(required=False)
+
+    def validate(self, data):
+        if ('count' in data) == ('until' in data):
+            raise ValidationError(_("Give either 'count' or 'until'"))
+        return data
+
+
+class ReservationSeriesSerializer(serializers.Serializer):
+    reservation = serializers.DictField()
+    occurrences = OccurrenceSerializer(many=True, required=False)
+    recurrence = RecurrenceSerializer(required=False)
+    skip_conflicts = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if ('occurrences' in data) == ('recurrence' in data):
+            raise ValidationError(_("Give either 'occurrences' or 'recurrence'"))
+        return data
+
+
+class SeriesConflictSerializer(serializers.Serializer):
+    begin = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    errors = serializers.ListField(child=serializers.CharField())
+
+
+def get_recurrence_occurrences(begin, end, recurrence, tz):
+    """
+    Returns the (begin, end) tuples of a recurring reservation
+
+    The occurrences keep the wall clock time of the first one in the given
+    time zone over daylight saving time changes. No more than one over
+    MAX_SERIES_OCCURRENCES are returned.
+    """
+    step = datetime.timedelta(days=RecurrenceSerializer.FREQUENCY_DAYS[recurrence['frequency']] *
+                              recurrence['interval'])
+    local_begin = begin.astimezone(tz).replace(tzinfo=None)
+    local_end = end.astimezone(tz).replace(tzinfo=None)
+    count = min(recurrence.get('count', MAX_SERIES_OCCURRENCES + 1), MAX_SERIES_OCCURRENCES + 1)
+
+    occurrences = []
+    while len(occurrences) < count:
+        if 'until' in recurrence and local_begin.date() > recurrence['until']:
+            break
+        occurrences.append((tz.localize(local_begin), tz.localize(local_end)))
+        local_begin += step
+        local_end += step
+    return occurrences
+
+
+def get_series_conflicts(resource, occurrences, user):
+    """
+    Checks the occurrences of a reservation series against the restrictions of the resource
+
+    The same checks are run as for a single reservation, with one
+    validation context of the whole series, so that the opening hours and
+    the existing reservations are fetched with one query each.
+
+    Returns the lists of error messages by the index of the occurrence.
+
+    :type resource: Resource
+    :type occurrences: list[tuple[datetime.datetime, datetime.datetime]]
+    :type user: User
+    :rtype: dict[int, list[str]]
+    """
+    if not occurrences:
+        return {}
+    validation_context = ReservationValidationContext(
+        resource, user, min(begin for begin, end in occurrences), max(end for begin, end in occurrences)
+    )
+
+    conflicts = {}
+    accepted = []
+    for index, (begin, end) in enumerate(occurrences):
+        try:
+            validate_reservable_time(resource, begin, end, validation_context)
+            resource.validate_reservation_period(None, user, data={'begin': begin, 'end': end},
+                                                 validation_context=validation_context)
+            Reservation(resource=resource, begin=begin, end=end).clean(validation_context=validation_context)
+        except DjangoValidationError as exc:
+            conflicts[index] = exc.messages
+            continue
+        except ValidationError as exc:
+            conflicts[index] = [str(error) for error in exc.detail]
+            continue
+
+        if any(begin < other_end and end > other_begin for other_begin, other_end in accepted):
+            conflicts[index] = [str(_("The reservation overlaps another one in the series"))]
+        else:
+            accepted.append((begin, end))
+
+    return conflicts
+
+
+class ReservationSeriesViewSet(viewsets.GenericViewSet):
+    """
+    Create a series of reservations in a resource at once.
+
+    `reservation` has the fields shared by all the reservations, as when
+    creating a single reservation. The times are given either as a list of
+    `occurrences` with `begin` and `end`, or as a `recurrence` of the
+    `begin` and `end` of `reservation`: `frequency` is `daily` or `weekly`,
+    `interval` the number of days or weeks between the reservations and
+    either `count` or `until` (a date) ends the series.
+
+    The whole series is checked in one pass and the conflicting occurrences
+    are reported with their errors. Unless `skip_conflicts` is set, nothing
+    is created when there are conflicts. The reservations are confirmed
+    right away, so only the managers of the resource can create series.
+    A single notification of the whole series is sent.
+    """
+    serializer_class = ReservationSeriesSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    authentication_classes = ReservationViewSet.authentication_classes
+
+    def _get_template_data(self, params):
+        serializer = ReservationSeriesTemplateSerializer(
+            data=params['reservation'], context=self.get_serializer_context()
+        )
+        if not serializer.is_valid():
+            raise ValidationError({'reservation': serializer.errors})
+        return serializer.validated_data
+
+    def _get_occurrences(self, params, data, tz):
+        if 'occurrences' in params:
+            occurrences = [(occ['begin'], occ['end']) for occ in params['occurrences']]
+        else:
+            if not data.get('begin') or not data.get('end'):
+                raise ValidationError({'reservation': _('The first reservation of a recurrence needs begin and end')})
+            occurrences = get_recurrence_occurrences(data['begin'], data['end'], params['recurrence'], tz)
+
+        if len(occurrences) > MAX_SERIES_OCCURRENCES:
+            raise ValidationError(_('A series can have at most %(count)d reservations') %
+                                  {'count': MAX_SERIES_OCCURRENCES})
+        return occurrences
+
+    def _format_conflicts(self, occurrences, conflicts):
+        return SeriesConflictSerializer([
+            {'begin': occurrences[index][0], 'end': occurrences[index][1], 'errors': errors}
+            for index, errors in sorted(conflicts.items())
+        ], many=True).data
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        data = self._get_template_data(params)
+        resource = data['resource']
+        occurrences = self._get_occurrences(params, data, resource.unit.get_tz())
+
+        with transaction.atomic():
+            # The same critical section as with single reservations
+            if not getattr(settings, 'RESPA_RESERVATION_OVERLAP_CONSTRAINT', False):
+                Resource.objects.select_for_update().get(pk=resource.pk)
+
+            conflicts = get_series_conflicts(resource, occurrences, request.user)
+            conflict_data = self._format_conflicts(occurrences, conflicts)
+            if conflicts and not params['skip_conflicts']:
+                return Response({'conflicts': conflict_data}, status=status.HTTP_400_BAD_REQUEST)
+
+            times = [occ for index, occ in enumerate(occurrences) if index not in conflicts]
+            if not resource.is_admin(request.user) and resource.max_reservations_per_user is not None:
+                reservation_count = resource.reservations.filter(user=data.get('user', request.user)).active().count()
+                if reservation_count + len(times) > resource.max_reservations_per_user:
+                    raise ValidationError(_("Maximum number of active reservations for this resource exceeded."))
+
+            fields = {key: value for key, value in data.items() if key not in ('begin', 'end', 'state')}
+            fields.setdefault('user', request.user)
+            reservations = [
+                Reservation(begin=begin, end=end, created_by=request.user, modified_by=request.user, **fields)
+                for begin, end in times
+            ]
+            with convert_reservation_collision():
+                Reservation.create_series(reservations, request.user)
+
+        context = self.get_serializer_context()
+        return Response({
+            'reservations': ReservationSerializer(reservations, many=True, context=context).data,
+            'conflicts': conflict_data,
+        }, status=status.HTTP_201_CREATED)
+
+
+register_view(ReservationSeriesViewSet, 'reservation_series', base_name='reservation_series')
@@ -1,62 +1,102 @@
 import collections
 import datetime
+import hashlib
+import re
 
 import arrow
 import django_filters
 import pytz
 from arrow.parser import ParserError
 
-from django import forms
-from django.db.models import Prefetch, Q
-from django.urls import reverse
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import (
+    DateTimeField, DurationField, Exists, ExpressionWrapper, F, FloatField, Func, OuterRef, Q, Value
+)
+from django.db.models.functions import Greatest, Least
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
-from resources.pagination import PurposePagination
+from psycopg2.extras import DateTimeTZRange
+from resources.pagination import PurposePagination, ResourcePagination
 from rest_framework import exceptions, filters, mixins, serializers, viewsets, response, status
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import action
-from guardian.core import ObjectPermissionChecker
 
 from munigeo import api as munigeo_api
 from resources.models import (
-    Purpose, Reservation, Resource, ResourceImage, ResourceType, ResourceEquipment,
-    TermsOfUse, Equipment, ReservationMetadataSet, ResourceDailyOpeningHours
+    Purpose, PurposeClosure, Reservation, Resource, ResourceImage, ResourceType, ResourceEquipment,
+    TermsOfUse, Equipment, ResourceDailyFreeTime, ResourceDailyOpeningHours
+)
+from resources.models.resource import SEARCH_CONFIGS, determine_hours_time_range
+from resources.models.resource_permission import preload_effective_permissions
+from resources.cache import (
+    EQUIPMENT, FAVORITES, OPENING_HOURS, PERMISSIONS, PURPOSES, RESERVATIONS, RESOURCE_REPRESENTATION, RESOURCE_TYPES,
+    TERMS_OF_USE, get_cache_version, get_catalog, get_shared_cache
 )
-from resources.models.resource import determine_hours_time_range
 
 from ..auth import is_general_admin, is_staff
-from .base import TranslatedModelSerializer, register_view, DRFFilterBooleanWidget
-from .reservation import ReservationSerializer
+from .base import (
+    ConditionalListMixin, FieldSelectionSerializerMixin, StreamingListMixin, TranslatedModelSerializer,
+    register_view, DRFFilterBooleanWidget, get_field_selection, is_field_selected, parse_query_time_range
+)
+from .reservation import ReservationSerializer, get_reservation_metadata_set_cache
 from .unit import UnitSerializer
 from .equipment import EquipmentSerializer
 from rest_framework.settings import api_settings as drf_settings
 
+STATIC_REPRESENTATION_CACHE_TIMEOUT = 24 * 60 * 60
+PURPOSE_TREE_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_static_representation_key(serializer_class, resource, request, version):
+    params = request.query_params
+    parts = (version, serializer_class.__name__, resource.id, request.build_absolute_uri('/'), params.get('srid', ''),
+             params.get('fields', ''), params.get('exclude', ''))
+    return 'resource:%s' % hashlib.md5(':'.join(str(x) for x in parts).encode('utf8')).hexdigest()
 
-def parse_query_time_range(params):
-    times = {}
-    for name in ('start', 'end'):
-        if name not in params:
-            continue
-        try:
-            times[name] = arrow.get(params[name]).to('utc').datetime
-        except ParserError:
-            raise exceptions.ParseError("'%s' must be a timestamp in ISO 8601 format" % name)
 
-    if len(times):
-        if 'start' not in times or 'end' not in times:
-            raise exceptions.ParseError("You must supply both 'start' and 'end'")
-        if times['end'] < times['start']:
-            raise exceptions.ParseError("'end' must be after 'start'")
+def _load_equipment():
+    equipment_list = Equipment.objects.select_related('category').prefetch_related('aliases')
+    return {x.id: x for x in equipment_list}
 
-    return times
+
+def _load_resource_types():
+    return {x.id: x for x in ResourceType.objects.all()}
+
+
+def _load_terms_of_use():
+    return {x.id: x for x in TermsOfUse.objects.all()}
 
 
 def get_resource_reservations_queryset(begin, end):
-    qs = Reservation.objects.filter(begin__lte=end, end__gte=begin).current()
+    qs = Reservation.objects.overlaps(begin, end, inclusive=True).current()
     qs = qs.order_by('begin').prefetch_related('catering_orders').select_related('user')
     return qs
 
 
+class RangeLower(Func):
+    function = 'LOWER'
+    output_field = DateTimeField()
+
+
+class RangeUpper(Func):
+    function = 'UPPER'
+    output_field = DateTimeField()
+
+
+class PrefixSearchQuery(SearchQuery):
+    """
+    Search query that matches the given words as prefixes of the searched words
+    """
+
+    def __init__(self, words, **kwargs):
+        value = ' & '.join('%s:*' % word for word in words)
+        super().__init__(value, **kwargs)
+
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery', 'to_tsquery'), params
+
+
 class PurposeSerializer(TranslatedModelSerializer):
     class Meta:
         model = Purpose
@@ -74,6 +114,44 @@ class PurposeViewSet(viewsets.ReadOnlyModelViewSet):
         else:
             return self.queryset.filter(public=True)
 
+    def _build_tree(self):
+        purposes = list(self.get_queryset())
+        parents = {purpose.id: purpose.parent_id for purpose in purposes}
+
+        def is_in_loop(purpose_id):
+            ancestor_id = parents[purpose_id]
+            visited = set()
+            while ancestor_id in parents and ancestor_id not in visited:
+                if ancestor_id == purpose_id:
+                    return True
+                visited.add(ancestor_id)
+                ancestor_id = parents[ancestor_id]
+            return False
+
+        data = {purpose.id: dict(self.get_serializer(purpose).data, children=[]) for purpose in purposes}
+        roots = []
+        for purpose in purposes:
+            # The children of the purposes that are not shown become roots
+            if purpose.parent_id in data and not is_in_loop(purpose.id):
+                data[purpose.parent_id]['children'].append(data[purpose.id])
+            else:
+                roots.append(data[purpose.id])
+        return roots
+
+    @action(detail=False)
+    def tree(self, request):
+        """
+        All of the purposes nested under their parents
+        """
+        version = get_cache_version(PURPOSES)
+        key = 'purpose_tree:%s:%s' % (version, 'all' if is_staff(request.user) else 'public')
+        shared_cache = get_shared_cache()
+        tree = shared_cache.get(key)
+        if tree is None:
+            tree = self._build_tree()
+            shared_cache.set(key, tree, PURPOSE_TREE_CACHE_TIMEOUT)
+        return response.Response(tree)
+
 
 register_view(PurposeViewSet, 'purpose')
 
@@ -107,7 +185,7 @@ class NestedResourceImageSerializer(TranslatedModelSerializer):
     url = serializers.SerializerMethodField()
 
     def get_url(self, obj):
-        url = reverse('resource-image-view', kwargs={'pk': obj.pk})
+        url = obj.get_url()
         request = self.context.get('request')
         if request:
             return request.build_absolute_uri(url)
@@ -127,8 +205,9 @@ class ResourceEquipmentSerializer(TranslatedModelSerializer):
 
     def to_representation(self, obj):
         # remove unnecessary nesting and aliases
-        if 'equipment_cache' in self.context:
-            obj.equipment = self.context['equipment_cache'][obj.equipment_id]
+        equipment = self.context.get('equipment_cache', {}).get(obj.equipment_id)
+        if equipment is not None:
+            obj.equipment = equipment
         ret = super().to_representation(obj)
         ret['name'] = ret['equipment']['name']
         ret['id'] = ret['equipment']['id']
@@ -142,15 +221,14 @@ class TermsOfUseSerializer(TranslatedModelSerializer):
         fields = ('text',)
 
 
-class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
+class ResourceSerializer(FieldSelectionSerializerMixin, TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     purposes = PurposeSerializer(many=True)
     images = NestedResourceImageSerializer(many=True)
     equipment = ResourceEquipmentSerializer(many=True, read_only=True, source='resource_equipment')
     type = ResourceTypeSerializer()
     # FIXME: location field gets removed by munigeo
     location = serializers.SerializerMethodField()
-    # FIXME: Enable available_hours when it's more performant
-    # available_hours = serializers.SerializerMethodField()
+    available_hours = serializers.SerializerMethodField()
     opening_hours = serializers.SerializerMethodField()
     reservations = serializers.SerializerMethodField()
     user_permissions = serializers.SerializerMethodField()
@@ -165,6 +243,17 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
     reservable_min_days_in_advance = serializers.ReadOnlyField(source='get_reservable_min_days_in_advance')
     reservable_after = serializers.SerializerMethodField()
 
+    # Fields that depend on the user or the requested time window
+    dynamic_fields = ('user_permissions', 'is_favorite', 'reservable_before', 'reservable_after',
+                      'opening_hours', 'reservations', 'available_hours')
+    _representation_part = None
+    # Related objects that are taken from the catalogs in the context
+    catalog_relations = (
+        ('reservation_metadata_set', 'reservation_metadata_set_cache'),
+        ('type', 'resource_type_cache'),
+        ('generic_terms', 'terms_of_use_cache'),
+    )
+
     def get_user_permissions(self, obj):
         request = self.context.get('request', None)
         return {
@@ -174,8 +263,12 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
         }
 
     def get_is_favorite(self, obj):
+        if 'favorite_resource_ids' in self.context:
+            return obj.id in self.context['favorite_resource_ids']
         request = self.context.get('request', None)
-        return request.user in obj.favorited_by.all()
+        if not request or not request.user.is_authenticated:
+            return False
+        return obj.favorited_by.filter(id=request.user.id).exists()
 
     def get_generic_terms(self, obj):
         data = TermsOfUseSerializer(obj.generic_terms).data
@@ -199,6 +292,26 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
         else:
             return obj.get_reservable_after()
 
+    @property
+    def _readable_fields(self):
+        fields = super()._readable_fields
+        if self._representation_part is None:
+            return fields
+        dynamic = self._representation_part == 'dynamic'
+        return [field for field in fields if (field.field_name in self.dynamic_fields) == dynamic]
+
+    def _get_static_representation(self, obj):
+        ret = self.context['static_representation_cache'].get(obj.id)
+        if ret is not None:
+            return ret
+
+        self._representation_part = 'static'
+        ret = super().to_representation(obj)
+        get_shared_cache().set(
+            self.context['static_representation_keys'][obj.id], ret, STATIC_REPRESENTATION_CACHE_TIMEOUT
+        )
+        return ret
+
     def to_representation(self, obj):
         # we must parse the time parameters before serializing
         self.parse_parameters()
@@ -206,17 +319,26 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
             # resource is already serialized
             return obj
 
-        # We cache the metadata objects to save on SQL roundtrips
-        if 'reservation_metadata_set_cache' in self.context:
-            set_id = obj.reservation_metadata_set_id
-            if set_id:
-                obj.reservation_metadata_set = self.context['reservation_metadata_set_cache'][set_id]
-        ret = super().to_representation(obj)
-        if hasattr(obj, 'distance'):
+        # We cache the catalog objects to save on SQL roundtrips
+        for field_name, cache_name in self.catalog_relations:
+            related_obj = self.context.get(cache_name, {}).get(getattr(obj, field_name + '_id'))
+            if related_obj is not None:
+                setattr(obj, field_name, related_obj)
+
+        # The part of the representation that is the same for every user
+        # and time window is cached by the views, see ResourceCacheMixin.
+        if obj.id in self.context.get('static_representation_keys', {}):
+            ret = collections.OrderedDict(self._get_static_representation(obj))
+            self._representation_part = 'dynamic'
+            dynamic_ret = super().to_representation(obj)
+            ret.update((name, dynamic_ret[name]) for name in self.dynamic_fields if name in dynamic_ret)
+        else:
+            self._representation_part = None
+            ret = super().to_representation(obj)
+
+        if hasattr(obj, 'distance') and self.is_field_selected('distance'):
             if obj.distance is not None:
                 ret['distance'] = int(obj.distance.m)
-            elif obj.unit_distance is not None:
-                ret['distance'] = int(obj.unit_distance.m)
 
         return ret
 
@@ -256,7 +378,7 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
             start = None
             end = None
 
-        hours_cache = self.context.get('opening_hours_cache', {}).get(obj.id)
+        hours_cache = (self.context.get('opening_hours_cache') or {}).get(obj.id)
         hours_by_date = obj.get_opening_hours(start, end, opening_hours_cache=hours_cache)
 
         ret = []
@@ -267,6 +389,25 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
             ret.append(d)
         return ret
 
+    def get_available_hours(self, obj):
+        if 'start' not in self.context:
+            return None
+
+        duration = self.context.get('duration')
+        if duration is not None:
+            duration = datetime.timedelta(minutes=duration)
+        hours_cache = (self.context.get('opening_hours_cache') or {}).get(obj.id)
+        if 'reservations_cache' in self.context:
+            rv_list = self.context['reservations_cache'].get(obj.id, [])
+        else:
+            rv_list = None
+
+        return obj.get_available_hours(
+            self.context['start'], self.context['end'], duration=duration,
+            during_closing=self.context.get('during_closing', False),
+            opening_hours_cache=hours_cache, reservations=rv_list
+        )
+
     def get_reservations(self, obj):
         if 'start' not in self.context:
             return None
@@ -285,27 +426,14 @@ class ResourceSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializ
     class Meta:
         model = Resource
         exclude = ('reservation_requested_notification_extra', 'reservation_confirmed_notification_extra',
-                   'access_code_type', 'reservation_metadata_set')
+                   'access_code_type', 'reservation_metadata_set', 'search_vector_fi', 'search_vector_en',
+                   'search_vector_sv', 'effective_location')
 
 
 class ResourceDetailsSerializer(ResourceSerializer):
     unit = UnitSerializer()
 
-
-class ParentFilter(django_filters.Filter):
-    """
-    Filter that also checks the parent field
-    """
-
-    def filter(self, qs, value):
-        child_matches = super().filter(qs, value)
-        self.field_name = self.field_name.replace('__id', '__parent__id')
-        parent_matches = super().filter(qs, value)
-        return child_matches | parent_matches
-
-
-class ParentCharFilter(ParentFilter):
-    field_class = forms.CharField
+    dynamic_fields = ResourceSerializer.dynamic_fields + ('unit',)
 
 
 class ResourceFilterSet(django_filters.FilterSet):
@@ -313,7 +441,7 @@ class ResourceFilterSet(django_filters.FilterSet):
         self.user = kwargs.pop('user')
         super().__init__(*args, **kwargs)
 
-    purpose = ParentCharFilter(field_name='purposes__id', lookup_expr='iexact')
+    purpose = django_filters.CharFilter(method='filter_purpose')
     type = django_filters.Filter(field_name='type__id', lookup_expr='in', widget=django_filters.widgets.CSVWidget)
     people = django_filters.NumberFilter(field_name='people_capacity', lookup_expr='gte')
     need_manual_confirmation = django_filters.BooleanFilter(field_name='need_manual_confirmation',
@@ -345,6 +473,14 @@ class ResourceFilterSet(django_filters.FilterSet):
         ),
     )
 
+    def filter_purpose(self, queryset, name, value):
+        # The purpose matches its descendants at any depth through the closures
+        purposes = PurposeClosure.objects.filter(ancestor__in=Purpose.objects.filter(id__iexact=value).values('id'))
+        resource_purposes = Resource.purposes.through.objects.filter(
+            resource=OuterRef('pk'), purpose__in=purposes.values('descendant')
+        )
+        return queryset.annotate(has_purpose=Exists(resource_purposes)).filter(has_purpose=True)
+
     def filter_is_favorite(self, queryset, name, value):
         if not self.user.is_authenticated:
             if value:
@@ -379,11 +515,11 @@ class ResourceFilterSet(django_filters.FilterSet):
 
         if available_start.date() != available_end.date():
             raise exceptions.ParseError('available_between timestamps must be on the same day.')
-        overlapping_reservations = Reservation.objects.filter(
-            resource__in=queryset, end__gt=available_start, begin__lt=available_end
-        ).current()
 
         if len(value) == 2:
+            overlapping_reservations = Reservation.objects.filter(
+                resource__in=queryset
+            ).overlaps(available_start, available_end).current()
             return self._filter_available_between_whole_range(
                 queryset, overlapping_reservations, available_start, available_end
             )
@@ -392,118 +528,80 @@ class ResourceFilterSet(django_filters.FilterSet):
                 period = datetime.timedelta(minutes=int(value[2]))
             except ValueError:
                 raise exceptions.ParseError('available_between period must be an integer.')
-            return self._filter_available_between_with_period(
-                queryset, overlapping_reservations, available_start, available_end, period
-            )
+            return self._filter_available_between_with_period(queryset, available_start, available_end, period)
 
     def _filter_available_between_whole_range(self, queryset, reservations, available_start, available_end):
         # exclude resources that have reservation(s) overlapping with the available_between range
         queryset = queryset.exclude(reservations__in=reservations)
-        closed_resource_ids = {
-            resource.id
-            for resource in queryset
-            if not self._is_resource_open(resource, available_start, available_end)
-        }
-
-        return queryset.exclude(id__in=closed_resource_ids)
-
-    @staticmethod
-    def _is_resource_open(resource, start, end):
-        opening_hours = resource.get_opening_hours(start, end)
-        if len(opening_hours) > 1:
-            # range spans over multiple days, assume resources aren't open all night and skip the resource
-            return False
-
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
-        if not hours['opens'] and not hours['closes']:
-            return False
-
-        start_too_early = hours['opens'] and start < hours['opens']
-        end_too_late = hours['closes'] and end > hours['closes']
-        if start_too_early or end_too_late:
-            return False
-
-        return True
-
-    def _filter_available_between_with_period(self, queryset, reservations, available_start, available_end, period):
-        reservations = reservations.order_by('begin').select_related('resource')
-
-        reservations_by_resource = collections.defaultdict(list)
-        for reservation in reservations:
-            reservations_by_resource[reservation.resource_id].append(reservation)
-
-        available_resources = set()
-
-        hours_qs = ResourceDailyOpeningHours.objects.filter(
-            open_between__overlap=(available_start, available_end, '[)'))
+        # and the ones that are not open for the whole range
+        open_hours = ResourceDailyOpeningHours.objects.filter(
+            open_between__contains=DateTimeTZRange(available_start, available_end, '[)')
+        )
+        return queryset.filter(id__in=open_hours.values('resource_id'))
+
+    def _filter_available_between_with_period(self, queryset, available_start, available_end, period):
+        # the free time of the resources is maintained on reservation and opening hours changes,
+        # so a free slot exists if any free time overlaps the range for at least the given period
+        free_time = ResourceDailyFreeTime.objects.filter(
+            free_between__overlap=DateTimeTZRange(available_start, available_end, '[)')
+        ).annotate(
+            free_length=ExpressionWrapper(
+                Least(RangeUpper('free_between'), Value(available_end, output_field=DateTimeField())) -
+                Greatest(RangeLower('free_between'), Value(available_start, output_field=DateTimeField())),
+                output_field=DurationField()
+            )
+        ).filter(free_length__gte=period)
 
-        # check the resources one by one to determine which ones have open slots
-        for resource in queryset.prefetch_related(None).prefetch_related(
-                Prefetch('opening_hours', queryset=hours_qs, to_attr='prefetched_opening_hours')):
-            reservations = reservations_by_resource[resource.id]
+        return queryset.filter(id__in=free_time.values('resource_id'))
 
-            if self._is_resource_available(resource, available_start, available_end, reservations, period):
-                available_resources.add(resource.id)
+    class Meta:
+        model = Resource
+        fields = ['purpose', 'type', 'people', 'need_manual_confirmation', 'is_favorite', 'unit', 'available_between', 'min_price_per_hour']
 
-        return queryset.filter(id__in=available_resources)
 
-    @staticmethod
-    def _is_resource_available(resource, available_start, available_end, reservations, period):
-        opening_hours = resource.get_opening_hours(available_start, available_end, resource.prefetched_opening_hours)
-        hours = next(iter(opening_hours.values()))[0]  # assume there is only one hours obj per day
+class ResourceFilterBackend(filters.BaseFilterBackend):
+    """
+    Make request user available in the filter set.
+    """
 
-        if not (hours['opens'] or hours['closes']):
-            return False
+    def filter_queryset(self, request, queryset, view):
+        return ResourceFilterSet(request.query_params, queryset=queryset, user=request.user).qs
 
-        current = max(available_start, hours['opens']) if hours['opens'] is not None else available_start
-        end = min(available_end, hours['closes']) if hours['closes'] is not None else available_end
 
-        if current >= end:
-            # the resource is already closed
-            return False
-
-        if not reservations:
-            # the resource has no reservations, just check if the period fits in the resource's opening times
-            if end - current >= period:
-                return True
-            return False
+class ResourceSearchFilterBackend(filters.BaseFilterBackend):
+    """
+    Full text search from the names, descriptions and unit names of the resources in all languages.
 
-        # try to find an open slot between reservations and opening / closing times.
-        # start from period start time or opening time depending on which one is earlier.
-        for reservation in reservations:
-            if reservation.end <= current:
-                # this reservation is in the past
-                continue
-            if reservation.begin - current >= period:
-                # found an open slot before the reservation currently being examined
-                return True
-            if reservation.end > end:
-                # the reservation currently being examined ends after the period or closing time,
-                # so no free slots
-                return False
-            # did not find an open slot before the reservation currently being examined,
-            # proceed to next reservation
-            current = reservation.end
-        else:
-            # all reservations checked and no free slot found, check if there is a free slot after the last
-            # reservation
-            if end - reservation.end >= period:
-                return True
+    The results are ordered by relevance.
+    """
+    search_param = 'search'
 
-        return False
+    def filter_queryset(self, request, queryset, view):
+        words = re.findall(r'\w+', request.query_params.get(self.search_param, ''))
+        if not words:
+            return queryset
 
-    class Meta:
-        model = Resource
-        fields = ['purpose', 'type', 'people', 'need_manual_confirmation', 'is_favorite', 'unit', 'available_between', 'min_price_per_hour']
+        matches = Q()
+        ranks = []
+        for lang, config in SEARCH_CONFIGS.items():
+            query = PrefixSearchQuery(words, config=config)
+            matches |= Q(**{'search_vector_%s' % lang: query})
+            ranks.append(SearchRank(F('search_vector_%s' % lang), query))
+        queryset = queryset.filter(matches).annotate(search_rank=Greatest(*ranks))
+        return queryset.order_by('-search_rank', *queryset.model._meta.ordering)
 
 
-class ResourceFilterBackend(filters.BaseFilterBackend):
+class KNNDistance(Func):
     """
-    Make request user available in the filter set.
+    The index-assisted distance between a geography column and a point
     """
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = FloatField()
 
-    def filter_queryset(self, request, queryset, view):
-        return ResourceFilterSet(request.query_params, queryset=queryset, user=request.user).qs
+    def __init__(self, expression, point, **extra):
+        point = Func(Value(point.ewkt), function='ST_GeogFromText')
+        super().__init__(expression, point, **extra)
 
 
 class LocationFilterBackend(filters.BaseFilterBackend):
@@ -522,9 +620,10 @@ class LocationFilterBackend(filters.BaseFilterBackend):
         except ValueError:
             raise exceptions.ParseError("'lat' and 'lon' need to be floating point numbers")
         point = Point(lon, lat, srid=4326)
-        queryset = queryset.annotate(distance=Distance('location', point))
-        queryset = queryset.annotate(unit_distance=Distance('unit__location', point))
-        queryset = queryset.order_by('distance', 'unit_distance')
+        queryset = queryset.annotate(distance=Distance('effective_location', point, spheroid=False))
+        # Ordering by the <-> operator instead of the distance lets PostGIS
+        # walk the spatial index in nearest-first order.
+        queryset = queryset.order_by(KNNDistance('effective_location', point))
 
         if 'distance' in query_params:
             try:
@@ -533,32 +632,31 @@ class LocationFilterBackend(filters.BaseFilterBackend):
                     raise ValueError()
             except ValueError:
                 raise exceptions.ParseError("'distance' needs to be a floating point number")
-            q = Q(location__distance_lte=(point, distance)) | Q(unit__location__distance_lte=(point, distance))
-            queryset = queryset.filter(q)
+            queryset = queryset.filter(effective_location__dwithin=(point, distance))
         return queryset
 
 
 class ResourceCacheMixin:
     def _preload_opening_hours(self, times):
-        # We have to evaluate the query here to make sure all the
-        # resources are on the same timezone. In case of different
-        # time zones, we skip this optimization.
-        time_zone = None
+        # The hours are loaded for the local days of each resource, so
+        # the resources are grouped by time zone and each group gets its
+        # own range in the query.
+        resources_by_time_zone = {}
         hours_by_resource = {}
         for resource in self._page:
-            if time_zone:
-                if resource.unit.time_zone != time_zone:
-                    return None
-            else:
-                time_zone = resource.unit.time_zone
+            if not resource.unit:
+                continue
+            resources_by_time_zone.setdefault(resource.unit.time_zone, []).append(resource)
             hours_by_resource[resource.id] = []
-        if not time_zone:
+        if not resources_by_time_zone:
             return None
 
-        begin, end = determine_hours_time_range(times.get('start'), times.get('end'), pytz.timezone(time_zone))
-        hours = ResourceDailyOpeningHours.objects.filter(
-            resource__in=self._page, open_between__overlap=(begin, end, '[)')
-        )
+        query = Q()
+        for time_zone, resources in resources_by_time_zone.items():
+            begin, end = determine_hours_time_range(times.get('start'), times.get('end'), pytz.timezone(time_zone))
+            query |= Q(resource__in=resources, open_between__overlap=(begin, end, '[)'))
+
+        hours = ResourceDailyOpeningHours.objects.filter(query)
         for obj in hours:
             hours_by_resource[obj.resource_id].append(obj)
         return hours_by_resource
@@ -572,54 +670,83 @@ class ResourceCacheMixin:
             rv_list.append(rv)
         return reservations_by_resource
 
+    def _preload_favorites(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return set()
+        favorites = user.favorite_resources.filter(id__in=[res.id for res in self._page])
+        return set(favorites.values_list('id', flat=True))
+
     def _preload_permissions(self):
-        units = set()
-        resource_groups = set()
-        checker = ObjectPermissionChecker(self.request.user)
-        for res in self._page:
-            units.add(res.unit)
-            for g in res.groups.all():
-                resource_groups.add(g)
-            res._permission_checker = checker
-
-        if units:
-            checker.prefetch_perms(units)
-        if resource_groups:
-            checker.prefetch_perms(resource_groups)
+        preload_effective_permissions(self._page, self.request.user)
+
+    def _preload_static_representations(self):
+        version = get_cache_version(RESOURCE_REPRESENTATION)
+        serializer_class = self.get_serializer_class()
+        keys = {
+            res.id: get_static_representation_key(serializer_class, res, self.request, version) for res in self._page
+        }
+        cached = get_shared_cache().get_many(keys.values())
+        representations = {res_id: cached[key] for res_id, key in keys.items() if key in cached}
+        return keys, representations
 
     def _get_cache_context(self):
         context = {}
+        field_selection = get_field_selection(self.request)
+
+        def is_selected(*field_names):
+            return any(is_field_selected(field_selection, name) for name in field_names)
+
+        keys, representations = self._preload_static_representations()
+        context['static_representation_keys'] = keys
+        context['static_representation_cache'] = representations
 
-        equipment_list = Equipment.objects.filter(resource_equipment__resource__in=self._page).distinct().\
-            select_related('category').prefetch_related('aliases')
-        equipment_cache = {x.id: x for x in equipment_list}
+        # These are only needed for the resources that are serialized from scratch
+        uncached = [res for res in self._page if res.id not in representations]
+        if uncached and is_selected('equipment'):
+            context['equipment_cache'] = get_catalog(EQUIPMENT, _load_equipment)
+        if uncached and is_selected('type'):
+            context['resource_type_cache'] = get_catalog(RESOURCE_TYPES, _load_resource_types)
+        if uncached and is_selected('generic_terms'):
+            context['terms_of_use_cache'] = get_catalog(TERMS_OF_USE, _load_terms_of_use)
 
-        context['equipment_cache'] = equipment_cache
-        set_list = ReservationMetadataSet.objects.all().prefetch_related('supported_fields', 'required_fields')
-        context['reservation_metadata_set_cache'] = {x.id: x for x in set_list}
+        if is_selected('supported_reservation_extra_fields', 'required_reservation_extra_fields', 'reservations'):
+            context['reservation_metadata_set_cache'] = get_reservation_metadata_set_cache()
 
         times = parse_query_time_range(self.request.query_params)
-        if times:
+        if times and is_selected('reservations', 'available_hours'):
             context['reservations_cache'] = self._preload_reservations(times)
-        context['opening_hours_cache'] = self._preload_opening_hours(times)
+        if is_selected('opening_hours', 'available_hours'):
+            context['opening_hours_cache'] = self._preload_opening_hours(times)
 
-        self._preload_permissions()
+        if is_selected('is_favorite'):
+            context['favorite_resource_ids'] = self._preload_favorites()
+
+        if is_selected('user_permissions', 'reservable_before', 'reservable_after', 'reservations', 'unit'):
+            self._preload_permissions()
 
         return context
 
 
-class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
-                          viewsets.GenericViewSet, ResourceCacheMixin):
-    queryset = Resource.objects.select_related('generic_terms', 'unit', 'type', 'reservation_metadata_set')
-    queryset = queryset.prefetch_related('favorited_by', 'resource_equipment', 'resource_equipment__equipment',
-                                         'purposes', 'images', 'purposes', 'groups')
-    filter_backends = (filters.SearchFilter, ResourceFilterBackend, LocationFilterBackend)
-    search_fields = ('name_fi', 'description_fi', 'unit__name_fi',
-                     'name_sv', 'description_sv', 'unit__name_sv',
-                     'name_en', 'description_en', 'unit__name_en')
+class ResourceListViewSet(ConditionalListMixin, StreamingListMixin, munigeo_api.GeoModelAPIView,
+                          mixins.ListModelMixin, viewsets.GenericViewSet, ResourceCacheMixin):
+    # The types, terms of use, metadata sets and equipment come from the catalogs
+    queryset = Resource.objects.select_related('unit')
+    queryset = queryset.prefetch_related('resource_equipment', 'purposes', 'images', 'purposes', 'groups')
+    pagination_class = ResourcePagination
+    filter_backends = (ResourceSearchFilterBackend, ResourceFilterBackend, LocationFilterBackend)
     authentication_classes = (
         list(drf_settings.DEFAULT_AUTHENTICATION_CLASSES) +
         [SessionAuthentication])
+    etag_cache_versions = (RESOURCE_REPRESENTATION, OPENING_HOURS, PERMISSIONS, FAVORITES)
+
+    def get_etag_cache_versions(self):
+        versions = self.etag_cache_versions
+        # The reservations only matter when a time range is given
+        query_params = self.request.query_params
+        if parse_query_time_range(query_params) or 'available_between' in query_params:
+            versions += (RESERVATIONS,)
+        return versions
 
     def get_serializer_class(self):
         query_params = self.request.query_params
@@ -629,6 +756,7 @@ class ResourceListViewSet(munigeo_api.GeoModelAPIView, mixins.ListModelMixin,
 
     def get_serializer(self, page, *args, **kwargs):
         self._page = page
+        kwargs.update(get_field_selection(self.request))
         return super().get_serializer(page, *args, **kwargs)
 
     def get_serializer_context(self):
@@ -647,6 +775,7 @@ class ResourceViewSet(munigeo_api.GeoModelAPIView, mixins.RetrieveModelMixin,
 
     def get_serializer(self, page, *args, **kwargs):
         self._page = [page]
+        kwargs.update(get_field_selection(self.request))
         return super().get_serializer(page, *args, **kwargs)
 
     def get_serializer_context(self):
@@ -1,11 +1,23 @@
+import hashlib
+
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.cache import cache
 from django.db.models import Q
+from django.db.models.functions import Greatest
 from django.utils.encoding import force_text
+from modeltranslation.translator import NotRegistered, translator
+from modeltranslation.utils import build_localized_fieldname, get_language
 from rest_framework import viewsets
 from rest_framework.fields import BooleanField
 from rest_framework.response import Response
 
 from resources.api.resource import ResourceListViewSet
 from resources.api.unit import UnitViewSet
+from resources.auth import is_authenticated_user, is_general_admin
+from resources.models import Unit
+
+# The suggestions are cached only briefly, as they are not invalidated on changes
+TYPEAHEAD_CACHE_TIMEOUT = 60
 
 
 class TypeaheadViewSet(viewsets.ViewSet):
@@ -24,6 +36,9 @@ class TypeaheadViewSet(viewsets.ViewSet):
     By default, all supported object types are returned, but this can
     be limited by the comma-separated `types` query parameter.
 
+    The suggestions are ordered by the similarity of their names to the
+    input.
+
     Currently supported are "resource" and "unit".
     """
     objects = {
@@ -52,10 +67,19 @@ class TypeaheadViewSet(viewsets.ViewSet):
                 yield obj_list
 
     def get_single_object_type_object_list(self, request, obj_name, query_parts, full=False):
-        # TODO: Could add caching here, keyed on `query_parts`
         obj_schema = self.objects.get(obj_name)
         if not obj_schema:
             return None
+
+        cache_key = self.get_cache_key(request, obj_name, query_parts, full)
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.get_data(request, obj_schema, query_parts, full)
+            cache.set(cache_key, data, TYPEAHEAD_CACHE_TIMEOUT)
+        if data:
+            return (obj_name, data)
+
+    def get_data(self, request, obj_schema, query_parts, full):
         q = self.build_q(obj_schema["search_fields"], query_parts)
 
         # Defer serialization and queryset retrieval to the viewsets that are in use
@@ -63,14 +87,49 @@ class TypeaheadViewSet(viewsets.ViewSet):
         viewset_class = obj_schema["viewset"]
         object_viewset = viewset_class(request=request)
         object_viewset.initial(request)
-        queryset = object_viewset.get_queryset().filter(q)[:10]  # TODO: Sort these?
-        if queryset.exists():
-            if full:
-                data = object_viewset.get_serializer(queryset, many=True).data
-            else:
-                text_getter = obj_schema["text_getter"]
-                data = [{"id": obj.pk, "text": text_getter(obj)} for obj in queryset]
-            return (obj_name, data)
+        queryset = object_viewset.get_queryset().filter(q)
+        rank = self.build_rank(queryset.model, obj_schema["search_fields"], query_parts)
+        objs = list(queryset.annotate(typeahead_rank=rank).order_by('-typeahead_rank', 'pk')[:10])
+        if not objs:
+            return []
+        if full:
+            return object_viewset.get_serializer(objs, many=True).data
+        text_getter = obj_schema["text_getter"]
+        return [{"id": obj.pk, "text": text_getter(obj)} for obj in objs]
+
+    def get_cache_key(self, request, obj_name, query_parts, full):
+        user = request.user
+        # Resource visibility depends on the units the user manages. Those
+        # are looked up only for the staff, the other users get the public
+        # suggestions or ones of their own. The full representations also
+        # contain fields specific to the user.
+        if not is_authenticated_user(user):
+            scope = 'public'
+        elif is_general_admin(user):
+            scope = 'admin'
+        elif user.is_staff:
+            scope = ','.join(sorted(Unit.objects.managed_by(user).values_list('id', flat=True)))
+        else:
+            scope = 'user:%s' % user.pk
+        if full and is_authenticated_user(user):
+            scope += ':%s' % user.pk
+        parts = (obj_name, ' '.join(query_parts), full, get_language(), request.build_absolute_uri('/'), scope)
+        return 'typeahead:%s' % hashlib.md5(':'.join(str(x) for x in parts).encode('utf8')).hexdigest()
+
+    def build_rank(self, model, fields, query_parts):
+        try:
+            translated_fields = translator.get_options_for_model(model).fields
+        except NotRegistered:
+            translated_fields = {}
+        text = ' '.join(query_parts)
+        similarities = [
+            TrigramSimilarity(build_localized_fieldname(field, get_language()) if field in translated_fields else field,
+                              text)
+            for field in fields
+        ]
+        if len(similarities) == 1:
+            return similarities[0]
+        return Greatest(*similarities)
 
     def build_q(self, fields, query_parts):
         q = Q()
@@ -1,9 +1,17 @@
+import collections
+import datetime
+
+from django.utils import timezone
 from rest_framework import serializers, viewsets
 
 import django_filters
 from munigeo import api as munigeo_api
-from resources.api.base import NullableDateTimeField, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget
-from resources.models import Unit
+from resources.api.base import (
+    ConditionalListMixin, NullableDateTimeField, TranslatedModelSerializer, register_view, DRFFilterBooleanWidget,
+    parse_query_time_range
+)
+from resources.cache import OPENING_HOURS, PERMISSIONS, UNITS
+from resources.models import Day, Period, Unit
 
 
 class UnitFilterSet(django_filters.FilterSet):
@@ -20,13 +28,8 @@ class UnitFilterSet(django_filters.FilterSet):
 
 
 class UnitSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
-    opening_hours_today = serializers.DictField(
-        source='get_opening_hours',
-        child=serializers.ListField(
-            child=serializers.DictField(
-                child=NullableDateTimeField())
-        )
-    )
+    opening_hours_today = serializers.SerializerMethodField()
+    opening_hours = serializers.SerializerMethodField()
     # depracated, available for backwards compatibility
     reservable_days_in_advance = serializers.ReadOnlyField(source='reservable_max_days_in_advance')
     reservable_max_days_in_advance = serializers.ReadOnlyField()
@@ -34,6 +37,34 @@ class UnitSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
     reservable_min_days_in_advance = serializers.ReadOnlyField()
     reservable_after = serializers.SerializerMethodField()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The opening hours of a range are only given by the unit endpoints
+        # when asked for, as they are not preloaded elsewhere.
+        if not self.context.get('start'):
+            del self.fields['opening_hours']
+
+    def _get_opening_hours(self, obj, begin, end):
+        hours_cache = (self.context.get('unit_opening_hours_cache') or {}).get(obj.id)
+        hours_by_date = obj.get_opening_hours(begin, end, opening_hours_cache=hours_cache)
+        datetime_field = NullableDateTimeField()
+        return [
+            (date, [{key: datetime_field.to_representation(value) for key, value in hours.items()} for hours in day])
+            for date, day in sorted(hours_by_date.items())
+        ]
+
+    def get_opening_hours_today(self, obj):
+        return {str(date): day for date, day in self._get_opening_hours(obj, None, None)}
+
+    def get_opening_hours(self, obj):
+        ret = []
+        for date, day in self._get_opening_hours(obj, self.context.get('start'), self.context.get('end')):
+            d = collections.OrderedDict(date=date.isoformat())
+            if len(day):
+                d.update(day[0])
+            ret.append(d)
+        return ret
+
     def get_reservable_before(self, obj):
         request = self.context.get('request')
         user = request.user if request else None
@@ -57,11 +88,54 @@ class UnitSerializer(TranslatedModelSerializer, munigeo_api.GeoModelSerializer):
         fields = '__all__'
 
 
-class UnitViewSet(munigeo_api.GeoModelAPIView, viewsets.ReadOnlyModelViewSet):
+class UnitCacheMixin:
+    def _preload_opening_hours(self, times):
+        # The local dates of the units can differ from the UTC ones by a
+        # day, so the periods are loaded with a day of margin on both sides.
+        begin = times.get('start') or timezone.now()
+        end = times.get('end') or begin
+        margin = datetime.timedelta(days=1)
+
+        periods = Period.objects.filter(
+            unit__in=self._page, start__lte=end.date() + margin, end__gte=begin.date() - margin
+        )
+        hours_by_unit = {unit.id: ([], []) for unit in self._page}
+        periods_by_id = {}
+        for period in periods:
+            hours_by_unit[period.unit_id][0].append(period)
+            periods_by_id[period.id] = period
+        for day in Day.objects.filter(period__in=list(periods_by_id)):
+            hours_by_unit[periods_by_id[day.period_id].unit_id][1].append(day)
+        return hours_by_unit
+
+    def _get_cache_context(self):
+        times = parse_query_time_range(self.request.query_params)
+        context = dict(times)
+        context['unit_opening_hours_cache'] = self._preload_opening_hours(times)
+        return context
+
+    def get_serializer(self, *args, **kwargs):
+        if args:
+            self._page = args[0] if kwargs.get('many') else [args[0]]
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if hasattr(self, '_page'):
+            context.update(self._get_cache_context())
+        return context
+
+
+class UnitViewSet(ConditionalListMixin, munigeo_api.GeoModelAPIView, UnitCacheMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Units and their opening hours. The opening hours are given for today, and
+    for the days between `start` and `end` when they are supplied.
+    """
     queryset = Unit.objects.all()
     serializer_class = UnitSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filterset_class = UnitFilterSet
+    etag_cache_versions = (UNITS, OPENING_HOURS, PERMISSIONS)
 
 
 register_view(UnitViewSet, 'unit')
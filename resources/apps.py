@@ -5,3 +5,6 @@ from django.utils.translation import ugettext_lazy
 class ResourceConfig(AppConfig):
     name = 'resources'
     verbose_name = ugettext_lazy('Resource app')
+
+    def ready(self):
+        import resources.signal_handlers  # noqa
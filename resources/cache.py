@@ -0,0 +1,105 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+RESOURCE_REPRESENTATION = 'resource_representation'
+RESERVATION_METADATA_SETS = 'reservation_metadata_sets'
+RESOURCE_TYPES = 'resource_types'
+TERMS_OF_USE = 'terms_of_use'
+EQUIPMENT = 'equipment'
+UNITS = 'units'
+OPENING_HOURS = 'opening_hours'
+RESERVATIONS = 'reservations'
+CATERING_ORDERS = 'catering_orders'
+PERMISSIONS = 'permissions'
+FAVORITES = 'favorites'
+PURPOSES = 'purposes'
+
+# Catalogs kept in the memory of this process, see get_catalog()
+_catalogs = {}
+
+# Seconds after which a catalog is loaded again even if its version has not
+# been bumped. With a cache that is not shared by the processes, the version
+# bumps of the other processes are not seen, so this is how long they can go
+# on using old objects.
+CATALOG_MAX_AGE = 60
+
+# Used by get_shared_cache() when the default cache is not shared
+_dummy_cache = DummyCache('dummy', {})
+
+
+def _get_version_key(name):
+    return 'respa:version:%s' % name
+
+
+def get_cache_version(name):
+    """
+    Returns the current version of a group of cached values
+
+    The version is meant to be made part of the cache keys of the group,
+    so that all of the values can be invalidated at once by bumping it.
+    """
+    key = _get_version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(name):
+    """
+    Invalidates a group of cached values
+
+    The version is changed again after the current transaction commits,
+    so that values cached from the old data by concurrent requests in the
+    meantime are not picked up either.
+    """
+    key = _get_version_key(name)
+    cache.set(key, uuid4().hex, None)
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
+
+
+def is_cache_shared():
+    """
+    Returns whether the default cache is shared by all of the processes
+
+    A local memory cache is only seen by the process itself, so the version
+    bumps of the other processes, like the other workers and the management
+    commands run from cron, are not noticed through it.
+    """
+    return settings.RESPA_LOCAL_CACHE_SHARED or not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def get_shared_cache():
+    """
+    Returns the cache for the values that are invalidated by bumping their version
+
+    Nothing is cached when the default cache is not shared, as the values
+    would go on being used after the other processes have changed the data.
+    """
+    return cache if is_cache_shared() else _dummy_cache
+
+
+def get_catalog(name, loader):
+    """
+    Returns the objects produced by loader, reusing them within the process
+
+    The objects are loaded again after the cache version of the catalog
+    has been bumped or after CATALOG_MAX_AGE seconds, so loader should
+    return objects that are only read by the users of the catalog.
+    """
+    version = get_cache_version(name)
+    now = time.monotonic()
+    cached = _catalogs.get(name)
+    if cached is not None and cached[0] == version and now - cached[1] < CATALOG_MAX_AGE:
+        return cached[2]
+
+    objects = loader()
+    _catalogs[name] = (version, now, objects)
+    return objects
@@ -3,3 +3,7 @@ from django.core.exceptions import ValidationError
 
 class InvalidImage(ValidationError):
     pass
+
+
+class ReservationCollision(ValidationError):
+    pass
@@ -0,0 +1,81 @@
+"""
+Management command to run the reservation notifications and integration actions left in the outbox
+
+The actions are only written to the outbox if the RESPA_RESERVATION_OUTBOX
+setting is on, and this command, run periodically, sends them. Failed
+actions are retried with an increasing delay until they have been tried
+MAX_OUTBOX_ATTEMPTS times.
+
+The actions of a reservation are run strictly in the order they were
+written, so that e.g. a cancellation is never handled before the
+confirmation preceding it. Until an action has been run, the later ones
+of the same reservation are held back. An action that has run out of
+attempts keeps holding them back until it is dispatched or deleted
+by hand.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from resources.models import Reservation, ReservationOutboxMessage
+from resources.models.outbox import MAX_OUTBOX_ATTEMPTS
+from resources.models.utils import RESERVATION_OUTBOX_LOCK, lock_for_transaction
+
+
+class Command(BaseCommand):
+    help = "Dispatch the reservation notifications and integration actions in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000, help="Dispatch at most this many messages")
+
+    def _is_due(self, message, now):
+        return message.next_attempt_at <= now and message.attempts < MAX_OUTBOX_ATTEMPTS
+
+    def dispatch_reservation_messages(self, reservation_id, limit):
+        """
+        Dispatch the messages of the reservation in order until one fails or is not due yet
+
+        Returns the numbers of the dispatched and the failed messages.
+        """
+        dispatched = failed = 0
+        with transaction.atomic():
+            # Reservations being dispatched by another run are skipped. The
+            # lock does not keep the reservation from being saved meanwhile.
+            if not lock_for_transaction(RESERVATION_OUTBOX_LOCK, reservation_id, wait=False):
+                return dispatched, failed
+            reservation = Reservation.objects.filter(id=reservation_id).first()
+            if reservation is None:
+                return dispatched, failed
+
+            now = timezone.now()
+            messages = reservation.outbox_messages.filter(dispatched_at__isnull=True).order_by('id')[:limit]
+            for message in messages:
+                if not self._is_due(message, now):
+                    break
+                message.reservation = reservation
+                if not message.dispatch():
+                    failed += 1
+                    break
+                dispatched += 1
+        return dispatched, failed
+
+    def handle(self, *args, **options):
+        dispatched = failed = 0
+        # Only the reservations whose oldest undispatched message is due
+        oldest_pending = ReservationOutboxMessage.objects.filter(
+            dispatched_at__isnull=True
+        ).values('reservation').annotate(oldest_id=Min('id')).values('oldest_id')
+        due = ReservationOutboxMessage.objects.filter(
+            id__in=oldest_pending, next_attempt_at__lte=timezone.now(), attempts__lt=MAX_OUTBOX_ATTEMPTS
+        ).order_by('id')
+        reservation_ids = due.values_list('reservation_id', flat=True)[:options['limit']]
+        for reservation_id in list(reservation_ids):
+            if dispatched + failed >= options['limit']:
+                break
+            counts = self.dispatch_reservation_messages(reservation_id, options['limit'] - dispatched - failed)
+            dispatched += counts[0]
+            failed += counts[1]
+
+        if options['verbosity'] >= 1:
+            self.stdout.write('Dispatched %d messages, %d failed' % (dispatched, failed))
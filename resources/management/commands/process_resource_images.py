@@ -0,0 +1,43 @@
+"""
+Management command to process the resource images left for later
+
+The images are only checked when they are uploaded if the
+RESPA_IMAGE_PROCESSING_ASYNC setting is on, and this command, run
+periodically, does the transcoding and generates the variants.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from resources.errors import InvalidImage
+from resources.models import ResourceImage
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process the pending resource images"
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        image_ids = ResourceImage.objects.filter(processing_pending=True).values_list('id', flat=True)
+        for image_id in list(image_ids):
+            with transaction.atomic():
+                # Images being processed by another run are skipped
+                image = (ResourceImage.objects.select_for_update(skip_locked=True)
+                         .filter(id=image_id, processing_pending=True).first())
+                if image is None:
+                    continue
+                try:
+                    image.process()
+                except InvalidImage:
+                    # The file is served as it was uploaded, it is not retried
+                    logger.exception('Processing resource image %s failed', image_id)
+                    ResourceImage.objects.filter(id=image_id).update(processing_pending=False)
+                    failed += 1
+                    continue
+            processed += 1
+
+        if options['verbosity'] >= 1:
+            self.stdout.write('Processed %d images, %d failed' % (processed, failed))
@@ -0,0 +1,45 @@
+"""
+Management command to add or remove the reservation overlap constraint
+
+The constraint keeps the current reservations of a resource from
+overlapping in the database. Once it is added, the RESPA_RESERVATION_OVERLAP_CONSTRAINT
+setting can be turned on so that reservation writes no longer lock
+the resource.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from resources.models import Reservation
+from resources.models.reservation import OVERLAP_CONSTRAINT_NAME
+
+
+class Command(BaseCommand):
+    help = "Add or remove the constraint that prevents overlapping reservations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--remove', action='store_true', help="Remove the constraint")
+
+    def handle(self, *args, **options):
+        table = connection.ops.quote_name(Reservation._meta.db_table)
+        name = connection.ops.quote_name(OVERLAP_CONSTRAINT_NAME)
+
+        if options['remove']:
+            with connection.cursor() as cursor:
+                cursor.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' % (table, name))
+            self.stdout.write('Removed the reservation overlap constraint')
+            return
+
+        # The same states are left out as in ReservationQuerySet.current()
+        sql = (
+            'ALTER TABLE %s ADD CONSTRAINT %s EXCLUDE USING gist (resource_id WITH =, duration WITH &&) '
+            'WHERE (state NOT IN (%%s, %%s))' % (table, name)
+        )
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Needed for the equality of resource_id in a GiST index
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+                cursor.execute('ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s' % (table, name))
+                cursor.execute(sql, [Reservation.CANCELLED, Reservation.DENIED])
+        except DatabaseError as exc:
+            raise CommandError('Adding the constraint failed, there may be overlapping reservations: %s' % exc)
+        self.stdout.write('Added the reservation overlap constraint')
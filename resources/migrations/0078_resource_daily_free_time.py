@@ -0,0 +1,73 @@
+import django.contrib.postgres.fields.ranges
+import django.db.models.deletion
+from django.db import migrations, models
+
+import resources.models.gistindex
+
+
+def get_free_intervals(open_intervals, reserved_intervals):
+    """
+    Returns the parts of the open intervals that are not reserved
+    """
+    reserved_intervals = sorted(reserved_intervals)
+    free = []
+    for open_begin, open_end in sorted(open_intervals):
+        current = open_begin
+        for reserved_begin, reserved_end in reserved_intervals:
+            if reserved_end <= current:
+                continue
+            if reserved_begin >= open_end:
+                break
+            if reserved_begin > current:
+                free.append((current, reserved_begin))
+            current = reserved_end
+            if current >= open_end:
+                break
+        if current < open_end:
+            free.append((current, open_end))
+    return free
+
+
+def build_free_time(apps, schema_editor):
+    Resource = apps.get_model('resources', 'Resource')
+    ResourceDailyOpeningHours = apps.get_model('resources', 'ResourceDailyOpeningHours')
+    ResourceDailyFreeTime = apps.get_model('resources', 'ResourceDailyFreeTime')
+    Reservation = apps.get_model('resources', 'Reservation')
+
+    for resource_id in Resource.objects.values_list('id', flat=True):
+        open_intervals = [
+            (open_between.lower, open_between.upper) for open_between in
+            ResourceDailyOpeningHours.objects.filter(resource_id=resource_id).values_list('open_between', flat=True)
+        ]
+        if not open_intervals:
+            continue
+        reservations = Reservation.objects.filter(resource_id=resource_id).exclude(state__in=('cancelled', 'denied'))
+        free_intervals = get_free_intervals(open_intervals, reservations.values_list('begin', 'end'))
+        ResourceDailyFreeTime.objects.bulk_create([
+            ResourceDailyFreeTime(resource_id=resource_id, free_between=(begin, end, '[)'))
+            for begin, end in free_intervals
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0077_resource_slot_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceDailyFreeTime',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('free_between', django.contrib.postgres.fields.ranges.DateTimeRangeField()),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='free_time',
+                                               to='resources.Resource')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='resourcedailyfreetime',
+            index=resources.models.gistindex.GistIndex(fields=['free_between'], name='resources_r_free_be_b28a96_gist'),
+        ),
+        migrations.RunPython(build_free_time, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+SEARCH_CONFIGS = {
+    'fi': 'finnish',
+    'en': 'english',
+    'sv': 'swedish',
+}
+
+
+def update_search_vectors(apps, schema_editor):
+    Resource = apps.get_model('resources', 'Resource')
+    Unit = apps.get_model('resources', 'Unit')
+    updates = {}
+    for lang, config in SEARCH_CONFIGS.items():
+        unit_name = Subquery(Unit.objects.filter(pk=OuterRef('unit_id')).values('name_%s' % lang)[:1])
+        updates['search_vector_%s' % lang] = (
+            SearchVector('name_%s' % lang, config=config, weight='A') +
+            SearchVector('description_%s' % lang, config=config, weight='B') +
+            SearchVector(unit_name, config=config, weight='C')
+        )
+    Resource.objects.update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0078_resource_daily_free_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='search_vector_en',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='search_vector_fi',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='search_vector_sv',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector_fi'],
+                                                           name='resources_r_search__890688_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector_en'],
+                                                           name='resources_r_search__438342_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='resource',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector_sv'],
+                                                           name='resources_r_search__67ef9c_gin'),
+        ),
+        migrations.RunPython(update_search_vectors, migrations.RunPython.noop),
+    ]
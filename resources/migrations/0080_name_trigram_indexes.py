@@ -0,0 +1,45 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# The indexes match the UPPER(...) LIKE UPPER(...) comparisons that Django
+# uses for the case-insensitive lookups of the typeahead search.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0079_resource_search_vectors'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            'CREATE INDEX resources_resource_name_fi_trgm ON resources_resource '
+            'USING gin (UPPER(name_fi::text) gin_trgm_ops)',
+            'DROP INDEX resources_resource_name_fi_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX resources_resource_name_en_trgm ON resources_resource '
+            'USING gin (UPPER(name_en::text) gin_trgm_ops)',
+            'DROP INDEX resources_resource_name_en_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX resources_resource_name_sv_trgm ON resources_resource '
+            'USING gin (UPPER(name_sv::text) gin_trgm_ops)',
+            'DROP INDEX resources_resource_name_sv_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX resources_unit_name_fi_trgm ON resources_unit '
+            'USING gin (UPPER(name_fi::text) gin_trgm_ops)',
+            'DROP INDEX resources_unit_name_fi_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX resources_unit_name_en_trgm ON resources_unit '
+            'USING gin (UPPER(name_en::text) gin_trgm_ops)',
+            'DROP INDEX resources_unit_name_en_trgm',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX resources_unit_name_sv_trgm ON resources_unit '
+            'USING gin (UPPER(name_sv::text) gin_trgm_ops)',
+            'DROP INDEX resources_unit_name_sv_trgm',
+        ),
+    ]
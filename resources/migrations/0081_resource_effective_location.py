@@ -0,0 +1,31 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce
+
+
+def update_effective_locations(apps, schema_editor):
+    Resource = apps.get_model('resources', 'Resource')
+    Unit = apps.get_model('resources', 'Unit')
+    unit_location = Subquery(Unit.objects.filter(pk=OuterRef('unit_id')).values('location')[:1])
+    Resource.objects.update(effective_location=Cast(
+        Coalesce('location', unit_location),
+        django.contrib.gis.db.models.fields.PointField(geography=True, srid=4326)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0080_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resource',
+            name='effective_location',
+            field=django.contrib.gis.db.models.fields.PointField(editable=False, geography=True, null=True,
+                                                                 srid=4326),
+        ),
+        migrations.RunPython(update_effective_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+ADMIN = 'admin'
+MANAGER = 'manager'
+
+
+def get_object_permissions(apps, model_name, prefix, object_ids):
+    UserObjectPermission = apps.get_model('guardian', 'UserObjectPermission')
+    GroupObjectPermission = apps.get_model('guardian', 'GroupObjectPermission')
+    object_pks = [str(x) for x in object_ids]
+
+    for model, user_field in ((UserObjectPermission, 'user'), (GroupObjectPermission, 'group__user')):
+        qs = model.objects.filter(
+            content_type__app_label='resources', content_type__model=model_name, object_pk__in=object_pks,
+            permission__codename__startswith=prefix, **{'%s__isnull' % user_field: False}
+        )
+        for user_id, object_pk, codename in qs.values_list(user_field, 'object_pk', 'permission__codename'):
+            yield user_id, object_pk, codename[len(prefix):]
+
+
+def create_user_resource_permissions(apps, schema_editor):
+    Resource = apps.get_model('resources', 'Resource')
+    ResourceGroup = apps.get_model('resources', 'ResourceGroup')
+    UnitAuthorization = apps.get_model('resources', 'UnitAuthorization')
+    UnitGroupAuthorization = apps.get_model('resources', 'UnitGroupAuthorization')
+    UserResourcePermission = apps.get_model('resources', 'UserResourcePermission')
+
+    resources_by_unit = defaultdict(list)
+    for resource_id, unit_id in Resource.objects.filter(unit__isnull=False).values_list('id', 'unit_id'):
+        resources_by_unit[unit_id].append(resource_id)
+    resources_by_group = defaultdict(list)
+    group_memberships = ResourceGroup.resources.through.objects.all()
+    for resource_id, group_id in group_memberships.values_list('resource_id', 'resourcegroup_id'):
+        resources_by_group[str(group_id)].append(resource_id)
+
+    unit_permissions = set()
+    unit_ids = list(resources_by_unit)
+    authorizations = (
+        (UnitAuthorization.objects.filter(subject__in=unit_ids, level='admin'), 'subject', (ADMIN, MANAGER)),
+        (UnitAuthorization.objects.filter(subject__in=unit_ids, level='manager'), 'subject', (MANAGER,)),
+        (UnitGroupAuthorization.objects.filter(subject__members__in=unit_ids, level='admin'), 'subject__members',
+         (ADMIN, MANAGER)),
+    )
+    for qs, unit_field, roles in authorizations:
+        for user_id, unit_id in qs.values_list('authorized', unit_field):
+            unit_permissions.update((user_id, unit_id, role) for role in roles)
+    unit_permissions.update(get_object_permissions(apps, 'unit', 'unit:', unit_ids))
+
+    permissions = set()
+    for user_id, unit_id, permission in unit_permissions:
+        permissions.update((user_id, resource_id, permission) for resource_id in resources_by_unit[unit_id])
+    group_permissions = get_object_permissions(apps, 'resourcegroup', 'group:', resources_by_group)
+    for user_id, group_id, permission in group_permissions:
+        permissions.update((user_id, resource_id, permission) for resource_id in resources_by_group[group_id])
+
+    UserResourcePermission.objects.bulk_create([
+        UserResourcePermission(user_id=user_id, resource_id=resource_id, permission=permission)
+        for user_id, resource_id, permission in permissions
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('guardian', '0001_initial'),
+        ('resources', '0081_resource_effective_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserResourcePermission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(max_length=100)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                               related_name='effective_user_permissions', to='resources.Resource')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                           related_name='effective_resource_permissions',
+                                           to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'user resource permission',
+                'verbose_name_plural': 'user resource permissions',
+                'unique_together': {('user', 'permission', 'resource')},
+            },
+        ),
+        migrations.RunPython(create_user_resource_permissions, migrations.RunPython.noop),
+    ]
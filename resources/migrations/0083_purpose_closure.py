@@ -0,0 +1,47 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_purpose_closures(apps, schema_editor):
+    Purpose = apps.get_model('resources', 'Purpose')
+    PurposeClosure = apps.get_model('resources', 'PurposeClosure')
+    parents = dict(Purpose.objects.values_list('id', 'parent_id'))
+
+    closures = []
+    for purpose_id in parents:
+        ancestor_id = purpose_id
+        depth = 0
+        visited = set()
+        while ancestor_id is not None and ancestor_id not in visited:
+            closures.append(PurposeClosure(ancestor_id=ancestor_id, descendant_id=purpose_id, depth=depth))
+            visited.add(ancestor_id)
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+    PurposeClosure.objects.bulk_create(closures)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0082_user_resource_permissions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurposeClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                               related_name='descendant_closures', to='resources.Purpose')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='ancestor_closures', to='resources.Purpose')),
+            ],
+            options={
+                'verbose_name': 'purpose closure',
+                'verbose_name_plural': 'purpose closures',
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(create_purpose_closures, migrations.RunPython.noop),
+    ]
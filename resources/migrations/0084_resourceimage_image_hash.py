@@ -0,0 +1,32 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def calculate_image_hashes(apps, schema_editor):
+    ResourceImage = apps.get_model('resources', 'ResourceImage')
+    for image in ResourceImage.objects.exclude(image=''):
+        digest = hashlib.md5()
+        try:
+            for chunk in image.image.chunks():
+                digest.update(chunk)
+        except OSError:
+            # The file is missing, the hash is calculated when the image is saved again
+            continue
+        ResourceImage.objects.filter(pk=image.pk).update(image_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0083_purpose_closure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceimage',
+            name='image_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(calculate_image_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0084_resourceimage_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourceimage',
+            name='processing_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
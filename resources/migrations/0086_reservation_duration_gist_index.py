@@ -0,0 +1,33 @@
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension
+from django.db import migrations
+from django.db.models import F, Func, Value
+
+
+def fill_missing_durations(apps, schema_editor):
+    Reservation = apps.get_model('resources', 'Reservation')
+    Reservation.objects.filter(duration__isnull=True).update(
+        duration=Func(F('begin'), F('end'), Value('[)'), function='tstzrange')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0085_resourceimage_processing_pending'),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        migrations.RunPython(fill_missing_durations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='reservation',
+            name='duration',
+            field=django.contrib.postgres.fields.ranges.DateTimeRangeField(blank=True, null=True, verbose_name='Length of reservation'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['resource', 'duration'], name='reservation_resource_duration'),
+        ),
+    ]
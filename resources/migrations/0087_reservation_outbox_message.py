@@ -0,0 +1,39 @@
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('resources', '0086_reservation_duration_gist_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationOutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=100)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('dispatched_at', models.DateTimeField(blank=True, null=True)),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                  related_name='outbox_messages', to='resources.Reservation')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                           related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'reservation outbox message',
+                'verbose_name_plural': 'reservation outbox messages',
+                'ordering': ('id',),
+                'index_together': {('dispatched_at', 'next_attempt_at')},
+            },
+        ),
+    ]
@@ -1,12 +1,16 @@
 from .availability import Day, Period, get_opening_hours
-from .reservation import ReservationMetadataField, ReservationMetadataSet, Reservation, RESERVATION_EXTRA_FIELDS
+from .reservation import (
+    ReservationMetadataField, ReservationMetadataSet, Reservation, RESERVATION_EXTRA_FIELDS
+)
 from .resource import (
-    Purpose, Resource, ResourceType, ResourceImage, ResourceEquipment, ResourceGroup,
-    ResourceDailyOpeningHours, TermsOfUse
+    Purpose, PurposeClosure, Resource, ResourceType, ResourceImage, ResourceEquipment, ResourceGroup,
+    ResourceDailyFreeTime, ResourceDailyOpeningHours, ReservationValidationContext, TermsOfUse
 )
 from .equipment import Equipment, EquipmentAlias, EquipmentCategory
 from .unit import Unit, UnitAuthorization, UnitIdentifier
 from .unit_group import UnitGroup, UnitGroupAuthorization
+from .resource_permission import UserResourcePermission
+from .outbox import ReservationOutboxMessage
 
 __all__ = [
     'Day',
@@ -15,11 +19,15 @@ __all__ = [
     'EquipmentCategory',
     'Period',
     'Purpose',
+    'PurposeClosure',
     'RESERVATION_EXTRA_FIELDS',
     'Reservation',
     'ReservationMetadataField',
     'ReservationMetadataSet',
+    'ReservationOutboxMessage',
+    'ReservationValidationContext',
     'Resource',
+    'ResourceDailyFreeTime',
     'ResourceDailyOpeningHours',
     'ResourceEquipment',
     'ResourceGroup',
@@ -31,5 +39,6 @@ __all__ = [
     'UnitGroup',
     'UnitGroupAuthorization',
     'UnitIdentifier',
+    'UserResourcePermission',
     'get_opening_hours',
 ]
@@ -29,7 +29,7 @@ def datetime_to_date(dt, tz):
     return dt.date()
 
 
-def get_opening_hours(time_zone, periods, begin, end=None):
+def get_opening_hours(time_zone, periods, begin, end=None, days=None):
     """
     Returns opening and closing times for a given date range
 
@@ -37,10 +37,13 @@ def get_opening_hours(time_zone, periods, begin, end=None):
         and values are a list of Day objects for that day's active period
         containing opening and closing hours
 
+    The days of the periods are queried unless they are given.
+
     :rtype : dict[str, list[dict[str, datetime.datetime]]]
     :type periods: list[Period]
     :type begin: datetime.date | datetime.datetime
     :type end: datetime.date | None
+    :type days: list[Day] | None
     """
 
     tz = pytz.timezone(time_zone)
@@ -69,7 +72,8 @@ def get_opening_hours(time_zone, periods, begin, end=None):
             p.priority = 0
     periods.sort(key=lambda x: (-x.priority, x.end - x.start))
 
-    days = list(Day.objects.filter(period__in=periods))
+    if days is None:
+        days = list(Day.objects.filter(period__in=periods))
     for period in periods:
         period.range_days = {day.weekday: day for day in days if day.period_id == period.id}
 
@@ -102,6 +106,40 @@ def get_opening_hours(time_zone, periods, begin, end=None):
     return dates
 
 
+def get_free_intervals(open_intervals, reserved_intervals, min_length=None):
+    """
+    Returns the parts of the open intervals that are not reserved
+
+    Return value is a sorted list of (begin, end) tuples. If min_length
+    is given, intervals shorter than that are left out.
+
+    :rtype : list[tuple[datetime.datetime, datetime.datetime]]
+    :type open_intervals: list[tuple[datetime.datetime, datetime.datetime]]
+    :type reserved_intervals: list[tuple[datetime.datetime, datetime.datetime]]
+    :type min_length: datetime.timedelta | None
+    """
+    reserved_intervals = sorted(reserved_intervals)
+    free = []
+    for open_begin, open_end in sorted(open_intervals):
+        current = open_begin
+        for reserved_begin, reserved_end in reserved_intervals:
+            if reserved_end <= current:
+                continue
+            if reserved_begin >= open_end:
+                break
+            if reserved_begin > current:
+                free.append((current, reserved_begin))
+            current = reserved_end
+            if current >= open_end:
+                break
+        if current < open_end:
+            free.append((current, open_end))
+
+    if min_length is not None:
+        free = [(begin, end) for begin, end in free if end - begin >= min_length]
+    return free
+
+
 class Period(models.Model):
     """
     A period of time to express state of open or closed
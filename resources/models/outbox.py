@@ -0,0 +1,98 @@
+import datetime
+import logging
+
+import django.contrib.postgres.fields as pgfields
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+logger = logging.getLogger(__name__)
+
+# The handlers of the actions by name, see register_outbox_handler()
+OUTBOX_HANDLERS = {}
+
+MAX_OUTBOX_ATTEMPTS = 10
+
+
+class ReservationOutboxMessage(models.Model):
+    """
+    A notification or integration action of a reservation waiting to be run
+
+    With the RESPA_RESERVATION_OUTBOX setting on, the mails and the signals
+    of reservation changes are written here in the same transaction as the
+    change, and the dispatch_reservation_outbox command runs them later, so
+    that slow external services do not hold up the requests. Failed actions
+    are retried with an increasing delay.
+    """
+    reservation = models.ForeignKey('Reservation', related_name='outbox_messages', on_delete=models.CASCADE)
+    action = models.CharField(max_length=100)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', null=True, blank=True,
+                             on_delete=models.SET_NULL)
+    data = pgfields.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("reservation outbox message")
+        verbose_name_plural = _("reservation outbox messages")
+        ordering = ('id',)
+        index_together = [('dispatched_at', 'next_attempt_at')]
+
+    def __str__(self):
+        return '%s: %s' % (self.reservation_id, self.action)
+
+    def dispatch(self):
+        """
+        Run the action, recording the failure for a later retry if it fails
+
+        :rtype: bool
+        """
+        try:
+            with transaction.atomic():
+                run_outbox_handler(self.reservation, self.action, self.user, self.data)
+        except Exception as exc:
+            logger.exception('Reservation outbox message %s failed', self.pk)
+            self.attempts += 1
+            self.last_error = repr(exc)
+            self.next_attempt_at = timezone.now() + datetime.timedelta(minutes=2 ** self.attempts)
+            self.save(update_fields=('attempts', 'last_error', 'next_attempt_at'))
+            return False
+
+        self.attempts += 1
+        self.dispatched_at = timezone.now()
+        self.save(update_fields=('attempts', 'dispatched_at'))
+        return True
+
+
+def register_outbox_handler(action, handler):
+    """
+    Register the function that runs the given reservation action
+
+    The handler is called with the reservation, the user who caused the
+    action or None, and the keyword arguments given to queue_or_run().
+    """
+    OUTBOX_HANDLERS[action] = handler
+
+
+def run_outbox_handler(reservation, action, user, data):
+    OUTBOX_HANDLERS[action](reservation, user, **data)
+
+
+def is_outbox_enabled():
+    return getattr(settings, 'RESPA_RESERVATION_OUTBOX', False)
+
+
+def queue_or_run(reservation, action, user=None, **data):
+    """
+    Run the given action of a saved reservation now, or through the outbox if it is enabled
+
+    The data has to be serializable to JSON.
+    """
+    if is_outbox_enabled():
+        ReservationOutboxMessage.objects.create(reservation=reservation, action=action, user=user, data=data)
+    else:
+        run_outbox_handler(reservation, action, user, data)
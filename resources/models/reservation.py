@@ -2,24 +2,30 @@
 import logging
 import datetime
 import pytz
+from contextlib import contextmanager
 
 from django.utils import timezone
 import django.contrib.postgres.fields as pgfields
+from django.contrib.postgres.indexes import GistIndex
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.utils import translation
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.db.models import Q
+from django.db.models.signals import post_save
 from psycopg2.extras import DateTimeTZRange
 
 from notifications.models import NotificationTemplate, NotificationTemplateException, NotificationType
 from resources.signals import (
     reservation_modified, reservation_confirmed, reservation_cancelled
 )
+from ..errors import ReservationCollision
 from .base import ModifiableModel
+from .outbox import queue_or_run, register_outbox_handler
 from .resource import generate_access_code, validate_access_code
-from .resource import Resource
+from .resource import Resource, ReservationValidationContext
 from .utils import (
     get_dt, save_dt, is_valid_time_slot, humanize_duration, send_respa_mail,
     DEFAULT_LANG, localize_datetime, format_dt_range, build_reservations_ical_file
@@ -42,9 +48,23 @@ class ReservationQuerySet(models.QuerySet):
     def active(self):
         return self.filter(end__gte=timezone.now()).current()
 
-    def overlaps(self, begin, end):
-        qs = Q(begin__lt=end) & Q(end__gt=begin)
-        return self.filter(qs)
+    def overlaps(self, begin, end, inclusive=False):
+        """
+        Filter the reservations overlapping the given range
+
+        The range is compared to the duration of the reservations, which
+        is indexed together with the resource. Either end of the range can
+        be None for an unbounded range. With inclusive, also the reservations
+        ending at begin or beginning at end are included, as when comparing
+        end >= begin and begin <= end.
+        """
+        if not inclusive:
+            return self.filter(duration__overlap=DateTimeTZRange(begin, end, '[)'))
+        # The durations do not include their end, so the range is extended to
+        # the previous microsecond, the precision of the stored times.
+        if begin is not None:
+            begin -= datetime.timedelta(microseconds=1)
+        return self.filter(duration__overlap=DateTimeTZRange(begin, end, '[]'))
 
     def for_date(self, date):
         if isinstance(date, str):
@@ -78,6 +98,29 @@ class ReservationQuerySet(models.QuerySet):
         return self.filter(Q(user=user) | Q(resource__in=allowed_resources))
 
 
+# Name of the optional exclusion constraint that keeps the current reservations
+# of a resource from overlapping, see the reservation_overlap_constraint command
+OVERLAP_CONSTRAINT_NAME = 'resources_reservation_no_overlap'
+
+
+@contextmanager
+def convert_overlap_violation():
+    """
+    Turns violations of the overlap constraint into validation errors
+
+    The statements are run in a savepoint, so that the surrounding
+    transaction can go on after a violation.
+    """
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as exc:
+        diag = getattr(exc.__cause__, 'diag', None)
+        if diag is None or diag.constraint_name != OVERLAP_CONSTRAINT_NAME:
+            raise
+        raise ReservationCollision(_("The resource is already reserved for some of the period")) from exc
+
+
 class Reservation(ModifiableModel):
     CREATED = 'created'
     CANCELLED = 'cancelled'
@@ -96,8 +139,7 @@ class Reservation(ModifiableModel):
                                  on_delete=models.PROTECT)
     begin = models.DateTimeField(verbose_name=_('Begin time'))
     end = models.DateTimeField(verbose_name=_('End time'))
-    duration = pgfields.DateTimeRangeField(verbose_name=_('Length of reservation'), null=True,
-                                           blank=True, db_index=True)
+    duration = pgfields.DateTimeRangeField(verbose_name=_('Length of reservation'), null=True, blank=True)
     comments = models.TextField(null=True, blank=True, verbose_name=_('Comments'))
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('User'), null=True,
                              blank=True, db_index=True, on_delete=models.PROTECT)
@@ -141,6 +183,38 @@ class Reservation(ModifiableModel):
         verbose_name = _("reservation")
         verbose_name_plural = _("reservations")
         ordering = ('id',)
+        # The time window queries of the reservations use the duration
+        indexes = [GistIndex(fields=['resource', 'duration'], name='reservation_resource_duration')]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields() & {'resource_id', 'begin', 'end', 'state'}:
+            instance._free_time_key = instance._get_free_time_key()
+        return instance
+
+    def _get_free_time_key(self):
+        begin = self._meta.get_field('begin').to_python(self.begin)
+        end = self._meta.get_field('end').to_python(self.end)
+        is_current = self.state not in (Reservation.CANCELLED, Reservation.DENIED)
+        return (self.resource_id, begin, end, is_current)
+
+    def _update_resource_free_time(self):
+        """
+        Update the free time of the resources for both the old and the new time of the reservation
+        """
+        old_key = getattr(self, '_free_time_key', None)
+        new_key = self._get_free_time_key()
+        if old_key == new_key:
+            return
+        self.resource.update_free_time(new_key[1], new_key[2])
+        if old_key and old_key[:3] != new_key[:3]:
+            if old_key[0] == self.resource_id:
+                old_resource = self.resource
+            else:
+                old_resource = Resource.objects.get(pk=old_key[0])
+            old_resource.update_free_time(old_key[1], old_key[2])
+        self._free_time_key = new_key
 
     def _save_dt(self, attr, dt):
         """
@@ -218,14 +292,12 @@ class Reservation(ModifiableModel):
         old_state = self.state
         if new_state == old_state:
             if old_state == Reservation.CONFIRMED:
-                reservation_modified.send(sender=self.__class__, instance=self,
-                                          user=user)
+                self.notify('reservation_modified', user)
             return
 
         if new_state == Reservation.CONFIRMED:
             self.approver = user
-            reservation_confirmed.send(sender=self.__class__, instance=self,
-                                       user=user)
+            self.notify('reservation_confirmed', user)
         elif old_state == Reservation.CONFIRMED:
             self.approver = None
 
@@ -233,28 +305,38 @@ class Reservation(ModifiableModel):
 
         # Notifications
         if new_state == Reservation.REQUESTED:
-            self.send_reservation_requested_mail()
-            self.send_reservation_requested_mail_to_officials()
+            self.notify('send_reservation_requested_mail')
+            self.notify('send_reservation_requested_mail_to_officials')
         elif new_state == Reservation.CONFIRMED:
             if self.need_manual_confirmation():
-                self.send_reservation_confirmed_mail()
+                self.notify('send_reservation_confirmed_mail')
             elif self.access_code:
-                self.send_reservation_created_with_access_code_mail()
+                self.notify('send_reservation_created_with_access_code_mail')
             else:
                 if not user_is_staff:
                     # notifications are not sent from staff created reservations to avoid spam
-                    self.send_reservation_created_mail()
+                    self.notify('send_reservation_created_mail')
         elif new_state == Reservation.DENIED:
-            self.send_reservation_denied_mail()
+            self.notify('send_reservation_denied_mail')
         elif new_state == Reservation.CANCELLED:
             if user != self.user:
-                self.send_reservation_cancelled_mail()
-            reservation_cancelled.send(sender=self.__class__, instance=self,
-                                       user=user)
+                self.notify('send_reservation_cancelled_mail')
+            self.notify('reservation_cancelled', user)
 
         self.state = new_state
         self.save()
 
+    def notify(self, action, user=None, **data):
+        """
+        Send a mail or a signal of a change of the reservation
+
+        The action is the name of the signal or of the mail method. With
+        the RESPA_RESERVATION_OUTBOX setting on, the action is only written
+        to the outbox and the dispatch_reservation_outbox command runs it
+        after the change has been committed.
+        """
+        queue_or_run(self, action, user, **data)
+
     def can_modify(self, user):
         if not user:
             return False
@@ -304,21 +386,29 @@ class Reservation(ModifiableModel):
         If this reservation isn't yet saved and it will modify an existing reservation,
         the original reservation need to be provided in kwargs as 'original_reservation', so
         that it can be excluded when checking if the resource is available.
+
+        A ReservationValidationContext of the write can be given in kwargs as
+        'validation_context' to use the opening hours and the overlapping
+        reservations already loaded in it.
         """
         if self.end <= self.begin:
             raise ValidationError(_("You must end the reservation after it has begun"))
 
+        original_reservation = self if self.pk else kwargs.get('original_reservation', None)
+        validation_context = (kwargs.get('validation_context') or
+                              ReservationValidationContext.for_reservation(self, original_reservation))
+
         # Check that begin and end times are on valid time slots.
-        opening_hours = self.resource.get_opening_hours(self.begin.date(), self.end.date())
+        opening_hours = validation_context.opening_hours
         for dt in (self.begin, self.end):
             days = opening_hours.get(dt.date(), [])
             day = next((day for day in days if day['opens'] is not None and day['opens'] <= dt <= day['closes']), None)
             if day and not is_valid_time_slot(dt, self.resource.slot_size, day['opens']):
                 raise ValidationError(_("Begin and end time must match time slots"), code='invalid_time_slot')
 
-        original_reservation = self if self.pk else kwargs.get('original_reservation', None)
-        if self.resource.check_reservation_collision(self.begin, self.end, original_reservation):
-            raise ValidationError(_("The resource is already reserved for some of the period"))
+        if any(res.begin < self.end and res.end > self.begin and res.pk != self.pk
+               for res in validation_context.overlapping_reservations):
+            raise ReservationCollision(_("The resource is already reserved for some of the period"))
 
         if (self.end - self.begin) < self.resource.min_period:
             raise ValidationError(_("The minimum reservation length is %(min_period)s") %
@@ -376,11 +466,12 @@ class Reservation(ModifiableModel):
 
         return context
 
-    def send_reservation_mail(self, notification_type, user=None, attachments=None):
+    def send_reservation_mail(self, notification_type, user=None, attachments=None, extra_context=None):
         """
         Stuff common to all reservation related mails.
 
-        If user isn't given use self.user.
+        If user isn't given use self.user. Anything in extra_context is
+        added to the context of the notification template.
         """
         try:
             notification_template = NotificationTemplate.objects.get(type=notification_type)
@@ -397,6 +488,8 @@ class Reservation(ModifiableModel):
 
         language = user.get_preferred_language() if user else DEFAULT_LANG
         context = self.get_notification_context(language, notification_type=notification_type)
+        if extra_context:
+            context.update(extra_context)
 
         try:
             rendered_notification = notification_template.render(context, language)
@@ -449,18 +542,87 @@ class Reservation(ModifiableModel):
         self.send_reservation_mail(NotificationType.RESERVATION_CREATED_WITH_ACCESS_CODE,
                                    attachments=[attachment])
 
+    def send_reservation_series_created_mail(self, reservations):
+        ical_file = build_reservations_ical_file(reservations)
+        attachment = 'reservations.ics', ical_file, 'text/calendar'
+        language = self.user.get_preferred_language() if self.user else DEFAULT_LANG
+        with translation.override(language):
+            series = [{
+                'begin': localize_datetime(res.begin),
+                'end': localize_datetime(res.end),
+                'begin_dt': res.begin,
+                'end_dt': res.end,
+                'time_range': res.format_time(),
+            } for res in reservations]
+        self.send_reservation_mail(NotificationType.RESERVATION_SERIES_CREATED, attachments=[attachment],
+                                   extra_context={'reservations': series})
+
     def send_access_code_created_mail(self):
         self.send_reservation_mail(NotificationType.RESERVATION_ACCESS_CODE_CREATED)
 
-    def save(self, *args, **kwargs):
+    def _set_computed_fields(self):
         self.duration = DateTimeTZRange(self.begin, self.end, '[)')
+        # Conditional requests of reservation lists rely on this being up to date
+        self.modified_at = timezone.now()
 
         if not self.access_code:
             access_code_type = self.resource.access_code_type
             if self.resource.is_access_code_enabled() and self.resource.generate_access_codes:
                 self.access_code = generate_access_code(access_code_type)
 
-        return super().save(*args, **kwargs)
+    def save(self, *args, **kwargs):
+        self._set_computed_fields()
+
+        if getattr(settings, 'RESPA_RESERVATION_OVERLAP_CONSTRAINT', False):
+            with convert_overlap_violation():
+                ret = super().save(*args, **kwargs)
+        else:
+            ret = super().save(*args, **kwargs)
+        self._update_resource_free_time()
+        return ret
+
+    @classmethod
+    def create_series(cls, reservations, user):
+        """
+        Save new reservations of one resource as confirmed by the given user
+
+        The reservations are inserted with one query and the free time of
+        the resource is recalculated once for the whole series. The post_save
+        and confirmation signals are still sent for each of them, but
+        pre_save is not, as bulk_create() does not send it. Instead of the
+        per reservation mails a single summary of the series is sent.
+
+        :type reservations: list[Reservation]
+        :type user: User
+        """
+        if not reservations:
+            return
+        resource = reservations[0].resource
+        for reservation in reservations:
+            reservation.state = cls.CONFIRMED
+            reservation.approver = user
+            reservation._set_computed_fields()
+
+        with convert_overlap_violation():
+            cls.objects.bulk_create(reservations)
+
+        for reservation in reservations:
+            reservation._free_time_key = reservation._get_free_time_key()
+            post_save.send(sender=cls, instance=reservation, created=True, update_fields=None, raw=False,
+                           using=reservation._state.db)
+            reservation.notify('reservation_confirmed', user)
+        resource.update_free_time(min(res.begin for res in reservations), max(res.end for res in reservations))
+
+        first = reservations[0]
+        if not (first.user and first.user.is_staff):
+            # notifications are not sent from staff created reservations to avoid spam
+            first.notify('send_reservation_series_created_mail', reservations=[res.pk for res in reservations])
+
+    def delete(self, *args, **kwargs):
+        resource_id, begin, end, is_current = self._get_free_time_key()
+        ret = super().delete(*args, **kwargs)
+        self.resource.update_free_time(begin, end)
+        return ret
 
 
 class ReservationMetadataField(models.Model):
@@ -487,3 +649,33 @@ class ReservationMetadataSet(ModifiableModel):
 
     def __str__(self):
         return self.name
+
+
+def _get_signal_handler(signal):
+    def send_signal(reservation, user):
+        signal.send(sender=Reservation, instance=reservation, user=user)
+    return send_signal
+
+
+def _get_mail_handler(method_name):
+    def send_mail(reservation, user):
+        getattr(reservation, method_name)()
+    return send_mail
+
+
+def _send_series_created_mail(reservation, user, reservations):
+    reservation.send_reservation_series_created_mail(list(Reservation.objects.filter(pk__in=reservations)))
+
+
+for _action, _signal in (
+    ('reservation_confirmed', reservation_confirmed), ('reservation_modified', reservation_modified),
+    ('reservation_cancelled', reservation_cancelled),
+):
+    register_outbox_handler(_action, _get_signal_handler(_signal))
+for _method_name in (
+    'send_reservation_requested_mail', 'send_reservation_requested_mail_to_officials',
+    'send_reservation_confirmed_mail', 'send_reservation_created_with_access_code_mail',
+    'send_reservation_created_mail', 'send_reservation_denied_mail', 'send_reservation_cancelled_mail',
+):
+    register_outbox_handler(_method_name, _get_mail_handler(_method_name))
+register_outbox_handler('send_reservation_series_created_mail', _send_series_created_mail)
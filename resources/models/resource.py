@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import os
 import re
 import pytz
@@ -7,8 +8,9 @@ from decimal import Decimal
 
 import arrow
 import django.db.models as dbm
-from django.db.models import Q
-from django.apps import apps
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce
 from django.conf import settings
 from django.contrib.gis.db import models
 from django.core.exceptions import ValidationError
@@ -22,22 +24,28 @@ from django.utils.six import BytesIO
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import pgettext_lazy
 from django.contrib.postgres.fields import HStoreField, DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from .gistindex import GistIndex
 from psycopg2.extras import DateTimeTZRange
+from easy_thumbnails.files import get_thumbnailer
 from image_cropping import ImageRatioField
 from PIL import Image
-from guardian.shortcuts import get_objects_for_user, get_users_with_perms
-from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import get_users_with_perms
 
 from ..auth import is_authenticated_user, is_general_admin
 from ..errors import InvalidImage
 from ..fields import EquipmentField
 from .base import AutoIdentifiedModel, NameIdentifiedModel, ModifiableModel
-from .utils import create_datetime_days_from_now, get_translated, get_translated_name, humanize_duration
+from .utils import (
+    RESOURCE_FREE_TIME_LOCK, create_datetime_days_from_now, get_translated, get_translated_name, humanize_duration,
+    lock_for_transaction
+)
 from .equipment import Equipment
 from .unit import Unit
-from .availability import get_opening_hours
+from .availability import get_free_intervals, get_opening_hours
 from .permissions import RESOURCE_GROUP_PERMISSIONS
+from .resource_permission import UserResourcePermission, preload_effective_permissions
 
 
 def generate_access_code(access_code_type):
@@ -115,6 +123,51 @@ class Purpose(ModifiableModel, NameIdentifiedModel):
         return "%s (%s)" % (get_translated(self, 'name'), self.id)
 
 
+class PurposeClosure(models.Model):
+    """
+    A purpose and one of its ancestors, or the purpose itself with depth 0
+
+    Lets resources be filtered by a purpose and all of its descendants
+    with a single lookup. Maintained by update_purpose_closures().
+    """
+    ancestor = models.ForeignKey(Purpose, related_name='descendant_closures', on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Purpose, related_name='ancestor_closures', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = [('ancestor', 'descendant')]
+        verbose_name = _("purpose closure")
+        verbose_name_plural = _("purpose closures")
+
+    def __str__(self):
+        return '%s > %s' % (self.ancestor_id, self.descendant_id)
+
+
+def update_purpose_closures():
+    """
+    Rebuilds the purpose closure table from the parents of the purposes
+
+    There are few purposes, so the whole table is rebuilt at once.
+    """
+    parents = dict(Purpose.objects.values_list('id', 'parent_id'))
+
+    closures = []
+    for purpose_id in parents:
+        ancestor_id = purpose_id
+        depth = 0
+        # The visited ids guard against loops in the hierarchy
+        visited = set()
+        while ancestor_id is not None and ancestor_id not in visited:
+            closures.append(PurposeClosure(ancestor_id=ancestor_id, descendant_id=purpose_id, depth=depth))
+            visited.add(ancestor_id)
+            ancestor_id = parents.get(ancestor_id)
+            depth += 1
+
+    with transaction.atomic():
+        PurposeClosure.objects.all().delete()
+        PurposeClosure.objects.bulk_create(closures)
+
+
 class TermsOfUse(ModifiableModel, AutoIdentifiedModel):
     id = models.CharField(primary_key=True, max_length=100)
     name = models.CharField(verbose_name=_('Name'), max_length=200)
@@ -128,12 +181,51 @@ class TermsOfUse(ModifiableModel, AutoIdentifiedModel):
         return get_translated_name(self)
 
 
+# Text search configurations of the languages that have search vectors
+SEARCH_CONFIGS = {
+    'fi': 'finnish',
+    'en': 'english',
+    'sv': 'swedish',
+}
+
+
+def get_search_vector_updates():
+    """
+    Returns the update expressions of the resource search vectors
+
+    The name is weighted the most, then the description and the unit name.
+    """
+    updates = {}
+    for lang, config in SEARCH_CONFIGS.items():
+        unit_name = Subquery(Unit.objects.filter(pk=OuterRef('unit_id')).values('name_%s' % lang)[:1])
+        updates['search_vector_%s' % lang] = (
+            SearchVector('name_%s' % lang, config=config, weight='A') +
+            SearchVector('description_%s' % lang, config=config, weight='B') +
+            SearchVector(unit_name, config=config, weight='C')
+        )
+    return updates
+
+
+def get_effective_location_update():
+    """
+    Returns the update expression of the resource effective location
+    """
+    unit_location = Subquery(Unit.objects.filter(pk=OuterRef('unit_id')).values('location')[:1])
+    return Cast(Coalesce('location', unit_location), models.PointField(geography=True, srid=4326))
+
+
+def _get_resources_with_permission(user, permission):
+    return UserResourcePermission.objects.filter(user=user, permission=permission).values('resource')
+
+
 class ResourceQuerySet(models.QuerySet):
     def visible_for(self, user):
         if is_general_admin(user):
             return self
-        is_in_managed_units = Q(unit__in=Unit.objects.managed_by(user))
         is_public = Q(public=True)
+        if not is_authenticated_user(user):
+            return self.filter(is_public)
+        is_in_managed_units = Q(id__in=_get_resources_with_permission(user, UserResourcePermission.MANAGER))
         return self.filter(is_in_managed_units | is_public)
 
     def modifiable_by(self, user):
@@ -143,15 +235,88 @@ class ResourceQuerySet(models.QuerySet):
         if is_general_admin(user):
             return self
 
-        units = Unit.objects.managed_by(user)
-        return self.filter(unit__in=units)
+        return self.filter(id__in=_get_resources_with_permission(user, UserResourcePermission.MANAGER))
 
     def with_perm(self, perm, user):
-        units = get_objects_for_user(user, 'unit:%s' % perm, klass=Unit,
-                                     with_superuser=False)
-        resource_groups = get_objects_for_user(user, 'group:%s' % perm, klass=ResourceGroup,
-                                               with_superuser=False)
-        return self.filter(Q(unit__in=units) | Q(groups__in=resource_groups)).distinct()
+        if not is_authenticated_user(user):
+            return self.none()
+
+        # Permissions can be given per-unit or through Resource Groups
+        q = Q(id__in=_get_resources_with_permission(user, perm))
+        # Like in django-guardian, global permissions give access to all of the units or groups
+        if user.has_perm('resources.unit:%s' % perm):
+            q |= Q(unit__isnull=False)
+        if user.has_perm('resources.group:%s' % perm):
+            q |= Q(groups__isnull=False)
+        return self.filter(q).distinct()
+
+    def update_search_vectors(self):
+        return self.update(**get_search_vector_updates())
+
+    def update_effective_locations(self):
+        return self.update(effective_location=get_effective_location_update())
+
+
+class ReservationValidationContext:
+    """
+    The data the validation of one reservation write needs, loaded once
+
+    The permissions of the user to the resource, the opening hours of the
+    days of the reservation and the reservations overlapping it are loaded
+    on first use and shared by all the checks of the write. The overlapping
+    reservations are loaded only when the collision check needs them, which
+    is after the resource has been locked.
+
+    :type resource: Resource
+    :type user: users.models.User | None
+    :type begin: datetime.datetime
+    :type end: datetime.datetime
+    :type original_reservation: Reservation | None
+    """
+    def __init__(self, resource, user, begin, end, original_reservation=None):
+        self.resource = resource
+        self.user = user
+        self.begin = begin
+        self.end = end
+        self.original_reservation = original_reservation
+        # The permission checks of the resource use the preloaded permissions
+        if user is not None:
+            preload_effective_permissions([resource], user)
+
+    @classmethod
+    def for_reservation(cls, reservation, original_reservation=None, user=None):
+        """
+        Returns a context for checking the given reservation on its own
+
+        :type reservation: Reservation
+        :type original_reservation: Reservation | None
+        :type user: users.models.User | None
+        """
+        return cls(reservation.resource, user, reservation.begin, reservation.end,
+                   original_reservation=original_reservation)
+
+    @cached_property
+    def is_admin(self):
+        return self.resource.is_admin(self.user)
+
+    @cached_property
+    def is_manager(self):
+        return self.resource.is_manager(self.user)
+
+    @cached_property
+    def opening_hours(self):
+        # The checks look up the days both in the time zone of the resource
+        # and in the one the times were given in.
+        tz = self.resource.unit.get_tz()
+        dates = [self.begin.date(), self.end.date(), self.begin.astimezone(tz).date(), self.end.astimezone(tz).date()]
+        return self.resource.get_opening_hours(min(dates), max(dates))
+
+    @cached_property
+    def overlapping_reservations(self):
+        reservations = self.resource.reservations.overlaps(self.begin, self.end).active()
+        if self.original_reservation is not None:
+            reservations = reservations.exclude(pk=self.original_reservation.pk)
+        return list(reservations)
 
 
 class Resource(ModifiableModel, AutoIdentifiedModel):
@@ -185,6 +350,8 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
 
     # if not set, location is inherited from unit
     location = models.PointField(verbose_name=_('Location'), null=True, blank=True, srid=settings.DEFAULT_SRID)
+    # location, or the unit location as a fallback, kept up to date by signal handlers
+    effective_location = models.PointField(null=True, editable=False, geography=True, srid=4326)
 
     min_period = models.DurationField(verbose_name=_('Minimum reservation time'),
                                       default=datetime.timedelta(minutes=30))
@@ -233,12 +400,22 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         help_text=_('A link to an external reservation system if this resource is managed elsewhere'),
         null=True, blank=True)
 
+    # Full text search vectors, updated whenever the resource or its unit is saved
+    search_vector_fi = SearchVectorField(null=True, editable=False)
+    search_vector_en = SearchVectorField(null=True, editable=False)
+    search_vector_sv = SearchVectorField(null=True, editable=False)
+
     objects = ResourceQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("resource")
         verbose_name_plural = _("resources")
         ordering = ('unit', 'name',)
+        indexes = [
+            GinIndex(fields=['search_vector_fi']),
+            GinIndex(fields=['search_vector_en']),
+            GinIndex(fields=['search_vector_sv']),
+        ]
 
     def __str__(self):
         return "%s (%s)/%s" % (get_translated(self, 'name'), self.id, self.unit)
@@ -251,7 +428,7 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
 
         return resource_image.image if resource_image else None
 
-    def validate_reservation_period(self, reservation, user, data=None):
+    def validate_reservation_period(self, reservation, user, data=None, validation_context=None):
         """
         Check that given reservation if valid for given user.
 
@@ -266,15 +443,15 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         Normal users cannot make multi day reservations or reservations
         outside opening hours.
 
+        The admin status and the opening hours are taken from the
+        validation context, which is created for the reservation if not
+        given.
+
         :type reservation: Reservation
         :type user: User
         :type data: dict[str, Object]
+        :type validation_context: ReservationValidationContext | None
         """
-
-        # no restrictions for staff
-        if self.is_admin(user):
-            return
-
         tz = self.unit.get_tz()
         # check if data from serializer is present:
         if data:
@@ -294,11 +471,17 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         else:
             end = tz.localize(end)
 
+        validation_context = validation_context or ReservationValidationContext(
+            self, user, begin, end, original_reservation=reservation
+        )
+        # no restrictions for staff
+        if validation_context.is_admin:
+            return
+
         if begin.date() != end.date():
             raise ValidationError(_("You cannot make a multi day reservation"))
 
-        opening_hours = self.get_opening_hours(begin.date(), end.date())
-        days = opening_hours.get(begin.date(), None)
+        days = validation_context.opening_hours.get(begin.date(), None)
         if days is None or not any(day['opens'] and begin >= day['opens'] and end <= day['closes'] for day in days):
             if not self._has_perm(user, 'can_ignore_opening_hours'):
                 raise ValidationError(_("You must start and end the reservation during opening hours"))
@@ -326,28 +509,34 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
                 raise ValidationError(_("Maximum number of active reservations for this resource exceeded."))
 
     def check_reservation_collision(self, begin, end, reservation):
-        overlapping = self.reservations.filter(end__gt=begin, begin__lt=end).active()
+        overlapping = self.reservations.overlaps(begin, end).active()
         if reservation:
             overlapping = overlapping.exclude(pk=reservation.pk)
         return overlapping.exists()
 
-    def get_available_hours(self, start=None, end=None, duration=None, reservation=None, during_closing=False):
+    def get_available_hours(self, start=None, end=None, duration=None, reservation=None, during_closing=False,
+                            opening_hours_cache=None, reservations=None):
         """
         Returns hours that the resource is not reserved for a given date range
 
-        If include_closed=True, will also return hours when the resource is closed, if it is not reserved.
+        If during_closing=True, will also return hours when the resource is closed, if it is not reserved.
         This is so that admins can book resources during closing hours. Returns
         the available hours as a list of dicts. The optional reservation argument
         is for disregarding a given reservation during checking, if we wish to
         move an existing reservation. The optional duration argument specifies
         minimum length for periods to be returned.
 
+        The opening hours and the reservations of the range can be given in
+        opening_hours_cache and reservations to avoid querying them.
+
         :rtype: list[dict[str, datetime.datetime]]
         :type start: datetime.datetime
         :type end: datetime.datetime
         :type duration: datetime.timedelta
         :type reservation: Reservation
         :type during_closing: bool
+        :type opening_hours_cache: list[ResourceDailyOpeningHours]
+        :type reservations: list[Reservation]
         """
         today = arrow.get(timezone.now())
         if start is None:
@@ -362,61 +551,29 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
             start = tz.localize(start)
             end = tz.localize(end)
 
-        if not during_closing:
-            """
-            Check open hours only
-            """
-            open_hours = self.get_opening_hours(start, end)
-            hours_list = []
-            for date, open_during_date in open_hours.items():
+        if during_closing:
+            open_intervals = [(start, end)]
+        else:
+            open_hours = self.get_opening_hours(start, end, opening_hours_cache=opening_hours_cache)
+            open_intervals = []
+            for open_during_date in open_hours.values():
                 for period in open_during_date:
-                    if period['opens']:
-                        # if the start or end straddle opening hours
-                        opens = period['opens'] if period['opens'] > start else start
-                        closes = period['closes'] if period['closes'] < end else end
-                        # include_closed to prevent recursion, opening hours need not be rechecked
-                        hours_list.extend(self.get_available_hours(start=opens,
-                                                                   end=closes,
-                                                                   duration=duration,
-                                                                   reservation=reservation,
-                                                                   during_closing=True))
-            return hours_list
-
-        reservations = self.reservations.filter(
-            end__gte=start, begin__lte=end).order_by('begin')
-        hours_list = [({'starts': start})]
-        first_checked = False
-        for res in reservations:
-            # skip the reservation that is being edited
-            if res == reservation:
-                continue
-            # check if the reservation spans the beginning
-            if not first_checked:
-                first_checked = True
-                if res.begin < start:
-                    if res.end > end:
-                        return []
-                    hours_list[0]['starts'] = res.end
-                    # proceed to the next reservation
-                    continue
-            if duration:
-                if res.begin - hours_list[-1]['starts'] < duration:
-                    # the free period is too short, discard this period
-                    hours_list[-1]['starts'] = res.end
-                    continue
-            hours_list[-1]['ends'] = timezone.localtime(res.begin)
-            # check if the reservation spans the end
-            if res.end > end:
-                return hours_list
-            hours_list.append({'starts': timezone.localtime(res.end)})
-        # after the last reservation, we must check if the remaining free period is too short
-        if duration:
-            if end - hours_list[-1]['starts'] < duration:
-                hours_list.pop()
-                return hours_list
-        # otherwise add the remaining free period
-        hours_list[-1]['ends'] = end
-        return hours_list
+                    if not period['opens']:
+                        continue
+                    # if the start or end straddle opening hours
+                    opens = max(period['opens'], start)
+                    closes = min(period['closes'], end)
+                    if opens < closes:
+                        open_intervals.append((opens, closes))
+
+        if reservations is None:
+            reservations = self.reservations.overlaps(start, end).current()
+        reserved_intervals = [(res.begin, res.end) for res in reservations if res != reservation]
+
+        free_intervals = get_free_intervals(open_intervals, reserved_intervals, min_length=duration)
+        return [
+            {'starts': timezone.localtime(begin), 'ends': timezone.localtime(end)} for begin, end in free_intervals
+        ]
 
     def get_opening_hours(self, begin=None, end=None, opening_hours_cache=None):
         """
@@ -508,6 +665,55 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         if add_objs:
             ResourceDailyOpeningHours.objects.bulk_create(add_objs)
 
+        changed = list(to_delete.items()) + list(to_add.items())
+        if changed:
+            self.update_free_time(min(opens for opens, closes in changed), max(closes for opens, closes in changed))
+
+    def update_free_time(self, begin=None, end=None):
+        """
+        Recalculate the free time of the resource
+
+        Free time is stored for every stretch of the opening hours that is not
+        covered by a current reservation. Only the opening hours overlapping
+        the given range are recalculated. If no range is given, all free time
+        of the resource is recalculated.
+
+        The recalculations of a resource are run one at a time, so that the
+        reservations made concurrently are seen by the last one of them even
+        when the resource itself is not locked for the reservation.
+
+        :type begin: datetime.datetime | None
+        :type end: datetime.datetime | None
+        """
+        with transaction.atomic():
+            lock_for_transaction(RESOURCE_FREE_TIME_LOCK, self.pk)
+            self._update_free_time(begin, end)
+
+    def _update_free_time(self, begin, end):
+        hours = self.opening_hours.all()
+        free_time = self.free_time.all()
+        if begin is not None and end is not None:
+            hours = hours.filter(open_between__overlap=(begin, end, '[)'))
+        open_intervals = [(h.open_between.lower, h.open_between.upper) for h in hours]
+
+        if begin is not None and end is not None:
+            span_begin = min([begin] + [opens for opens, closes in open_intervals])
+            span_end = max([end] + [closes for opens, closes in open_intervals])
+            free_time = free_time.filter(free_between__overlap=(span_begin, span_end, '[)'))
+        free_time.delete()
+
+        if not open_intervals:
+            return
+
+        span_begin = min(opens for opens, closes in open_intervals)
+        span_end = max(closes for opens, closes in open_intervals)
+        reservations = self.reservations.current().overlaps(span_begin, span_end)
+        free_intervals = get_free_intervals(open_intervals, reservations.values_list('begin', 'end'))
+        ResourceDailyFreeTime.objects.bulk_create([
+            ResourceDailyFreeTime(resource=self, free_between=(free_begin, free_end, '[)'))
+            for free_begin, free_end in free_intervals
+        ])
+
     def is_admin(self, user):
         """
         Check if the given user is an administrator of this resource.
@@ -517,9 +723,11 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         """
         # UserFilterBackend and ReservationFilterSet in resources.api.reservation assume the same behaviour,
         # so if this is changed those need to be changed as well.
-        if not self.unit:
-            return is_general_admin(user)
-        return self.unit.is_admin(user)
+        if is_general_admin(user):
+            return True
+        if not self.unit_id or not is_authenticated_user(user):
+            return False
+        return UserResourcePermission.ADMIN in self.get_effective_permissions(user)
 
     def is_manager(self, user):
         """
@@ -528,9 +736,26 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         :type user: users.models.User
         :rtype: bool
         """
-        if not self.unit:
-            return is_general_admin(user)
-        return self.unit.is_manager(user)
+        if is_general_admin(user):
+            return True
+        if not self.unit_id or not is_authenticated_user(user):
+            return False
+        return UserResourcePermission.MANAGER in self.get_effective_permissions(user)
+
+    def get_effective_permissions(self, user):
+        """
+        Returns the names of the permissions and roles the user has to this resource
+
+        See UserResourcePermission. The permissions can be loaded for many
+        resources at once with preload_effective_permissions().
+
+        :type user: users.models.User
+        :rtype: set[str]
+        """
+        preloaded = getattr(self, '_effective_permissions', {})
+        if user.pk in preloaded:
+            return preloaded[user.pk]
+        return set(self.effective_user_permissions.filter(user=user).values_list('permission', flat=True))
 
     def _has_perm(self, user, perm, allow_admin=True):
         if not is_authenticated_user(user):
@@ -538,17 +763,14 @@ class Resource(ModifiableModel, AutoIdentifiedModel):
         # Admins are almighty.
         if self.is_admin(user) and allow_admin:
             return True
-        if hasattr(self, '_permission_checker'):
-            checker = self._permission_checker
-        else:
-            checker = ObjectPermissionChecker(user)
-
-        # Permissions can be given per-unit
-        if checker.has_perm('unit:%s' % perm, self.unit):
+        # The same rules as in django-guardian's ObjectPermissionChecker
+        if not user.is_active:
+            return False
+        if user.is_superuser:
             return True
-        # ... or through Resource Groups
-        resource_group_perms = [checker.has_perm('group:%s' % perm, rg) for rg in self.groups.all()]
-        return any(resource_group_perms)
+
+        # Permissions can be given per-unit or through Resource Groups
+        return perm in self.get_effective_permissions(user)
 
     def get_users_with_perm(self, perm):
         users = {u for u in get_users_with_perms(self.unit) if u.has_perm('unit:%s' % perm, self.unit)}
@@ -642,9 +864,20 @@ class ResourceImage(ModifiableModel):
     image_format = models.CharField(max_length=10)
     cropping = ImageRatioField('image', '800x800', verbose_name=_('Cropping'))
     sort_order = models.PositiveSmallIntegerField(verbose_name=_('Sort order'))
+    # MD5 of the image file, see get_version()
+    image_hash = models.CharField(max_length=32, blank=True, default='', editable=False)
+    # Set when the processing of a new image file has been left for the
+    # process_resource_images management command
+    processing_pending = models.BooleanField(default=False, editable=False)
 
     def save(self, *args, **kwargs):
-        self._process_image()
+        if self._should_process_later():
+            self._check_image()
+            self.processing_pending = True
+        else:
+            self._process_image()
+        if self.image and (not self.image._committed or not self.image_hash):
+            self.image_hash = self._calculate_image_hash()
         if self.sort_order is None:
             other_images = self.resource.images.order_by('-sort_order')
             if not other_images:
@@ -663,9 +896,48 @@ class ResourceImage(ModifiableModel):
 
     def full_clean(self, exclude=(), validate_unique=True):
         if "image" not in exclude:
-            self._process_image()
+            if self._should_process_later():
+                self._check_image()
+            else:
+                self._process_image()
         return super(ResourceImage, self).full_clean(exclude, validate_unique)
 
+    def _should_process_later(self):
+        """
+        Tells whether a new image file is only checked now and processed later
+
+        See the RESPA_IMAGE_PROCESSING_ASYNC setting.
+        """
+        if not getattr(settings, 'RESPA_IMAGE_PROCESSING_ASYNC', False) or getattr(self, '_processing', False):
+            return False
+        return bool(self.image) and not self.image._committed
+
+    def _open_image(self, load):
+        try:
+            img = Image.open(self.image)
+            if load:
+                img.load()
+        except Exception as exc:
+            raise InvalidImage("Image %s not valid (%s)" % (self.image, exc)) from exc
+        return img
+
+    def _get_target_format(self, img):
+        if img.format in ("JPEG", "PNG"):
+            return img.format, None
+        if self.type in ("map", "ground_plan"):
+            return "PNG", {}
+        return "JPEG", {"quality": 75, "progressive": True}
+
+    def _check_image(self):
+        """
+        Checks the header of the uploaded image file and sets the format it will have
+
+        :raises InvalidImage: Exception raised if the uploaded file is not valid.
+        """
+        if not self.image:
+            return
+        self.image_format = self._get_target_format(self._open_image(load=False))[0]
+
     def _process_image(self):
         """
         Preprocess the uploaded image file, if required.
@@ -677,37 +949,90 @@ class ResourceImage(ModifiableModel):
         if not self.image:  # No image set - we can't do this right now
             return
 
-        if self.image_format:  # Assume that if image_format is set, no further processing is required
+        # Assume that if image_format is set, no further processing is required
+        if self.image_format and not self.processing_pending:
             return
 
-        try:
-            img = Image.open(self.image)
-            img.load()
-        except Exception as exc:
-            raise InvalidImage("Image %s not valid (%s)" % (self.image, exc)) from exc
-
-        if img.format not in ("JPEG", "PNG"):  # Needs transcoding.
-            if self.type in ("map", "ground_plan"):
-                target_format = "PNG"
-                save_kwargs = {}
-            else:
-                target_format = "JPEG"
-                save_kwargs = {"quality": 75, "progressive": True}
+        img = self._open_image(load=True)
+        target_format, save_kwargs = self._get_target_format(img)
+        if img.format != target_format:  # Needs transcoding.
             image_bio = BytesIO()
             img.save(image_bio, format=target_format, **save_kwargs)
             self.image = ContentFile(
                 image_bio.getvalue(),
-                name=os.path.splitext(self.image.name)[0] + ".%s" % target_format.lower()
+                name=os.path.splitext(os.path.basename(self.image.name))[0] + ".%s" % target_format.lower()
             )
-            self.image_format = target_format
-        else:  # All good -- keep the file as-is.
-            self.image_format = img.format
+        self.image_format = target_format
+
+    def process(self):
+        """
+        Does the processing that was left for later when the image was saved
+
+        The image is transcoded if needed, and its variants are generated
+        after the save.
+        """
+        original = self.image
+        self._processing = True
+        try:
+            self._process_image()
+            self.processing_pending = False
+            self.save()
+        finally:
+            self._processing = False
+        if original.name != self.image.name:
+            transaction.on_commit(lambda: original.storage.delete(original.name))
+
+    def _calculate_image_hash(self):
+        digest = hashlib.md5()
+        for chunk in self.image.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_version(self):
+        """
+        Returns a string that changes whenever the served image data may change
+
+        The version is added to the image URLs, so that the images can be
+        cached indefinitely. Empty if the hash of the image is not known.
+        """
+        if not self.image_hash:
+            return ''
+        return hashlib.md5(('%s:%s' % (self.image_hash, self.cropping)).encode('utf8')).hexdigest()[:16]
+
+    def get_url(self):
+        url = reverse('resource-image-view', args=[str(self.id)])
+        version = self.get_version()
+        if version:
+            url += '?v=%s' % version
+        return url
 
     def get_full_url(self):
         base_url = getattr(settings, 'RESPA_IMAGE_BASE_URL', None)
         if not base_url:
             return None
-        return base_url.rstrip('/') + reverse('resource-image-view', args=[str(self.id)])
+        return base_url.rstrip('/') + self.get_url()
+
+    def get_variant(self, width, height):
+        """
+        Returns the image cropped and scaled to the given size
+
+        The variant is generated and stored on the first call, later ones
+        return the stored file.
+        """
+        return get_thumbnailer(self.image).get_thumbnail({
+            'size': (width, height),
+            'box': self.cropping,
+            'crop': True,
+            'detail': True,
+        })
+
+    def generate_variants(self):
+        """
+        Generates the variants of the sizes in the RESPA_IMAGE_VARIANT_SIZES setting
+        """
+        for size in getattr(settings, 'RESPA_IMAGE_VARIANT_SIZES', ()):
+            width, height = (int(x) for x in size.split('x'))
+            self.get_variant(width, height)
 
     def __str__(self):
         return "%s image for %s" % (self.get_type_display(), str(self.resource))
@@ -782,3 +1107,27 @@ class ResourceDailyOpeningHours(models.Model):
             lower = self.open_between.lower
             upper = self.open_between.upper
         return "%s: %s -> %s" % (self.resource, lower, upper)
+
+
+class ResourceDailyFreeTime(models.Model):
+    """
+    Calculated automatically for each part of the opening hours the resource is not reserved
+    """
+    resource = models.ForeignKey(
+        Resource, related_name='free_time', on_delete=models.CASCADE, db_index=True
+    )
+    free_between = DateTimeRangeField()
+
+    class Meta:
+        indexes = [
+            GistIndex(fields=['free_between'])
+        ]
+
+    def __str__(self):
+        if isinstance(self.free_between, tuple):
+            lower = self.free_between[0]
+            upper = self.free_between[1]
+        else:
+            lower = self.free_between.lower
+            upper = self.free_between.upper
+        return "%s: %s -> %s" % (self.resource, lower, upper)
@@ -0,0 +1,155 @@
+from collections import defaultdict
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.translation import ugettext_lazy as _
+
+from ..enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
+
+
+class UserResourcePermission(models.Model):
+    """
+    A permission a user has to a resource through its unit or resource groups
+
+    Calculated automatically from the unit and unit group authorizations and
+    the object permissions of the units and resource groups, so that the
+    permissions of a user can be checked with a single indexed lookup. See
+    update_user_resource_permissions().
+
+    The permission is either the name of a resource permission, e.g.
+    `can_make_reservations`, or one of the roles ADMIN and MANAGER. Admins
+    always have the MANAGER role too. General administrators have no rows,
+    they are checked separately.
+    """
+    ADMIN = 'admin'
+    MANAGER = 'manager'
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='effective_resource_permissions', on_delete=models.CASCADE,
+        db_index=False
+    )
+    resource = models.ForeignKey(
+        'Resource', related_name='effective_user_permissions', on_delete=models.CASCADE, db_index=True
+    )
+    permission = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = [('user', 'permission', 'resource')]
+        verbose_name = _("user resource permission")
+        verbose_name_plural = _("user resource permissions")
+
+    def __str__(self):
+        return '%s / %s: %s' % (self.resource_id, self.permission, self.user_id)
+
+
+def _get_object_permissions(model_name, prefix, object_ids, users):
+    """
+    Yields (user id, object id, permission name) of the django-guardian permissions to the given objects
+    """
+    UserObjectPermission = global_apps.get_model('guardian', 'UserObjectPermission')
+    GroupObjectPermission = global_apps.get_model('guardian', 'GroupObjectPermission')
+    object_pks = [str(x) for x in object_ids]
+
+    for model, user_field in ((UserObjectPermission, 'user'), (GroupObjectPermission, 'group__user')):
+        qs = model.objects.filter(
+            content_type__app_label='resources', content_type__model=model_name, object_pk__in=object_pks,
+            permission__codename__startswith=prefix, **{'%s__isnull' % user_field: False}
+        )
+        if users is not None:
+            qs = qs.filter(**{'%s__in' % user_field: users})
+        for user_id, object_pk, codename in qs.values_list(user_field, 'object_pk', 'permission__codename'):
+            yield user_id, object_pk, codename[len(prefix):]
+
+
+def get_user_resource_permissions(users=None, resources=None):
+    """
+    Returns the (user id, resource id, permission) tuples of the given users and resources
+
+    :param users: ids or a queryset of the users, or None for all of them
+    :param resources: ids or a queryset of the resources, or None for all of them
+    :rtype: set[tuple]
+    """
+    Resource = global_apps.get_model('resources', 'Resource')
+    ResourceGroup = global_apps.get_model('resources', 'ResourceGroup')
+    UnitAuthorization = global_apps.get_model('resources', 'UnitAuthorization')
+    UnitGroupAuthorization = global_apps.get_model('resources', 'UnitGroupAuthorization')
+
+    resource_qs = Resource.objects.all()
+    if resources is not None:
+        resource_qs = resource_qs.filter(id__in=resources)
+
+    resources_by_unit = defaultdict(list)
+    for resource_id, unit_id in resource_qs.filter(unit__isnull=False).values_list('id', 'unit_id'):
+        resources_by_unit[unit_id].append(resource_id)
+    resources_by_group = defaultdict(list)
+    group_memberships = ResourceGroup.resources.through.objects.filter(resource__in=resource_qs)
+    for resource_id, group_id in group_memberships.values_list('resource_id', 'resourcegroup_id'):
+        resources_by_group[str(group_id)].append(resource_id)
+
+    unit_permissions = set()
+    unit_ids = list(resources_by_unit)
+
+    admin_roles = (UserResourcePermission.ADMIN, UserResourcePermission.MANAGER)
+    authorizations = (
+        (UnitAuthorization.objects.filter(subject__in=unit_ids, level=UnitAuthorizationLevel.admin), 'subject',
+         admin_roles),
+        (UnitAuthorization.objects.filter(subject__in=unit_ids, level=UnitAuthorizationLevel.manager), 'subject',
+         (UserResourcePermission.MANAGER,)),
+        (UnitGroupAuthorization.objects.filter(subject__members__in=unit_ids, level=UnitGroupAuthorizationLevel.admin),
+         'subject__members', admin_roles),
+    )
+    for qs, unit_field, roles in authorizations:
+        if users is not None:
+            qs = qs.filter(authorized__in=users)
+        for user_id, unit_id in qs.values_list('authorized', unit_field):
+            unit_permissions.update((user_id, unit_id, role) for role in roles)
+
+    unit_permissions.update(_get_object_permissions('unit', 'unit:', unit_ids, users))
+
+    permissions = set()
+    for user_id, unit_id, permission in unit_permissions:
+        permissions.update((user_id, resource_id, permission) for resource_id in resources_by_unit[unit_id])
+    group_permissions = _get_object_permissions('resourcegroup', 'group:', resources_by_group, users)
+    for user_id, group_id, permission in group_permissions:
+        permissions.update((user_id, resource_id, permission) for resource_id in resources_by_group[group_id])
+
+    return permissions
+
+
+def update_user_resource_permissions(users=None, resources=None):
+    """
+    Recalculates the UserResourcePermissions of the given users to the given resources
+
+    The arguments are the same as with get_user_resource_permissions().
+    """
+    permissions = get_user_resource_permissions(users, resources)
+
+    existing = UserResourcePermission.objects.all()
+    if users is not None:
+        existing = existing.filter(user__in=users)
+    if resources is not None:
+        existing = existing.filter(resource__in=resources)
+
+    with transaction.atomic():
+        existing.delete()
+        UserResourcePermission.objects.bulk_create([
+            UserResourcePermission(user_id=user_id, resource_id=resource_id, permission=permission)
+            for user_id, resource_id, permission in permissions
+        ], batch_size=1000)
+
+
+def preload_effective_permissions(resources, user):
+    """
+    Loads the permissions of the user to all of the given resources with one query
+
+    See Resource.get_effective_permissions().
+    """
+    if not user.is_authenticated:
+        return
+    permissions = defaultdict(set)
+    qs = UserResourcePermission.objects.filter(user=user, resource__in=[res.id for res in resources])
+    for resource_id, permission in qs.values_list('resource', 'permission'):
+        permissions[resource_id].add(permission)
+    for res in resources:
+        res._effective_permissions = {user.pk: permissions[res.id]}
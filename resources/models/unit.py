@@ -90,12 +90,16 @@ class Unit(ModifiableModel, AutoIdentifiedModel):
     def __str__(self):
         return "%s (%s)" % (get_translated(self, 'name'), self.id)
 
-    def get_opening_hours(self, begin=None, end=None):
+    def get_opening_hours(self, begin=None, end=None, opening_hours_cache=None):
         """
         :rtype : dict[str, list[dict[str, datetime.datetime]]]
         :type begin: datetime.date
         :type end: datetime.date
+        :type opening_hours_cache: tuple[list[Period], list[Day]] | None
         """
+        if opening_hours_cache is not None:
+            periods, days = opening_hours_cache
+            return get_opening_hours(self.time_zone, list(periods), begin, end, days=days)
         return get_opening_hours(self.time_zone, list(self.periods.all()), begin, end)
 
     def update_opening_hours(self):
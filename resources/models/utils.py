@@ -7,6 +7,7 @@ import logging
 
 import arrow
 from django.conf import settings
+from django.db import connection
 from django.utils import formats
 from django.utils.translation import ungettext
 from django.core.mail import EmailMultiAlternatives
@@ -21,6 +22,31 @@ import xlsxwriter
 
 DEFAULT_LANG = settings.LANGUAGES[0][0]
 
+# The namespaces of the advisory locks, see lock_for_transaction()
+RESOURCE_FREE_TIME_LOCK = 1
+RESERVATION_OUTBOX_LOCK = 2
+
+
+def lock_for_transaction(namespace, key, wait=True):
+    """
+    Take a PostgreSQL advisory lock on the given key, held until the end of the transaction
+
+    Unlike row locks, advisory locks do not block the writes of the rows
+    the key refers to. Without wait, the lock is only taken if it is free.
+    Returns whether the lock was taken.
+
+    :type namespace: int
+    :type key: str | int
+    :type wait: bool
+    :rtype: bool
+    """
+    with connection.cursor() as cursor:
+        if wait:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', [namespace, str(key)])
+            return True
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))', [namespace, str(key)])
+        return cursor.fetchone()[0]
+
 
 def save_dt(obj, attr, dt, orig_tz="UTC"):
     """
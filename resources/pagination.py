@@ -1,28 +1,131 @@
-from rest_framework.pagination import PageNumberPagination, _positive_int
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination, _positive_int
+
+
+def is_stream_requested(request):
+    """
+    Tells whether the client asked for a streamed JSON response with `?stream=true`
+    """
+    if request.query_params.get('stream', '').lower() not in ('1', 'true'):
+        return False
+    return request.accepted_renderer.format == 'json'
+
+
+def get_page_size(paginator, request, cutoff):
+    if paginator.page_size_query_param:
+        try:
+            return _positive_int(
+                request.query_params[paginator.page_size_query_param],
+                strict=True, cutoff=cutoff
+            )
+        except (KeyError, ValueError):
+            pass
+
+    return paginator.page_size
+
+
+def get_reservation_page_size(paginator, request):
+    cutoff = paginator.max_page_size
+    if request.query_params.get('format', '').lower() == 'xlsx':
+        cutoff = 50000
+    elif getattr(paginator, 'max_stream_page_size', None) and is_stream_requested(request):
+        cutoff = paginator.max_stream_page_size
+    return get_page_size(paginator, request, cutoff)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on a fixed unique ordering, without a count query.
+
+    An empty `?cursor=` starts from the first page.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def decode_cursor(self, request):
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        return super().decode_cursor(request)
+
+    def get_ordering(self, request, queryset, view):
+        # The keyset must stay stable between pages, so the client-chosen
+        # ordering is ignored in cursor mode.
+        return self.ordering
+
+
+class ResourceKeysetPagination(KeysetPagination):
+    # The default language column is always filled in, unlike the other translations
+    ordering = ('name_%s' % settings.LANGUAGES[0][0], 'id')
+
+
+class ReservationKeysetPagination(KeysetPagination):
+    ordering = ('begin', 'id')
+
+    def get_page_size(self, request):
+        return get_reservation_page_size(self, request)
 
 
 class DefaultPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'  # Allow client to override, using `?page_size=xxx
     max_page_size = 500
+    # Used instead of page numbers when the client passes `?cursor=`
+    keyset_pagination_class = None
+    # Streamed responses are not held in memory, so their pages can be
+    # longer. Set for the views using StreamingListMixin.
+    max_stream_page_size = None
+
+    def get_page_size(self, request):
+        if self.max_stream_page_size and is_stream_requested(request):
+            return get_page_size(self, request, self.max_stream_page_size)
+        return super().get_page_size(request)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_paginator = None
+        if self.keyset_pagination_class and self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset_paginator = self.keyset_pagination_class()
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_queryset_lazily(self, queryset, request, view=None):
+        """
+        Like paginate_queryset(), but returns the page as an unevaluated queryset
+
+        Only page numbers are supported.
+        """
+        self.keyset_paginator = None
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.request = request
+        return self.page.object_list
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
 
 
 class PurposePagination(DefaultPagination):
     page_size = 40
 
 
+class ResourcePagination(DefaultPagination):
+    keyset_pagination_class = ResourceKeysetPagination
+    max_stream_page_size = 50000
+
+
 class ReservationPagination(DefaultPagination):
+    keyset_pagination_class = ReservationKeysetPagination
+    max_stream_page_size = 50000
+
     def get_page_size(self, request):
-        if self.page_size_query_param:
-            cutoff = self.max_page_size
-            if request.query_params.get('format', '').lower() == 'xlsx':
-                cutoff = 50000
-            try:
-                return _positive_int(
-                    request.query_params[self.page_size_query_param],
-                    strict=True, cutoff=cutoff
-                )
-            except (KeyError, ValueError):
-                pass
-
-        return self.page_size
+        return get_reservation_page_size(self, request)
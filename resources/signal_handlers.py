@@ -0,0 +1,262 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from .cache import (
+    EQUIPMENT, FAVORITES, OPENING_HOURS, PERMISSIONS, PURPOSES, RESERVATION_METADATA_SETS, RESERVATIONS,
+    RESOURCE_REPRESENTATION, RESOURCE_TYPES, TERMS_OF_USE, UNITS, bump_cache_version
+)
+from .models import (
+    Day, Equipment, EquipmentAlias, EquipmentCategory, Period, Purpose, Reservation, ReservationMetadataField,
+    ReservationMetadataSet, Resource, ResourceEquipment, ResourceGroup, ResourceImage, ResourceType, TermsOfUse, Unit,
+    UnitAuthorization, UnitGroup, UnitGroupAuthorization
+)
+from .models.resource import update_purpose_closures
+from .models.resource_permission import update_user_resource_permissions
+
+User = get_user_model()
+
+# The cached values that have to be invalidated when the given models are
+# saved or deleted.
+CACHE_MODELS = {
+    RESOURCE_REPRESENTATION: (
+        Resource, ResourceImage, ResourceEquipment, Purpose, TermsOfUse, ResourceType, Equipment, EquipmentAlias,
+        EquipmentCategory, ReservationMetadataSet, Unit,
+    ),
+    RESERVATION_METADATA_SETS: (ReservationMetadataSet, ReservationMetadataField),
+    RESOURCE_TYPES: (ResourceType,),
+    TERMS_OF_USE: (TermsOfUse,),
+    EQUIPMENT: (Equipment, EquipmentAlias, EquipmentCategory),
+    UNITS: (Unit,),
+    OPENING_HOURS: (Period, Day),
+    RESERVATIONS: (Reservation,),
+    PURPOSES: (Purpose,),
+    # The flags of the user itself are checked in each request
+    PERMISSIONS: (UnitAuthorization, UnitGroup, UnitGroupAuthorization, UserObjectPermission, GroupObjectPermission),
+}
+CACHE_M2M_MODELS = {
+    RESOURCE_REPRESENTATION: (
+        Resource.purposes.through, ReservationMetadataSet.supported_fields.through,
+        ReservationMetadataSet.required_fields.through,
+    ),
+    RESERVATION_METADATA_SETS: (
+        ReservationMetadataSet.supported_fields.through, ReservationMetadataSet.required_fields.through,
+    ),
+    PERMISSIONS: (
+        Resource.groups.through, UnitGroup.members.through, User.groups.through, User.user_permissions.through,
+        Group.permissions.through,
+    ),
+    FAVORITES: (User.favorite_resources.through,),
+}
+
+
+def _get_invalidate_handler(name):
+    def invalidate(sender, **kwargs):
+        bump_cache_version(name)
+    return invalidate
+
+
+for name, models in CACHE_MODELS.items():
+    handler = _get_invalidate_handler(name)
+    for model in models:
+        post_save.connect(handler, sender=model, weak=False,
+                          dispatch_uid='%s-save-%s' % (name, model._meta.label_lower))
+        post_delete.connect(handler, sender=model, weak=False,
+                            dispatch_uid='%s-delete-%s' % (name, model._meta.label_lower))
+
+for name, models in CACHE_M2M_MODELS.items():
+    handler = _get_invalidate_handler(name)
+    for model in models:
+        m2m_changed.connect(handler, sender=model, weak=False,
+                            dispatch_uid='%s-m2m-%s' % (name, model._meta.label_lower))
+
+
+@receiver(post_save, sender=Resource, dispatch_uid='resource-search-vectors')
+def update_resource_search_vectors(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Resource.objects.filter(pk=instance.pk).update_search_vectors()
+
+
+@receiver(post_save, sender=Unit, dispatch_uid='unit-resource-search-vectors')
+def update_unit_resource_search_vectors(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Resource.objects.filter(unit=instance).update_search_vectors()
+
+
+@receiver(post_save, sender=Resource, dispatch_uid='resource-effective-location')
+def update_resource_effective_location(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Resource.objects.filter(pk=instance.pk).update_effective_locations()
+
+
+@receiver(post_save, sender=Unit, dispatch_uid='unit-resource-effective-locations')
+def update_unit_resource_effective_locations(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Resource.objects.filter(unit=instance, location__isnull=True).update_effective_locations()
+
+
+@receiver(post_save, sender=ResourceImage, dispatch_uid='resource-image-variants')
+def generate_resource_image_variants(sender, instance, raw=False, **kwargs):
+    # Pending images get their variants once processed
+    if raw or instance.processing_pending:
+        return
+    instance.generate_variants()
+
+
+@receiver(post_save, sender=Purpose, dispatch_uid='purpose-closures-save')
+@receiver(post_delete, sender=Purpose, dispatch_uid='purpose-closures-delete')
+def update_purpose_closures_on_change(sender, **kwargs):
+    # The closures only depend on the purposes themselves, so they are
+    # rebuilt on raw saves too.
+    update_purpose_closures()
+
+
+# The user resource permissions are recalculated for the users and the
+# resources affected by each change.
+
+def _get_permission_object_resources(content_type, object_pk):
+    model = content_type.model_class()
+    if model == Unit:
+        return Resource.objects.filter(unit=object_pk).values_list('id', flat=True)
+    if model == ResourceGroup:
+        return Resource.objects.filter(groups=object_pk).values_list('id', flat=True)
+    return None
+
+
+def _get_object_permission_scope(instance):
+    resources = _get_permission_object_resources(instance.content_type, instance.object_pk)
+    if resources is None:
+        return None
+    if isinstance(instance, GroupObjectPermission):
+        users = User.objects.filter(groups=instance.group_id).values_list('id', flat=True)
+    else:
+        users = [instance.user_id]
+    return {'users': users, 'resources': resources}
+
+
+USER_PERMISSION_SCOPES = {
+    UnitAuthorization: lambda instance: {
+        'users': [instance.authorized_id],
+        'resources': Resource.objects.filter(unit=instance.subject_id).values_list('id', flat=True),
+    },
+    UnitGroupAuthorization: lambda instance: {
+        'users': [instance.authorized_id],
+        'resources': Resource.objects.filter(unit__unit_groups=instance.subject_id).values_list('id', flat=True),
+    },
+    UserObjectPermission: _get_object_permission_scope,
+    GroupObjectPermission: _get_object_permission_scope,
+    # The group memberships of a deleted resource group are gone before post_delete
+    ResourceGroup: lambda instance: {
+        'resources': Resource.objects.filter(groups=instance.pk).values_list('id', flat=True),
+    },
+}
+
+
+def _resolve_user_permission_scope(sender, instance):
+    scope = USER_PERMISSION_SCOPES[sender](instance)
+    if scope is not None:
+        scope = {key: list(value) for key, value in scope.items()}
+    return scope
+
+
+def resolve_user_permission_scope_before_save(sender, instance, raw=False, **kwargs):
+    # The authorizations and permissions can be moved to another user or
+    # object in place, so the scope of the old values is recalculated too.
+    old_instance = None
+    if not raw and instance.pk is not None:
+        old_instance = sender.objects.filter(pk=instance.pk).first()
+    instance._old_user_permission_scope = (
+        _resolve_user_permission_scope(sender, old_instance) if old_instance is not None else None
+    )
+
+
+def update_user_permissions_after_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old_scope = getattr(instance, '_old_user_permission_scope', None)
+    if old_scope is not None:
+        update_user_resource_permissions(**old_scope)
+    scope = USER_PERMISSION_SCOPES[sender](instance)
+    if scope is not None:
+        update_user_resource_permissions(**scope)
+
+
+def resolve_user_permission_scope_before_delete(sender, instance, **kwargs):
+    # The related objects the scope is found through may be deleted along
+    # with the instance, so the scope is resolved beforehand.
+    instance._user_permission_scope = _resolve_user_permission_scope(sender, instance)
+
+
+def update_user_permissions_after_delete(sender, instance, **kwargs):
+    scope = getattr(instance, '_user_permission_scope', None)
+    if scope is not None:
+        update_user_resource_permissions(**scope)
+
+
+for model in USER_PERMISSION_SCOPES:
+    label = model._meta.label_lower
+    if model != ResourceGroup:
+        pre_save.connect(resolve_user_permission_scope_before_save, sender=model,
+                         dispatch_uid='user-permissions-pre-save-%s' % label)
+        post_save.connect(update_user_permissions_after_save, sender=model,
+                          dispatch_uid='user-permissions-save-%s' % label)
+    pre_delete.connect(resolve_user_permission_scope_before_delete, sender=model,
+                       dispatch_uid='user-permissions-pre-delete-%s' % label)
+    post_delete.connect(update_user_permissions_after_delete, sender=model,
+                        dispatch_uid='user-permissions-delete-%s' % label)
+
+
+@receiver(post_save, sender=Resource, dispatch_uid='resource-user-permissions')
+def update_resource_user_permissions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    update_user_resource_permissions(resources=[instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid='user-groups-user-permissions')
+def update_user_groups_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The members of the group are gone after the clear
+        instance._user_permission_clear_users = list(instance.user_set.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        update_user_resource_permissions(users=[instance.pk])
+    elif action == 'post_clear':
+        update_user_resource_permissions(users=instance._user_permission_clear_users)
+    else:
+        update_user_resource_permissions(users=pk_set)
+
+
+@receiver(m2m_changed, sender=UnitGroup.members.through, dispatch_uid='unit-group-members-user-permissions')
+def update_unit_group_members_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        update_user_resource_permissions(resources=Resource.objects.filter(unit=instance).values('id'))
+    elif action == 'post_clear':
+        users = UnitGroupAuthorization.objects.filter(subject=instance).values('authorized')
+        update_user_resource_permissions(users=users)
+    else:
+        update_user_resource_permissions(resources=Resource.objects.filter(unit__in=pk_set).values('id'))
+
+
+@receiver(m2m_changed, sender=ResourceGroup.resources.through, dispatch_uid='resource-group-resources-user-permissions')
+def update_resource_group_resources_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action == 'pre_clear':
+        # The resources of the group are gone after the clear
+        instance._user_permission_clear_resources = list(instance.resources.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        update_user_resource_permissions(resources=[instance.pk])
+    elif action == 'post_clear':
+        update_user_resource_permissions(resources=instance._user_permission_clear_resources)
+    else:
+        update_user_resource_permissions(resources=pk_set)
@@ -3,12 +3,20 @@ import pytest
 import datetime
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from rest_framework.test import APIClient, APIRequestFactory
 
 from resources.models import Resource, ResourceType, Unit, Purpose, Day, Period
 from resources.models import Equipment, EquipmentAlias, ResourceEquipment, EquipmentCategory, TermsOfUse, ResourceGroup
 from munigeo.models import Municipality
 
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached API responses would leak from one test to another
+    cache.clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -0,0 +1,47 @@
+import pytest
+
+from resources.cache import TERMS_OF_USE, get_catalog
+from resources.models import TermsOfUse
+
+
+@pytest.mark.django_db
+def test_catalog_is_reloaded_after_changes(terms_of_use, monkeypatch):
+    # keep the catalogs of the other tests intact
+    monkeypatch.setattr('resources.cache._catalogs', {})
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {x.id: x.name for x in TermsOfUse.objects.all()}
+
+    assert get_catalog(TERMS_OF_USE, load)[terms_of_use.id] == terms_of_use.name
+    get_catalog(TERMS_OF_USE, load)
+    assert len(loads) == 1
+
+    terms_of_use.name = 'changed'
+    terms_of_use.save()
+    assert get_catalog(TERMS_OF_USE, load)[terms_of_use.id] == 'changed'
+    assert len(loads) == 2
+
+    TermsOfUse.objects.create(name='new terms')
+    get_catalog(TERMS_OF_USE, load)
+    assert len(loads) == 3
+
+
+@pytest.mark.django_db
+def test_catalog_is_reloaded_after_max_age(terms_of_use, monkeypatch):
+    monkeypatch.setattr('resources.cache._catalogs', {})
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {x.id: x.name for x in TermsOfUse.objects.all()}
+
+    get_catalog(TERMS_OF_USE, load)
+    get_catalog(TERMS_OF_USE, load)
+    assert len(loads) == 1
+
+    # the version bump of another process is not seen with a local cache
+    monkeypatch.setattr('resources.cache.CATALOG_MAX_AGE', 0)
+    get_catalog(TERMS_OF_USE, load)
+    assert len(loads) == 2
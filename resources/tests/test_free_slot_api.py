@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+from django.urls import reverse
+
+from resources.models import Reservation, Resource
+
+
+@pytest.fixture
+def list_url():
+    return reverse('free_slot-list')
+
+
+@pytest.fixture
+def reserved_resource(resource_with_opening_hours, user):
+    Reservation.objects.create(
+        resource=resource_with_opening_hours,
+        begin='2115-04-04T10:00:00+03:00',
+        end='2115-04-04T11:00:00+03:00',
+        user=user,
+        state=Reservation.CONFIRMED,
+    )
+    return resource_with_opening_hours
+
+
+def get_slots(response):
+    assert response.status_code == 200, response.data
+    return [(slot['resource'], slot['begin'], slot['end']) for slot in response.data['results']]
+
+
+@pytest.mark.django_db
+def test_free_slots(api_client, list_url, reserved_resource, resource_in_unit2):
+    params = {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00', 'duration': 60}
+    response = api_client.get(list_url, params)
+    assert get_slots(response) == [
+        (reserved_resource.id, '2115-04-04T08:00:00+03:00', '2115-04-04T10:00:00+03:00'),
+        (reserved_resource.id, '2115-04-04T11:00:00+03:00', '2115-04-04T18:00:00+03:00'),
+    ]
+    assert response.data['count'] == 2
+
+    response = api_client.get(list_url, dict(params, duration=150))
+    assert get_slots(response) == []
+
+    response = api_client.get(list_url, dict(params, start_time='09:00', end_time='12:00', limit=1))
+    assert get_slots(response) == [
+        (reserved_resource.id, '2115-04-04T09:00:00+03:00', '2115-04-04T10:00:00+03:00'),
+    ]
+    assert response.data['count'] == 2
+
+    response = api_client.get(list_url, dict(params, unit=resource_in_unit2.unit.id))
+    assert get_slots(response) == []
+
+
+@pytest.mark.django_db
+def test_free_slots_follow_reservation_rules(api_client, list_url, reserved_resource):
+    params = {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00', 'duration': 45,
+              'start_time': '09:00', 'end_time': '12:00'}
+    Resource.objects.filter(id=reserved_resource.id).update(
+        slot_size=datetime.timedelta(minutes=45), min_period=datetime.timedelta(minutes=45)
+    )
+    # The slots start from the opening time at 08:00
+    response = api_client.get(list_url, params)
+    assert get_slots(response) == [
+        (reserved_resource.id, '2115-04-04T11:00:00+03:00', '2115-04-04T11:45:00+03:00'),
+    ]
+
+    Resource.objects.filter(id=reserved_resource.id).update(reservable_max_days_in_advance=10)
+    response = api_client.get(list_url, params)
+    assert get_slots(response) == []
+
+
+@pytest.mark.parametrize('params', (
+    {'duration': 60},
+    {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00'},
+    {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-06-04T00:00:00+03:00', 'duration': 60},
+    {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00', 'duration': 60, 'start_time': '9'},
+))
+@pytest.mark.django_db
+def test_free_slots_invalid_params(api_client, list_url, params):
+    response = api_client.get(list_url, params)
+    assert response.status_code == 400
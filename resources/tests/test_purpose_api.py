@@ -3,6 +3,8 @@ import pytest
 
 from django.urls import reverse
 
+from resources.models import Purpose
+
 from .utils import check_only_safe_methods_allowed
 
 
@@ -55,3 +57,27 @@ def test_non_public_purpose_visibility(api_client, purpose, user, list_url):
     resp = api_client.get(list_url)
     assert resp.status_code == 200
     assert resp.data['count'] == 1
+
+
+@pytest.mark.django_db
+def test_purpose_tree(api_client, staff_api_client):
+    url = reverse('purpose-tree')
+    sports = Purpose.objects.create(id='sports', name='Sports')
+    ball_games = Purpose.objects.create(id='ball-games', name='Ball games', parent=sports)
+    Purpose.objects.create(id='football', name='Football', parent=ball_games)
+    Purpose.objects.create(id='music', name='Music')
+
+    def get_ids(nodes):
+        return [(node['id'], get_ids(node['children'])) for node in nodes]
+
+    response = api_client.get(url)
+    assert response.status_code == 200
+    assert get_ids(response.data) == [('music', []), ('sports', [('ball-games', [('football', [])])])]
+
+    ball_games.public = False
+    ball_games.save()
+    response = api_client.get(url)
+    assert get_ids(response.data) == [('football', []), ('music', []), ('sports', [])]
+
+    response = staff_api_client.get(url)
+    assert get_ids(response.data) == [('music', []), ('sports', [('ball-games', [('football', [])])])]
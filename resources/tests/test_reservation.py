@@ -3,12 +3,15 @@ import pytest
 
 import arrow
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
 from django.utils.translation import activate
 from django.test import TestCase
 from django.utils import timezone
 from freezegun import freeze_time
 
+from resources.errors import ReservationCollision
 from resources.models import *
+from resources.models.outbox import OUTBOX_HANDLERS
 
 
 class ReservationTestCase(TestCase):
@@ -139,3 +142,93 @@ def test_invalid_reservation_duration_with_slot_size(resource_with_opening_hours
     with pytest.raises(ValidationError) as error:
         reservation.clean()
     assert error.value.code == 'invalid_time_slot'
+
+
+@pytest.mark.django_db
+def test_reservation_overlap_constraint(resource_in_unit, user, settings):
+    settings.RESPA_RESERVATION_OVERLAP_CONSTRAINT = True
+    call_command('reservation_overlap_constraint')
+    begin = datetime.datetime(2115, 6, 1, 8, 0, tzinfo=datetime.timezone.utc)
+    end = begin + datetime.timedelta(hours=2)
+
+    reservation = Reservation.objects.create(
+        resource=resource_in_unit, begin=begin, end=end, user=user, state=Reservation.CONFIRMED)
+    with pytest.raises(ReservationCollision):
+        Reservation.objects.create(
+            resource=resource_in_unit, begin=begin + datetime.timedelta(hours=1), end=end + datetime.timedelta(hours=1),
+            user=user, state=Reservation.CONFIRMED)
+
+    # The transaction goes on after the violation, and cancelled reservations do not count
+    Reservation.objects.create(resource=resource_in_unit, begin=end, end=end + datetime.timedelta(hours=1), user=user)
+    reservation.set_state(Reservation.CANCELLED, user)
+    Reservation.objects.create(
+        resource=resource_in_unit, begin=begin, end=end, user=user, state=Reservation.CONFIRMED)
+    with pytest.raises(ReservationCollision):
+        reservation.set_state(Reservation.CONFIRMED, user)
+
+    call_command('reservation_overlap_constraint', remove=True)
+
+
+@pytest.mark.django_db
+def test_reservation_overlaps(resource_in_unit, user):
+    begin = datetime.datetime(2115, 6, 1, 8, 0, tzinfo=datetime.timezone.utc)
+    end = begin + datetime.timedelta(hours=2)
+    reservation = Reservation.objects.create(resource=resource_in_unit, begin=begin, end=end, user=user)
+    hour = datetime.timedelta(hours=1)
+
+    assert list(Reservation.objects.overlaps(begin + hour, end + hour)) == [reservation]
+    assert not Reservation.objects.overlaps(end, end + hour).exists()
+    assert not Reservation.objects.overlaps(begin - hour, begin).exists()
+    assert not Reservation.objects.overlaps(end, None).exists()
+    # An inclusive range includes the reservations beginning at its end and ending at its beginning
+    assert list(Reservation.objects.overlaps(begin - hour, begin, inclusive=True)) == [reservation]
+    assert list(Reservation.objects.overlaps(None, begin, inclusive=True)) == [reservation]
+    assert list(Reservation.objects.overlaps(end, end + hour, inclusive=True)) == [reservation]
+    assert list(Reservation.objects.overlaps(end, None, inclusive=True)) == [reservation]
+    assert not Reservation.objects.overlaps(end + datetime.timedelta(microseconds=1), None, inclusive=True).exists()
+
+
+@pytest.mark.django_db
+def test_reservation_outbox_retries(resource_in_unit, user):
+    reservation = Reservation.objects.create(
+        resource=resource_in_unit, begin='2115-06-01T08:00:00+03:00', end='2115-06-01T09:00:00+03:00', user=user
+    )
+    message = ReservationOutboxMessage.objects.create(reservation=reservation, action='unknown_action')
+
+    call_command('dispatch_reservation_outbox')
+    message.refresh_from_db()
+    assert message.dispatched_at is None
+    assert message.attempts == 1
+    assert 'unknown_action' in message.last_error
+    assert message.next_attempt_at > timezone.now()
+
+    # The message is retried only after the delay
+    call_command('dispatch_reservation_outbox')
+    message.refresh_from_db()
+    assert message.attempts == 1
+
+
+@pytest.mark.django_db
+def test_reservation_outbox_order(resource_in_unit, user, monkeypatch):
+    reservation = Reservation.objects.create(
+        resource=resource_in_unit, begin='2115-06-01T08:00:00+03:00', end='2115-06-01T09:00:00+03:00', user=user
+    )
+    first = ReservationOutboxMessage.objects.create(reservation=reservation, action='first_action')
+    second = ReservationOutboxMessage.objects.create(reservation=reservation, action='second_action')
+    handled = []
+    monkeypatch.setitem(OUTBOX_HANDLERS, 'second_action', lambda res, user: handled.append('second_action'))
+
+    # The second message is held back until the first one has been dispatched
+    call_command('dispatch_reservation_outbox')
+    first.refresh_from_db()
+    second.refresh_from_db()
+    assert first.attempts == 1
+    assert first.dispatched_at is None
+    assert second.attempts == 0
+    assert handled == []
+
+    monkeypatch.setitem(OUTBOX_HANDLERS, 'first_action', lambda res, user: handled.append('first_action'))
+    ReservationOutboxMessage.objects.filter(id=first.id).update(next_attempt_at=timezone.now())
+    call_command('dispatch_reservation_outbox')
+    assert handled == ['first_action', 'second_action']
+    assert not ReservationOutboxMessage.objects.filter(dispatched_at__isnull=True).exists()
@@ -1,10 +1,13 @@
 import pytest
 import datetime
+import json
 import re
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.core import mail
-from django.test.utils import override_settings
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import dateparse, timezone, translation
 from guardian.shortcuts import assign_perm, remove_perm
 from freezegun import freeze_time
@@ -13,6 +16,7 @@ from parler.utils.context import switch_language
 
 from caterings.models import CateringOrder, CateringProvider
 
+from resources.api.reservation import ReservationViewSet
 from resources.enums import UnitAuthorizationLevel
 from resources.models import (Period, Day, Reservation, Resource, ResourceGroup, ReservationMetadataField,
                               ReservationMetadataSet, UnitAuthorization)
@@ -201,6 +205,26 @@ def test_authenticated_user_can_make_reservation(api_client, list_url, reservati
     assert reservation.end == dateparse.parse_datetime('2115-04-04T12:00:00+02:00')
 
 
+@pytest.mark.django_db
+def test_reservation_validation_queries(api_client, list_url, reservation_data, user):
+    """
+    Tests that the permissions and the opening hours are not queried separately for each check.
+    """
+    api_client.force_authenticate(user=user)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.post(list_url, data=reservation_data)
+    assert response.status_code == 201
+
+    def count_queries(table):
+        return len([query for query in queries.captured_queries if '"%s"' % table in query['sql']])
+
+    # Once for the serializer fields and once for the validation
+    assert count_queries('resources_userresourcepermission') <= 2
+    # Once for the validation and once for the free time of the resource
+    assert count_queries('resources_resourcedailyopeninghours') <= 2
+
+
 @pytest.mark.django_db
 def test_authenticated_user_can_modify_reservation(
         api_client, detail_url, reservation_data, resource_in_unit, user):
@@ -668,6 +692,12 @@ def test_reservation_time_filters(api_client, list_url, reservation, resource_in
     assert response.data['count'] == 2
     assert {reservation.id, reservation2.id}.issubset(set(res['id'] for res in response.data['results']))
 
+    # the reservations ending at start or beginning at end are included
+    response = api_client.get(list_url, {'start': '2115-04-04T10:00:00+02:00', 'end': '2115-04-04T11:00:00+02:00'})
+    assert [res['id'] for res in response.data['results']] == [reservation.id]
+    response = api_client.get(list_url, {'start': '2115-04-04T08:00:00+02:00', 'end': '2115-04-04T09:00:00+02:00'})
+    assert [res['id'] for res in response.data['results']] == [reservation.id]
+
 
 @pytest.mark.parametrize("input_hours,input_mins,expected", [
     (2, 30, '2 hours 30 minutes'),
@@ -1289,6 +1319,32 @@ def test_reservation_created_mail(user_api_client, list_url, reservation_data, u
     )
 
 
+@override_settings(RESPA_MAILS_ENABLED=True, RESPA_RESERVATION_OUTBOX=True)
+@pytest.mark.django_db
+def test_reservation_created_mail_through_outbox(
+        user_api_client, list_url, reservation_data, user, reservation_created_notification):
+    response = user_api_client.post(list_url, data=reservation_data, format='json')
+    assert response.status_code == 201
+    assert len(mail.outbox) == 0
+    reservation = Reservation.objects.get(pk=response.data['id'])
+    assert set(reservation.outbox_messages.values_list('action', flat=True)) == {
+        'reservation_confirmed', 'send_reservation_created_mail'
+    }
+
+    call_command('dispatch_reservation_outbox')
+    assert len(mail.outbox) == 1
+    check_received_mail_exists(
+        'Normal reservation created subject.',
+        user.email,
+        'Normal reservation created body.',
+    )
+    assert not reservation.outbox_messages.filter(dispatched_at__isnull=True).exists()
+
+    # Dispatched messages are not sent again
+    call_command('dispatch_reservation_outbox')
+    assert len(mail.outbox) == 0
+
+
 @override_settings(RESPA_MAILS_ENABLED=True)
 @pytest.mark.django_db
 def test_no_reservation_created_mail_for_staff_reservation(
@@ -1941,3 +1997,59 @@ def test_manager_can_make_staff_reservation(
     assert response.data.get('staff_event', False) is True
     reservation = Reservation.objects.get(id=response.data['id'])
     assert reservation.staff_event is True
+
+
+@pytest.mark.django_db
+def test_reservation_cursor_pagination(user_api_client, list_url, reservation, reservation2):
+    response = user_api_client.get(list_url, {'cursor': '', 'page_size': 1})
+    assert response.status_code == 200
+    assert 'count' not in response.data
+    assert [rv['id'] for rv in response.data['results']] == [reservation.id]
+    assert response.data['previous'] is None
+
+    response = user_api_client.get(response.data['next'])
+    assert response.status_code == 200
+    assert [rv['id'] for rv in response.data['results']] == [reservation2.id]
+    assert response.data['next'] is None
+
+
+@pytest.mark.django_db
+def test_reservation_field_selection(user_api_client, list_url, reservation):
+    response = user_api_client.get(list_url, {'fields': 'id,begin,is_own'})
+    assert response.status_code == 200
+    assert set(response.data['results'][0]) == {'id', 'begin', 'is_own'}
+
+    response = user_api_client.get(list_url, {'exclude': 'user_permissions,is_own'})
+    assert response.status_code == 200
+    data = response.data['results'][0]
+    assert data['id'] == reservation.id
+    for field_name in ('user_permissions', 'is_own'):
+        assert field_name not in data
+
+
+@pytest.mark.django_db
+def test_reservation_list_conditional_get(user_api_client, list_url, reservation):
+    response = user_api_client.get(list_url)
+    assert response.status_code == 200
+    etag = response['ETag']
+    assert response['Last-Modified']
+
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    reservation.event_subject = 'changed'
+    reservation.save()
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_reservation_list_stream(user_api_client, list_url, reservation, reservation2, monkeypatch):
+    monkeypatch.setattr(ReservationViewSet, 'stream_chunk_size', 1)
+    response = user_api_client.get(list_url, {'stream': 'true', 'page_size': 1000})
+    assert response.status_code == 200
+    data = json.loads(b''.join(response.streaming_content).decode('utf8'))
+    assert data['count'] == 2
+    assert [rv['id'] for rv in data['results']] == [reservation.id, reservation2.id]
+    assert data['results'][0]['user_permissions']['can_modify'] is True
@@ -0,0 +1,105 @@
+import pytest
+from django.core import mail
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import translation
+
+from notifications.models import NotificationTemplate, NotificationType
+from resources.enums import UnitAuthorizationLevel
+from resources.models import Reservation, UnitAuthorization
+
+
+@pytest.fixture
+def list_url():
+    return reverse('reservation_series-list')
+
+
+@pytest.mark.django_db
+@pytest.fixture
+def series_created_notification():
+    with translation.override('en'):
+        return NotificationTemplate.objects.create(
+            type=NotificationType.RESERVATION_SERIES_CREATED,
+            subject='Reservation series created subject.',
+            body='{% for res in reservations %}{{ res.time_range }}\n{% endfor %}',
+        )
+
+
+@pytest.fixture
+def series_data(resource_with_opening_hours, user):
+    return {
+        'reservation': {
+            'resource': resource_with_opening_hours.pk,
+            'begin': '2115-04-06T10:00:00+03:00',
+            'end': '2115-04-06T11:00:00+03:00',
+            'user': {'id': user.uuid},
+        },
+        'recurrence': {'frequency': 'weekly', 'count': 3},
+    }
+
+
+@pytest.mark.django_db
+def test_reservation_series_requires_manager(user_api_client, list_url, series_data):
+    response = user_api_client.post(list_url, data=series_data, format='json')
+    assert response.status_code == 403
+    assert not Reservation.objects.exists()
+
+
+@override_settings(RESPA_MAILS_ENABLED=True)
+@pytest.mark.django_db
+def test_reservation_series(staff_api_client, staff_user, user, list_url, series_data, resource_with_opening_hours,
+                            series_created_notification):
+    resource = resource_with_opening_hours
+    UnitAuthorization.objects.create(subject=resource.unit, level=UnitAuthorizationLevel.admin, authorized=staff_user)
+    Reservation.objects.create(
+        resource=resource, begin='2115-04-13T10:30:00+03:00', end='2115-04-13T11:30:00+03:00', user=staff_user,
+        state=Reservation.CONFIRMED,
+    )
+
+    response = staff_api_client.post(list_url, data=series_data, format='json')
+    assert response.status_code == 400
+    assert [conflict['begin'] for conflict in response.data['conflicts']] == ['2115-04-13T10:00:00+03:00']
+    assert Reservation.objects.count() == 1
+    assert len(mail.outbox) == 0
+
+    series_data['skip_conflicts'] = True
+    response = staff_api_client.post(list_url, data=series_data, format='json')
+    assert response.status_code == 201, response.data
+    assert [res['begin'] for res in response.data['reservations']] == [
+        '2115-04-06T10:00:00+03:00', '2115-04-20T10:00:00+03:00'
+    ]
+    assert len(response.data['conflicts']) == 1
+
+    created = Reservation.objects.filter(user=user)
+    assert created.count() == 2
+    assert all(res.state == Reservation.CONFIRMED and res.approver == staff_user for res in created)
+    assert not resource.free_time.filter(
+        free_between__overlap=('2115-04-20T10:00:00+03:00', '2115-04-20T11:00:00+03:00', '[)')
+    ).exists()
+
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].subject == 'Reservation series created subject.'
+    assert mail.outbox[0].to == [user.email]
+    assert len(mail.outbox[0].body.splitlines()) == 2
+
+
+@pytest.mark.django_db
+def test_reservation_series_occurrences(staff_api_client, staff_user, list_url, series_data,
+                                        resource_with_opening_hours):
+    UnitAuthorization.objects.create(
+        subject=resource_with_opening_hours.unit, level=UnitAuthorizationLevel.admin, authorized=staff_user
+    )
+    del series_data['recurrence']
+    series_data['occurrences'] = [
+        {'begin': '2115-04-07T10:00:00+03:00', 'end': '2115-04-07T12:00:00+03:00'},
+        {'begin': '2115-04-07T11:00:00+03:00', 'end': '2115-04-07T12:00:00+03:00'},
+        {'begin': '2115-04-08T10:00:00+03:00', 'end': '2115-04-08T10:00:00+03:00'},
+    ]
+    response = staff_api_client.post(list_url, data=series_data, format='json')
+    assert response.status_code == 400
+    assert 'occurrences' in response.data
+
+    del series_data['occurrences'][2]
+    response = staff_api_client.post(list_url, data=series_data, format='json')
+    assert response.status_code == 400
+    assert [conflict['begin'] for conflict in response.data['conflicts']] == ['2115-04-07T11:00:00+03:00']
@@ -3,12 +3,19 @@ from decimal import Decimal
 import pytest
 import datetime
 from django.core.files.base import ContentFile
+from django.core.management import call_command
 from django.core.exceptions import ValidationError
 from django.utils.translation import activate
+from easy_thumbnails.files import get_thumbnailer
+from guardian.shortcuts import assign_perm, remove_perm
 from PIL import Image
 
+from resources.enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
 from resources.errors import InvalidImage
-from resources.models import ResourceImage
+from resources.models import (
+    Day, Period, Reservation, Resource, ResourceImage, UnitGroup, UserResourcePermission
+)
+from resources.models.availability import get_free_intervals
 from resources.tests.utils import create_resource_image, get_test_image_data, get_field_errors
 
 
@@ -68,6 +75,49 @@ def test_image_transcoding_bypass(space_resource, format):
     assert ri.image.read() == data  # the bitstream is identical
 
 
+@pytest.mark.django_db
+def test_image_processing_later(space_resource, settings):
+    settings.RESPA_IMAGE_PROCESSING_ASYNC = True
+    settings.RESPA_IMAGE_VARIANT_SIZES = ["50x50"]
+    ri = ResourceImage(
+        resource=space_resource,
+        sort_order=8,
+        type="main",
+        image=ContentFile(get_test_image_data(format="BMP"), name="long_horse.bmp")
+    )
+    ri.full_clean()
+    ri.save()
+    assert ri.processing_pending
+    assert ri.image_format == "JPEG"
+    assert Image.open(ri.image).format == "BMP"  # Not transcoded yet
+    original_name = ri.image.name
+    original_hash = ri.image_hash
+
+    call_command('process_resource_images', verbosity=0)
+    ri = ResourceImage.objects.get(pk=ri.pk)
+    assert not ri.processing_pending
+    assert Image.open(ri.image).format == "JPEG"
+    assert ri.image.name != original_name
+    assert ri.image_hash != original_hash
+    assert get_thumbnailer(ri.image).get_existing_thumbnail({
+        'size': (50, 50), 'box': ri.cropping, 'crop': True, 'detail': True,
+    }) is not None
+
+
+@pytest.mark.django_db
+def test_invalid_image_processing_later(space_resource, settings):
+    settings.RESPA_IMAGE_PROCESSING_ASYNC = True
+    ri = ResourceImage(
+        resource=space_resource,
+        sort_order=8,
+        type="main",
+        image=ContentFile(b"this is text, not an image!", name="bogus.xyz")
+    )
+    # The header is still checked right away
+    with pytest.raises(InvalidImage):
+        ri.full_clean()
+
+
 @pytest.mark.django_db
 def test_invalid_image(space_resource):
     data = b"this is text, not an image!"
@@ -117,3 +167,182 @@ def test_time_slot_validations(resource_in_unit):
     resource_in_unit.min_period = datetime.timedelta(hours=2)
     resource_in_unit.slot_size = datetime.timedelta(minutes=30)
     resource_in_unit.full_clean()
+
+
+def _get_free_time(resource, date):
+    tz = resource.unit.get_tz()
+    begin = tz.localize(datetime.datetime.combine(date, datetime.time(0, 0)))
+    end = begin + datetime.timedelta(days=1)
+    free_time = resource.free_time.filter(free_between__overlap=(begin, end, '[)')).order_by('free_between')
+    return [
+        (ft.free_between.lower.astimezone(tz).time(), ft.free_between.upper.astimezone(tz).time())
+        for ft in free_time
+    ]
+
+
+@pytest.mark.django_db
+def test_free_time_follows_reservations(resource_with_opening_hours, user):
+    resource = resource_with_opening_hours
+    date = datetime.date(2115, 4, 8)
+    assert _get_free_time(resource, date) == [(datetime.time(8, 0), datetime.time(18, 0))]
+
+    reservation = Reservation.objects.create(
+        resource=resource,
+        begin='2115-04-08T10:00:00+03:00',
+        end='2115-04-08T11:00:00+03:00',
+        user=user,
+    )
+    assert _get_free_time(resource, date) == [
+        (datetime.time(8, 0), datetime.time(10, 0)),
+        (datetime.time(11, 0), datetime.time(18, 0)),
+    ]
+
+    reservation = Reservation.objects.get(id=reservation.id)
+    reservation.begin = reservation.begin + datetime.timedelta(days=1)
+    reservation.end = reservation.end + datetime.timedelta(days=1)
+    reservation.save()
+    assert _get_free_time(resource, date) == [(datetime.time(8, 0), datetime.time(18, 0))]
+    assert _get_free_time(resource, date + datetime.timedelta(days=1)) == [
+        (datetime.time(8, 0), datetime.time(10, 0)),
+        (datetime.time(11, 0), datetime.time(18, 0)),
+    ]
+
+    reservation.set_state(Reservation.CANCELLED, user)
+    assert _get_free_time(resource, date + datetime.timedelta(days=1)) == [
+        (datetime.time(8, 0), datetime.time(18, 0))
+    ]
+
+
+@pytest.mark.django_db
+def test_free_time_follows_reservations_moved_to_another_resource(resource_with_opening_hours, user):
+    resource = resource_with_opening_hours
+    other_resource = Resource.objects.create(
+        type=resource.type,
+        authentication='none',
+        name='other resource',
+        unit=resource.unit,
+        reservable=True,
+    )
+    period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31),
+                                   resource=other_resource, name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(18, 0))
+    other_resource.update_opening_hours()
+    date = datetime.date(2115, 4, 8)
+
+    reservation = Reservation.objects.create(
+        resource=resource,
+        begin='2115-04-08T10:00:00+03:00',
+        end='2115-04-08T11:00:00+03:00',
+        user=user,
+    )
+    reservation = Reservation.objects.get(id=reservation.id)
+    reservation.resource = other_resource
+    reservation.save()
+    assert _get_free_time(resource, date) == [(datetime.time(8, 0), datetime.time(18, 0))]
+    assert _get_free_time(other_resource, date) == [
+        (datetime.time(8, 0), datetime.time(10, 0)),
+        (datetime.time(11, 0), datetime.time(18, 0)),
+    ]
+
+
+def test_get_free_intervals():
+    def dt(hour):
+        return datetime.datetime(2115, 4, 8, hour)
+
+    open_intervals = [(dt(8), dt(16))]
+    reserved = [(dt(10), dt(11)), (dt(7), dt(9)), (dt(15), dt(17))]
+    assert get_free_intervals(open_intervals, reserved) == [(dt(9), dt(10)), (dt(11), dt(15))]
+    assert get_free_intervals(open_intervals, reserved, datetime.timedelta(hours=2)) == [(dt(11), dt(15))]
+    assert get_free_intervals(open_intervals, []) == open_intervals
+    assert get_free_intervals(open_intervals, [(dt(8), dt(16))]) == []
+
+
+def _get_user_permissions(user, resource):
+    qs = UserResourcePermission.objects.filter(user=user, resource=resource)
+    return set(qs.values_list('permission', flat=True))
+
+
+@pytest.mark.django_db
+def test_user_resource_permissions_follow_authorizations(resource_in_unit, user):
+    unit = resource_in_unit.unit
+    assert _get_user_permissions(user, resource_in_unit) == set()
+    assert not Resource.objects.modifiable_by(user).exists()
+
+    authorization = user.unit_authorizations.create(
+        level=UnitAuthorizationLevel.manager, subject=unit)
+    assert _get_user_permissions(user, resource_in_unit) == {'manager'}
+    assert list(Resource.objects.modifiable_by(user)) == [resource_in_unit]
+    assert resource_in_unit.is_manager(user) and not resource_in_unit.is_admin(user)
+
+    authorization.level = UnitAuthorizationLevel.admin
+    authorization.save()
+    assert _get_user_permissions(user, resource_in_unit) == {'admin', 'manager'}
+    assert resource_in_unit.is_admin(user)
+
+    authorization.delete()
+    assert _get_user_permissions(user, resource_in_unit) == set()
+
+    # Deleting the unit group removes the authorizations through it
+    unit_group = UnitGroup.objects.create(name='foo')
+    unit_group.members.add(unit)
+    user.unit_group_authorizations.create(
+        level=UnitGroupAuthorizationLevel.admin, subject=unit_group)
+    assert _get_user_permissions(user, resource_in_unit) == {'admin', 'manager'}
+    unit_group.delete()
+    assert _get_user_permissions(user, resource_in_unit) == set()
+
+
+@pytest.mark.django_db
+def test_user_resource_permissions_follow_object_permissions(resource_in_unit, resource_group, user, group):
+    assign_perm('unit:can_make_reservations', user, resource_in_unit.unit)
+    assert _get_user_permissions(user, resource_in_unit) == {'can_make_reservations'}
+    assert list(Resource.objects.with_perm('can_make_reservations', user)) == [resource_in_unit]
+    remove_perm('unit:can_make_reservations', user, resource_in_unit.unit)
+    assert _get_user_permissions(user, resource_in_unit) == set()
+
+    assign_perm('group:can_ignore_opening_hours', group, resource_group)
+    assert _get_user_permissions(user, resource_in_unit) == set()
+    user.groups.add(group)
+    assert _get_user_permissions(user, resource_in_unit) == {'can_ignore_opening_hours'}
+    assert resource_in_unit.can_ignore_opening_hours(user)
+
+    resource_group.resources.remove(resource_in_unit)
+    assert _get_user_permissions(user, resource_in_unit) == set()
+    resource_group.resources.add(resource_in_unit)
+    assert _get_user_permissions(user, resource_in_unit) == {'can_ignore_opening_hours'}
+    resource_group.delete()
+    assert _get_user_permissions(user, resource_in_unit) == set()
+
+
+@pytest.mark.django_db
+def test_user_resource_permissions_follow_moved_authorizations(resource_in_unit, resource_in_unit2, user,
+                                                               staff_user):
+    authorization = user.unit_authorizations.create(
+        level=UnitAuthorizationLevel.admin, subject=resource_in_unit.unit)
+    assert resource_in_unit.is_admin(user)
+
+    authorization.authorized = staff_user
+    authorization.save()
+    assert _get_user_permissions(user, resource_in_unit) == set()
+    assert not Resource.objects.modifiable_by(user).exists()
+    assert _get_user_permissions(staff_user, resource_in_unit) == {'admin', 'manager'}
+
+    authorization.subject = resource_in_unit2.unit
+    authorization.save()
+    assert _get_user_permissions(staff_user, resource_in_unit) == set()
+    assert _get_user_permissions(staff_user, resource_in_unit2) == {'admin', 'manager'}
+
+
+@pytest.mark.django_db
+def test_user_resource_permissions_follow_cleared_groups(resource_in_unit, resource_group, user, group):
+    assign_perm('group:can_ignore_opening_hours', group, resource_group)
+    user.groups.add(group)
+    assert _get_user_permissions(user, resource_in_unit) == {'can_ignore_opening_hours'}
+
+    group.user_set.clear()
+    assert _get_user_permissions(user, resource_in_unit) == set()
+    user.groups.add(group)
+
+    resource_group.resources.clear()
+    assert _get_user_permissions(user, resource_in_unit) == set()
@@ -1,4 +1,5 @@
 import datetime
+import json
 import pytest
 from copy import deepcopy
 from django.urls import reverse
@@ -7,8 +8,10 @@ from django.utils import timezone
 from freezegun import freeze_time
 from guardian.shortcuts import assign_perm, remove_perm
 from ..enums import UnitAuthorizationLevel, UnitGroupAuthorizationLevel
+from resources.api.resource import ResourceFilterBackend
+from resources.cache import RESOURCE_REPRESENTATION, bump_cache_version
 
-from resources.models import (Day, Equipment, Period, Reservation, ReservationMetadataSet, ResourceEquipment,
+from resources.models import (Day, Equipment, Period, Purpose, Reservation, ReservationMetadataSet, Resource, ResourceEquipment,
                               ResourceType, Unit, UnitAuthorization, UnitGroup)
 from .utils import assert_response_objects, check_only_safe_methods_allowed
 
@@ -241,6 +244,31 @@ def test_api_resource_geo_queries(api_client, resource_in_unit):
     assert results[0]['distance'] == 53907
 
 
+@pytest.mark.django_db
+def test_api_resource_geo_queries_follow_unit_location(api_client, resource_in_unit):
+    resource_in_unit.location = None
+    resource_in_unit.save()
+    unit = resource_in_unit.unit
+    unit.location = Point(24, 61, srid=4326)
+    unit.save()
+
+    url = reverse('resource-list') + '?lat=60&lon=24&distance=100000'
+    response = api_client.get(url)
+    assert response.data['count'] == 0
+
+    unit.location = Point(24, 60, srid=4326)
+    unit.save()
+    response = api_client.get(url)
+    assert response.data['count'] == 1
+    assert response.data['results'][0]['distance'] == 0
+
+    # The resource's own location takes precedence over the unit location
+    resource_in_unit.location = Point(24, 62, srid=4326)
+    resource_in_unit.save()
+    response = api_client.get(url)
+    assert response.data['count'] == 0
+
+
 @pytest.mark.django_db
 def test_resource_favorite(staff_api_client, staff_user, resource_in_unit):
     url = '%sfavorite/' % get_detail_url(resource_in_unit)
@@ -428,6 +456,13 @@ def test_include_unit_detail(api_client, resource_in_unit, list_url):
     assert response.status_code == 200
     assert response.json()['results'][0]['unit']['id'] == resource_in_unit.unit.id
 
+    # The opening hours of a range are only given by the unit endpoints
+    response = api_client.get(list_url, {
+        'include': 'unit_detail', 'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00'
+    })
+    assert response.status_code == 200
+    assert 'opening_hours' not in response.json()['results'][0]['unit']
+
 
 @pytest.mark.django_db
 def test_reservation_extra_fields(api_client, resource_in_unit):
@@ -937,3 +972,286 @@ def test_order_by_filter(list_url, api_client, resource_in_unit, resource_in_uni
     assert_response_objects(response, [resource_in_unit, resource_in_unit2])
     assert response.data['results'][1]['people_capacity'] == resource_in_unit.people_capacity
     assert response.data['results'][0]['people_capacity'] == resource_in_unit2.people_capacity
+
+
+@pytest.mark.django_db
+def test_opening_hours_with_units_in_different_time_zones(list_url, api_client, resource_in_unit,
+                                                          resource_in_unit2, test_unit2):
+    test_unit2.time_zone = 'Europe/Stockholm'
+    test_unit2.save()
+
+    for resource in (resource_in_unit, resource_in_unit2):
+        period = Period.objects.create(start=datetime.date(2115, 4, 1), end=datetime.date(2115, 4, 30),
+                                       resource=resource)
+        for weekday in range(0, 7):
+            Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0),
+                               closes=datetime.time(16, 0))
+        resource.update_opening_hours()
+
+    response = api_client.get(list_url, {'start': '2115-04-08T00:00:00Z', 'end': '2115-04-08T23:00:00Z'})
+    assert response.status_code == 200
+
+    opening_hours = {resource['id']: resource['opening_hours'] for resource in response.data['results']}
+    assert opening_hours[resource_in_unit.id][0]['opens'].isoformat() == '2115-04-08T08:00:00+03:00'
+    assert opening_hours[resource_in_unit2.id][0]['opens'].isoformat() == '2115-04-08T08:00:00+02:00'
+
+
+@pytest.mark.django_db
+def test_resource_reservations_time_range(api_client, resource_in_unit, user):
+    reservation = Reservation.objects.create(
+        resource=resource_in_unit, begin='2115-04-04T09:00:00+02:00', end='2115-04-04T10:00:00+02:00', user=user,
+        state=Reservation.CONFIRMED
+    )
+    # The reservations ending at start or beginning at end are included
+    for start, end in (('2115-04-04T10:00:00+02:00', '2115-04-04T11:00:00+02:00'),
+                       ('2115-04-04T08:00:00+02:00', '2115-04-04T09:00:00+02:00')):
+        response = api_client.get(get_detail_url(resource_in_unit), {'start': start, 'end': end})
+        assert response.status_code == 200
+        assert [res['id'] for res in response.data['reservations']] == [reservation.id]
+
+    response = api_client.get(get_detail_url(resource_in_unit), {
+        'start': '2115-04-04T10:00:00.000001+02:00', 'end': '2115-04-04T11:00:00+02:00'
+    })
+    assert response.data['reservations'] == []
+
+
+@pytest.mark.django_db
+def test_resource_cursor_pagination(list_url, api_client, resource_in_unit, resource_in_unit2):
+    resource_in_unit.name_fi = 'aaa'
+    resource_in_unit.save()
+    resource_in_unit2.name_fi = 'bbb'
+    resource_in_unit2.save()
+
+    response = api_client.get(list_url, {'cursor': '', 'page_size': 1})
+    assert response.status_code == 200
+    assert 'count' not in response.data
+    assert [resource['id'] for resource in response.data['results']] == [resource_in_unit.id]
+
+    response = api_client.get(response.data['next'])
+    assert response.status_code == 200
+    assert [resource['id'] for resource in response.data['results']] == [resource_in_unit2.id]
+    assert response.data['next'] is None
+
+
+@pytest.mark.django_db
+def test_static_representation_cache(api_client, staff_api_client, staff_user, resource_in_unit, detail_url):
+    response = api_client.get(detail_url)
+    assert response.status_code == 200
+    assert response.data['name']['fi'] == 'resource in unit'
+
+    # changes that bypass the model signals are noticed once the version is bumped
+    Resource.objects.filter(id=resource_in_unit.id).update(name_fi='updated')
+    bump_cache_version(RESOURCE_REPRESENTATION)
+    response = api_client.get(detail_url)
+    assert response.data['name']['fi'] == 'updated'
+
+    resource_in_unit.refresh_from_db()
+    resource_in_unit.name_fi = 'renamed'
+    resource_in_unit.save()
+    response = api_client.get(detail_url)
+    assert response.data['name']['fi'] == 'renamed'
+
+    resource_in_unit.generic_terms.text_fi = 'uudet käyttöehdot'
+    resource_in_unit.generic_terms.save()
+    response = api_client.get(detail_url)
+    assert response.data['generic_terms']['fi'] == 'uudet käyttöehdot'
+
+    # the user specific fields are not cached
+    staff_user.favorite_resources.add(resource_in_unit)
+    response = staff_api_client.get(detail_url)
+    assert response.data['is_favorite'] is True
+    response = api_client.get(detail_url)
+    assert response.data['is_favorite'] is False
+
+
+@pytest.mark.django_db
+def test_resource_field_selection(list_url, api_client, resource_in_unit, detail_url):
+    response = api_client.get(list_url, {'fields': 'id,name,unit'})
+    assert response.status_code == 200
+    assert set(response.data['results'][0]) == {'id', 'name', 'unit'}
+
+    response = api_client.get(detail_url, {'exclude': 'opening_hours,location,user_permissions'})
+    assert response.status_code == 200
+    assert response.data['id'] == resource_in_unit.id
+    for field_name in ('opening_hours', 'location', 'user_permissions'):
+        assert field_name not in response.data
+    assert 'unit' in response.data
+
+
+@pytest.mark.django_db
+def test_available_hours(api_client, resource_with_opening_hours, detail_url, user):
+    tz = timezone.get_current_timezone()
+    Reservation.objects.create(
+        resource=resource_with_opening_hours,
+        begin=tz.localize(datetime.datetime(2115, 4, 5, 10, 0)),
+        end=tz.localize(datetime.datetime(2115, 4, 5, 12, 0)),
+        user=user,
+    )
+
+    def get_available_hours(**params):
+        params.update(start='2115-04-05T00:00:00+03:00', end='2115-04-06T00:00:00+03:00')
+        response = api_client.get(detail_url, params)
+        assert response.status_code == 200
+        return [(x['starts'].hour, x['ends'].hour) for x in response.data['available_hours']]
+
+    assert get_available_hours() == [(8, 10), (12, 18)]
+    assert get_available_hours(duration=300) == [(12, 18)]
+    assert get_available_hours(during_closing='true') == [(0, 10), (12, 0)]
+
+    response = api_client.get(detail_url)
+    assert response.data['available_hours'] is None
+
+
+@pytest.mark.django_db
+def test_is_favorite_field_in_list(list_url, api_client, staff_api_client, staff_user, resource_in_unit,
+                                   resource_in_unit2):
+    staff_user.favorite_resources.add(resource_in_unit)
+
+    response = staff_api_client.get(list_url)
+    assert response.status_code == 200
+    is_favorite = {resource['id']: resource['is_favorite'] for resource in response.data['results']}
+    assert is_favorite == {resource_in_unit.id: True, resource_in_unit2.id: False}
+
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert not any(resource['is_favorite'] for resource in response.data['results'])
+
+
+@pytest.mark.django_db
+def test_search_filter(list_url, api_client, resource_in_unit, resource_in_unit2, test_unit2):
+    resource_in_unit.name_en = 'Meeting room'
+    resource_in_unit.save()
+    resource_in_unit2.name_en = 'Studio'
+    resource_in_unit2.description_en = 'Also suitable for meetings'
+    resource_in_unit2.save()
+
+    def search(value):
+        response = api_client.get(list_url, {'search': value})
+        assert response.status_code == 200
+        return [resource['id'] for resource in response.data['results']]
+
+    # the name weighs more than the description
+    assert search('meeting') == [resource_in_unit.id, resource_in_unit2.id]
+    assert search('meeting rooms') == [resource_in_unit.id]
+    assert search('stud') == [resource_in_unit2.id]
+    assert search('xyzzy') == []
+
+    test_unit2.name_en = 'Central library'
+    test_unit2.save()
+    assert search('library') == [resource_in_unit2.id]
+
+
+@pytest.mark.django_db
+def test_resource_list_conditional_get(api_client, list_url, resource_in_unit, resource_in_unit2):
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    etag = response['ETag']
+
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response['ETag'] == etag
+
+    # A different query is a different list
+    response = api_client.get(list_url, {'unit': resource_in_unit.unit.id}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    resource_in_unit.name_fi = 'muutettu'
+    resource_in_unit.save()
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response['ETag'] != etag
+
+    etag = response['ETag']
+    resource_in_unit2.delete()
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data['count'] == 1
+
+
+@pytest.mark.django_db
+def test_resource_list_conditional_get_depends_on_user(api_client, user_api_client, user, list_url, resource_in_unit):
+    etag = api_client.get(list_url)['ETag']
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+    etag = response['ETag']
+    user.favorite_resources.add(resource_in_unit)
+    response = user_api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.data['results'][0]['is_favorite'] is True
+
+
+@pytest.mark.django_db
+def test_resource_list_conditional_get_filters_once(api_client, list_url, resource_in_unit, monkeypatch):
+    calls = []
+    filter_queryset = ResourceFilterBackend.filter_queryset
+
+    def counting_filter_queryset(self, *args):
+        calls.append(1)
+        return filter_queryset(self, *args)
+
+    monkeypatch.setattr(ResourceFilterBackend, 'filter_queryset', counting_filter_queryset)
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert response.data['count'] == 1
+    assert len(calls) == 1
+
+
+@pytest.mark.django_db
+def test_resource_caches_need_shared_cache(api_client, list_url, detail_url, resource_in_unit, settings):
+    settings.RESPA_LOCAL_CACHE_SHARED = False
+    response = api_client.get(list_url)
+    assert response.status_code == 200
+    assert 'ETag' not in response
+
+    api_client.get(detail_url)
+    # the version bump of another process would not be seen
+    Resource.objects.filter(id=resource_in_unit.id).update(name_fi='updated')
+    response = api_client.get(detail_url)
+    assert response.data['name']['fi'] == 'updated'
+
+
+@pytest.mark.django_db
+def test_resource_list_stream(api_client, list_url, resource_in_unit, resource_in_unit2, resource_in_unit3):
+    expected = api_client.get(list_url, {'page_size': 2}).data
+
+    response = api_client.get(list_url, {'stream': 'true', 'page_size': 2})
+    assert response.status_code == 200
+    assert response.streaming
+    data = json.loads(b''.join(response.streaming_content).decode('utf8'))
+    assert data['count'] == 3
+    assert data['next'] == expected['next']
+    assert [res['id'] for res in data['results']] == [res['id'] for res in expected['results']]
+    assert data['results'][0]['name'] == expected['results'][0]['name']
+
+    response = api_client.get(list_url, {'stream': 'true', 'resource_group': 'nonexistent'})
+    data = json.loads(b''.join(response.streaming_content).decode('utf8'))
+    assert data['count'] == 0
+    assert data['results'] == []
+
+
+@pytest.mark.django_db
+def test_purpose_filter_matches_descendants(
+        api_client, list_url, resource_in_unit, resource_in_unit2, resource_in_unit3):
+    sports = Purpose.objects.create(id='sports', name='Sports')
+    ball_games = Purpose.objects.create(id='ball-games', name='Ball games', parent=sports)
+    football = Purpose.objects.create(id='football', name='Football', parent=ball_games)
+    resource_in_unit.purposes.set([sports])
+    resource_in_unit2.purposes.set([football])
+    resource_in_unit3.purposes.set([ball_games])
+
+    response = api_client.get(list_url, {'purpose': 'sports'})
+    assert response.status_code == 200
+    assert_response_objects(response, (resource_in_unit, resource_in_unit2, resource_in_unit3))
+
+    response = api_client.get(list_url, {'purpose': 'BALL-GAMES'})
+    assert_response_objects(response, (resource_in_unit2, resource_in_unit3))
+
+    football.parent = None
+    football.save()
+    response = api_client.get(list_url, {'purpose': 'sports'})
+    assert_response_objects(response, (resource_in_unit, resource_in_unit3))
+
+    ball_games.delete()
+    response = api_client.get(list_url, {'purpose': 'sports'})
+    assert_response_objects(response, resource_in_unit)
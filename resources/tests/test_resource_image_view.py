@@ -2,6 +2,7 @@
 import pytest
 from django.urls import reverse
 from django.utils.six import BytesIO
+from easy_thumbnails.files import get_thumbnailer
 from PIL import Image
 
 from resources.tests.utils import create_resource_image
@@ -31,6 +32,62 @@ def test_resource_image_view_thumbing(client, space_resource):
     assert client.get(reverse("resource-image-view", kwargs={"pk": png.pk}), data={"dim": "-x3"}).status_code == 400
 
 
+@pytest.mark.django_db
+def test_resource_image_view_caching(client, space_resource):
+    image = create_resource_image(space_resource, size=(300, 300), format="PNG")
+    assert image.image_hash
+    url = reverse("resource-image-view", kwargs={"pk": image.pk})
+    assert image.get_url() == "%s?v=%s" % (url, image.get_version())
+
+    resp = client.get(image.get_url())
+    assert resp.status_code == 200
+    assert "immutable" in resp["Cache-Control"]
+    etag = resp["ETag"]
+
+    resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 304
+    assert "immutable" not in resp["Cache-Control"]
+
+    # Variants have their own tags
+    resp = client.get(url, data={"dim": "50x50"}, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp["ETag"] != etag
+
+    # Changing the cropping changes the version
+    version = image.get_version()
+    image.cropping = "0,0,100,100"
+    image.save()
+    assert image.get_version() != version
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_resource_image_view_sendfile(client, space_resource, settings):
+    image = create_resource_image(space_resource, size=(300, 300), format="PNG")
+    url = reverse("resource-image-view", kwargs={"pk": image.pk})
+
+    settings.RESPA_IMAGE_SENDFILE_HEADER = "X-Accel-Redirect"
+    settings.RESPA_IMAGE_SENDFILE_URL = "/protected-media/"
+    resp = client.get(url)
+    assert resp["X-Accel-Redirect"] == "/protected-media/" + image.image.name
+    assert resp["Content-Type"] == "image/png"
+    assert not resp.content
+
+    settings.RESPA_IMAGE_SENDFILE_HEADER = "X-Sendfile"
+    resp = client.get(url, data={"dim": "50x50"})
+    assert resp["X-Sendfile"] == image.get_variant(50, 50).path
+
+
+@pytest.mark.django_db
+def test_resource_image_variants_generated_on_save(space_resource, settings):
+    settings.RESPA_IMAGE_VARIANT_SIZES = ["50x50"]
+    image = create_resource_image(space_resource, size=(300, 300), format="PNG")
+    thumbnail = get_thumbnailer(image.image).get_existing_thumbnail({
+        'size': (50, 50), 'box': image.cropping, 'crop': True, 'detail': True,
+    })
+    assert thumbnail is not None
+
+
 def test_dimension_string_parsing():
     with pytest.raises(ValueError):
         parse_dimension_string("3x8x2")
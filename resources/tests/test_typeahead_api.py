@@ -2,6 +2,8 @@
 import json
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.crypto import get_random_string
 from django.utils.encoding import force_text
 
@@ -89,3 +91,25 @@ def test_typeahead_api_full_response(rf, typeahead_test_objects, typeahead_view)
     # Check that we get more data than with the non-full mode for resources:
     assert all(key in response_data["resource"][0] for key in ("id", "type", "name", "unit"))
     assert all(key in response_data["unit"][0] for key in ("id", "time_zone", "name", "phone"))
+
+
+@pytest.mark.django_db
+def test_typeahead_api_ordering_and_caching(rf, typeahead_test_objects, typeahead_view, space_resource_type):
+    unit = typeahead_test_objects["unit"]
+    sauna = typeahead_test_objects["sauna"]
+    other_sauna = Resource.objects.create(
+        unit=unit, type=space_resource_type, authentication="none", name="Testiyksikön toinen sauna"
+    )
+
+    # The closest match comes first
+    response = typeahead_view(request=rf.get("/", {"input": "testiyksikön sauna", "types": "resource"}))
+    response.render()
+    response_data = json.loads(force_text(response.content))
+    assert [obj["id"] for obj in response_data["resource"]] == [sauna.id, other_sauna.id]
+
+    # The suggestions are cached for a while, so repeating the query needs no database queries
+    with CaptureQueriesContext(connection) as queries:
+        response = typeahead_view(request=rf.get("/", {"input": "testiyksikön sauna", "types": "resource"}))
+    response.render()
+    assert json.loads(force_text(response.content)) == response_data
+    assert len(queries) == 0
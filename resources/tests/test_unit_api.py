@@ -2,11 +2,13 @@
 import datetime
 import pytest
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from freezegun import freeze_time
 
-from resources.models import Resource, ResourceGroup
+from resources.models import Day, Period, Resource, ResourceGroup, Unit
 from .utils import assert_response_objects, check_only_safe_methods_allowed
 
 
@@ -94,4 +96,67 @@ def test_unit_has_resource_filter(api_client, test_unit,
 
     response = api_client.get(list_url + '?' + 'unit_has_resource=False')
     assert response.status_code == 200
-    assert_response_objects(response, (test_unit))
\ No newline at end of file
+    assert_response_objects(response, (test_unit))
+
+
+@pytest.mark.django_db
+def test_unit_list_conditional_get(api_client, test_unit, list_url):
+    etag = api_client.get(list_url)['ETag']
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    test_unit.name_fi = 'muutettu'
+    test_unit.save()
+    response = api_client.get(list_url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+
+def _create_unit_opening_hours(unit):
+    period = Period.objects.create(start=datetime.date(2115, 1, 1), end=datetime.date(2115, 12, 31), unit=unit,
+                                   name='regular hours')
+    for weekday in range(0, 7):
+        Day.objects.create(period=period, weekday=weekday, opens=datetime.time(8, 0), closes=datetime.time(16, 0))
+
+
+@pytest.mark.django_db
+def test_unit_opening_hours(api_client, test_unit, detail_url):
+    _create_unit_opening_hours(test_unit)
+
+    with freeze_time('2115-04-04T09:00:00+03:00'):
+        response = api_client.get(detail_url)
+    assert response.status_code == 200
+    assert response.data['opening_hours_today'] == {
+        '2115-04-04': [{'opens': '2115-04-04T08:00:00+03:00', 'closes': '2115-04-04T16:00:00+03:00'}]
+    }
+    assert 'opening_hours' not in response.data
+
+    response = api_client.get(detail_url, {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-05T00:00:00+03:00'})
+    assert response.status_code == 200
+    assert response.data['opening_hours'] == [
+        {'date': '2115-04-04', 'opens': '2115-04-04T08:00:00+03:00', 'closes': '2115-04-04T16:00:00+03:00'},
+        {'date': '2115-04-05', 'opens': '2115-04-05T08:00:00+03:00', 'closes': '2115-04-05T16:00:00+03:00'},
+    ]
+
+    response = api_client.get(detail_url, {'start': '2116-04-04T00:00:00+03:00', 'end': '2116-04-04T00:00:00+03:00'})
+    assert response.data['opening_hours'] == [{'date': '2116-04-04', 'opens': None, 'closes': None}]
+
+
+@pytest.mark.django_db
+def test_unit_list_opening_hours_queries(api_client, list_url, test_unit):
+    """
+    Tests that the opening hours of a page of units are loaded with a constant number of queries.
+    """
+    params = {'start': '2115-04-04T00:00:00+03:00', 'end': '2115-04-10T00:00:00+03:00'}
+    _create_unit_opening_hours(test_unit)
+    with CaptureQueriesContext(connection) as one_unit_queries:
+        response = api_client.get(list_url, params)
+    assert response.status_code == 200
+
+    for i in range(5):
+        _create_unit_opening_hours(Unit.objects.create(name='unit %d' % i, time_zone='Europe/Helsinki'))
+    with CaptureQueriesContext(connection) as many_units_queries:
+        response = api_client.get(list_url, params)
+    assert response.status_code == 200
+    assert len(response.data['results']) == 6
+    assert all(len(unit['opening_hours']) == 7 for unit in response.data['results'])
+    assert len(many_units_queries) == len(one_unit_queries)
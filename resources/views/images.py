@@ -1,12 +1,20 @@
 import os
 from mimetypes import guess_type
+from urllib.parse import quote
 
-from django.http.response import FileResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.http.response import FileResponse, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.views.generic import DetailView
-from easy_thumbnails.files import get_thumbnailer
 
 from resources.models import ResourceImage
 
+# How long the images are cached when the URL does not contain the current version
+IMAGE_MAX_AGE = 60 * 60
+# Versioned URLs change with the image, so they can be cached for good
+VERSIONED_IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
 
 def parse_dimension_string(dim):
     """
@@ -33,6 +41,13 @@ def parse_dimension_string(dim):
 
 
 class ResourceImageView(DetailView):
+    """
+    Serves a resource image or a variant of it scaled to the size given in `dim`
+
+    With the RESPA_IMAGE_SENDFILE_HEADER setting the file is left for the
+    web server to send: with X-Accel-Redirect the location is the file name
+    under RESPA_IMAGE_SENDFILE_URL, with X-Sendfile the path of the file.
+    """
     model = ResourceImage
 
     def get(self, request, *args, **kwargs):
@@ -47,20 +62,38 @@ class ResourceImageView(DetailView):
         else:
             width = height = None
 
-        if not width:
-            out_image = image.image
-            filename = image.image.name
+        version = image.get_version()
+        etag = quote_etag('%s-%s' % (version, dim or 'original')) if version else None
+        resp = get_conditional_response(request, etag=etag)
+        if resp is None:
+            if not width:
+                out_image = image.image
+                filename = image.image.name
+            else:
+                out_image = image.get_variant(width, height)
+                filename = "%s-%dx%d%s" % (image.image.name, width, height, os.path.splitext(out_image.name)[1])
+            resp = self.get_file_response(out_image, filename)
+
+        if etag:
+            resp['ETag'] = etag
+        if version and request.GET.get('v') == version:
+            patch_cache_control(resp, public=True, max_age=VERSIONED_IMAGE_MAX_AGE, immutable=True)
         else:
-            out_image = get_thumbnailer(image.image).get_thumbnail({
-                'size': (width, height),
-                'box': image.cropping,
-                'crop': True,
-                'detail': True,
-            })
-            filename = "%s-%dx%d%s" % (image.image.name, width, height, os.path.splitext(out_image.name)[1])
+            patch_cache_control(resp, public=True, max_age=IMAGE_MAX_AGE)
+        return resp
 
-        # FIXME: Use SendFile headers instead of Django output when not in debug mode
-        out_image.seek(0)
-        resp = FileResponse(out_image, content_type=guess_type(filename, False)[0])
+    def get_file_response(self, out_image, filename):
+        content_type = guess_type(filename, False)[0]
+        sendfile_header = getattr(settings, 'RESPA_IMAGE_SENDFILE_HEADER', None)
+        if sendfile_header == 'X-Accel-Redirect':
+            resp = HttpResponse(content_type=content_type)
+            base_url = getattr(settings, 'RESPA_IMAGE_SENDFILE_URL', None) or settings.MEDIA_URL
+            resp[sendfile_header] = quote(base_url.rstrip('/') + '/' + out_image.name)
+        elif sendfile_header == 'X-Sendfile':
+            resp = HttpResponse(content_type=content_type)
+            resp[sendfile_header] = out_image.storage.path(out_image.name)
+        else:
+            out_image.seek(0)
+            resp = FileResponse(out_image, content_type=content_type)
         resp["Content-Disposition"] = "attachment; filename=%s" % os.path.basename(filename)
         return resp
@@ -17,6 +17,7 @@ env = environ.Env(
     ALLOWED_HOSTS=(list, []),
     ADMINS=(list, []),
     DATABASE_URL=(str, 'postgis:///respa'),
+    CACHE_URL=(str, 'locmemcache://'),
     SECURE_PROXY_SSL_HEADER=(tuple, None),
     TOKEN_AUTH_ACCEPTED_AUDIENCE=(str, ''),
     TOKEN_AUTH_SHARED_SECRET=(str, ''),
@@ -34,6 +35,12 @@ env = environ.Env(
     MAIL_MAILGUN_DOMAIN=(str, ''),
     MAIL_MAILGUN_API=(str, ''),
     RESPA_IMAGE_BASE_URL=(str, ''),
+    RESPA_IMAGE_VARIANT_SIZES=(list, []),
+    RESPA_IMAGE_SENDFILE_HEADER=(str, ''),
+    RESPA_IMAGE_SENDFILE_URL=(str, ''),
+    RESPA_IMAGE_PROCESSING_ASYNC=(bool, False),
+    RESPA_RESERVATION_OVERLAP_CONSTRAINT=(bool, False),
+    RESPA_RESERVATION_OUTBOX=(bool, False),
     ACCESSIBILITY_API_BASE_URL=(str, 'https://asiointi.hel.fi/kapaesteettomyys/'),
     ACCESSIBILITY_API_SYSTEM_ID=(str, ''),
     ACCESSIBILITY_API_SECRET=(str, ''),
@@ -47,6 +54,15 @@ environ.Env.read_env()
 # reservation confirmation emails use this
 RESPA_IMAGE_BASE_URL = env('RESPA_IMAGE_BASE_URL')
 
+# sizes of the image variants generated when a resource image is saved, e.g. 250x250
+RESPA_IMAGE_VARIANT_SIZES = env('RESPA_IMAGE_VARIANT_SIZES')
+# X-Accel-Redirect or X-Sendfile, if the web server should send the image files
+RESPA_IMAGE_SENDFILE_HEADER = env('RESPA_IMAGE_SENDFILE_HEADER')
+# the internal location of the media files for X-Accel-Redirect, MEDIA_URL by default
+RESPA_IMAGE_SENDFILE_URL = env('RESPA_IMAGE_SENDFILE_URL')
+# if on, uploaded images are processed later by the process_resource_images command
+RESPA_IMAGE_PROCESSING_ASYNC = env('RESPA_IMAGE_PROCESSING_ASYNC')
+
 BASE_DIR = root()
 
 DEBUG_TOOLBAR_CONFIG = {
@@ -62,6 +78,13 @@ DATABASES = {
 }
 DATABASES['default']['ATOMIC_REQUESTS'] = True
 
+CACHES = {
+    'default': env.cache()
+}
+# The local memory cache is only used for the values invalidated by other
+# processes when it is known that there are no other processes
+RESPA_LOCAL_CACHE_SHARED = False
+
 SECURE_PROXY_SSL_HEADER = env('SECURE_PROXY_SSL_HEADER')
 
 SITE_ID = 1
@@ -277,6 +300,12 @@ RESPA_DOCX_TEMPLATE = os.path.join(BASE_DIR, 'reports', 'data', 'default.docx')
 
 RESPA_ADMIN_VIEW_RESOURCE_URL = env('RESPA_ADMIN_VIEW_RESOURCE_URL')
 
+# Rely on the constraint added by the reservation_overlap_constraint command
+# instead of locking the resource when reservations are saved
+RESPA_RESERVATION_OVERLAP_CONSTRAINT = env('RESPA_RESERVATION_OVERLAP_CONSTRAINT')
+# if on, reservation mails and signals are sent later by the dispatch_reservation_outbox command
+RESPA_RESERVATION_OUTBOX = env('RESPA_RESERVATION_OUTBOX')
+
 RESPA_ADMIN_ACCESSIBILITY_API_BASE_URL = env('ACCESSIBILITY_API_BASE_URL')
 RESPA_ADMIN_ACCESSIBILITY_API_SYSTEM_ID = env('ACCESSIBILITY_API_SYSTEM_ID')
 RESPA_ADMIN_ACCESSIBILITY_API_SECRET = env('ACCESSIBILITY_API_SECRET')
@@ -3,3 +3,5 @@ from .settings import *
 
 RESPA_CATERINGS_ENABLED = True
 RESPA_COMMENTS_ENABLED = True
+# The tests are run in a single process
+RESPA_LOCAL_CACHE_SHARED = True
@@ -9,8 +9,15 @@ class RespaExchangeAppConfig(AppConfig):
     def ready(self):
         """
         Wire up the signals for uploading reservations.
+
+        Deleted reservations are removed from Exchange right away, since
+        the outbox messages are deleted along with the reservation.
         """
-        from respa_exchange.signals import handle_reservation_delete, handle_reservation_save
+        from resources.models.outbox import register_outbox_handler
+        from respa_exchange.signals import (
+            EXCHANGE_SYNC_ACTION, handle_reservation_delete, handle_reservation_save, sync_reservation_to_exchange
+        )
+        register_outbox_handler(EXCHANGE_SYNC_ACTION, sync_reservation_to_exchange)
         post_save.connect(
             handle_reservation_save,
             sender='resources.Reservation',
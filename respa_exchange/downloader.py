@@ -9,6 +9,7 @@ from lxml import etree
 from django.db.transaction import atomic
 from django.utils.timezone import now
 
+from resources.errors import ReservationCollision
 from resources.models.reservation import Reservation
 from respa_exchange.ews.calendar import GetCalendarItemsRequest, FindCalendarItemsRequest
 from respa_exchange.ews.user import ResolveNamesRequest
@@ -49,7 +50,12 @@ def _populate_reservation(reservation, ex_resource, item_props):
 def _update_reservation_from_exchange(item_id, ex_reservation, ex_resource, item_props):
     reservation = ex_reservation.reservation
     _populate_reservation(reservation, ex_resource, item_props)
-    reservation.save()
+    try:
+        reservation.save()
+    except ReservationCollision:
+        # Only with the overlap constraint on; the update is tried again on the next sync
+        log.warning("Not updated, overlaps another reservation: %s", ex_reservation)
+        return
     ex_reservation.item_id = item_id
     ex_reservation.organizer = item_props.get("organizer")
     ex_reservation.save()
@@ -60,7 +66,12 @@ def _update_reservation_from_exchange(item_id, ex_reservation, ex_resource, item
 def _create_reservation_from_exchange(item_id, ex_resource, item_props):
     reservation = Reservation(resource=ex_resource.resource)
     _populate_reservation(reservation, ex_resource, item_props)
-    reservation.save()
+    try:
+        reservation.save()
+    except ReservationCollision:
+        # Only with the overlap constraint on; the creation is tried again on the next sync
+        log.warning("Not created, overlaps another reservation: %s", item_id)
+        return None
     ex_reservation = ExchangeReservation(
         exchange=ex_resource.exchange,
         principal_email=ex_resource.principal_email,
@@ -1,13 +1,19 @@
 from django.conf import settings
 
+from resources.models.outbox import is_outbox_enabled, queue_or_run
 from respa_exchange.models import ExchangeReservation, ExchangeResource
 from respa_exchange.uploader import create_on_remote, delete_on_remote, update_on_remote
 
+# The name of the outbox action that syncs a reservation to Exchange
+EXCHANGE_SYNC_ACTION = 'respa_exchange_sync'
+
 
 def handle_reservation_save(instance, **kwargs):
     """
     Django signal handler for updating changed/created reservations on remote Exchanges.
 
+    With the reservation outbox enabled, the update is only queued.
+
     :param instance: A Reservation instance
     :type instance: resources.models.Reservation
     :param kwargs: The rest of the signal args
@@ -21,6 +27,24 @@ def handle_reservation_save(instance, **kwargs):
         # we don't want to push it back up!
         return
 
+    if is_outbox_enabled():
+        is_synced = (
+            ExchangeResource.objects.filter(sync_from_respa=True, resource=instance.resource_id).exists() or
+            ExchangeReservation.objects.filter(reservation=instance, managed_in_exchange=False).exists()
+        )
+        if is_synced:
+            queue_or_run(instance, EXCHANGE_SYNC_ACTION)
+        return
+
+    sync_reservation_to_exchange(instance)
+
+
+def sync_reservation_to_exchange(instance, user=None):
+    """
+    Create or update the reservation on the remote Exchange of its resource
+
+    :type instance: resources.models.Reservation
+    """
     exchange_reservation = ExchangeReservation.objects.filter(
         reservation=instance,
         # If this reservation has come from Exchange,
@@ -1,9 +1,11 @@
 from datetime import timedelta
 
 import pytest
+from django.core.management import call_command
 from django.utils.crypto import get_random_string
 from django.utils.timezone import now
 
+from resources.models import Reservation
 from respa_exchange.downloader import sync_from_exchange
 from respa_exchange.ews.objs import ItemID
 from respa_exchange.models import ExchangeReservation, ExchangeResource
@@ -74,6 +76,37 @@ def test_download(
     assert ex_resource.reservations.count() == 1
 
 
+@pytest.mark.django_db
+def test_download_overlapping(settings, space_resource, exchange):
+    """
+    Tests that with the overlap constraint on, the events overlapping reservations are skipped.
+    """
+    settings.RESPA_RESERVATION_OVERLAP_CONSTRAINT = True
+    call_command('reservation_overlap_constraint')
+    email = "%s@example.com" % get_random_string()
+    item_dict = _generate_item_dict()
+    delegate = FindItemsHandler()
+    delegate.add_item(email, item_dict)
+    SoapSeller.wire(settings, delegate)
+    ex_resource = ExchangeResource.objects.create(
+        resource=space_resource,
+        principal_email=email,
+        exchange=exchange,
+        sync_to_respa=True
+    )
+    reservation = Reservation.objects.create(resource=space_resource, begin=item_dict['start'], end=item_dict['end'])
+
+    sync_from_exchange(ex_resource)
+    assert ex_resource.reservations.count() == 0
+
+    reservation.delete()
+    sync_from_exchange(ex_resource)
+    assert ex_resource.reservations.count() == 1
+    _check_imported_reservation(item_dict['id'], item_dict)
+
+    call_command('reservation_overlap_constraint', remove=True)
+
+
 def _check_imported_reservation(item_id, item_dict):
     ex = ExchangeReservation.objects.filter(item_id_hash=item_id.hash).first()
     assert moments_close_enough(ex.reservation.begin, item_dict['start'])